@@ -0,0 +1,225 @@
+"""Benchmarks of scoring, cache I/O, export and chart rendering on synthetic BCH reports."""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+import maintainability.better_code_hub as bch
+from maintainability.cache import SEGMENTS_EXTENSION
+from maintainability.fake_services import generate_report
+from maintainability.merge_cache import merge_cache
+from maintainability.score_table import get_score_table_path
+from maintainability.projection import get_projection_path
+import report
+import stats.chart as chart
+import stats.enum as enum
+import stats.tests as tests
+
+ERROR_RATE = 0.02
+LANGUAGES = ['java', 'py', 'php', 'c', 'rb', 'js', 'xml']
+CWES = ['CWE-79', 'CWE-22', 'CWE-89', 'CWE-400', 'CWE-190', 'CWE-611', 'NVD-CWE-Other']
+CACHE_FORMATS = {'json': '.json', 'zip': '.zip', 'seg': SEGMENTS_EXTENSION}
+
+def generate_dataset(reports, seed=0):
+    """Dataset of fixes and their parents with a cache of their random reports."""
+    rng = np.random.default_rng(seed)
+    rows = max(1, reports // 2)
+    shas = ['{:040x}'.format(n) for n in range(2 * rows)]
+    df = pd.DataFrame({
+        'owner': ['owner{}'.format(n % 97) for n in range(rows)],
+        'project': ['project{}'.format(n % 389) for n in range(rows)],
+        'sha': shas[0::2], 'sha-p': shas[1::2],
+        'Language': rng.choice(LANGUAGES, rows),
+        'Severity': rng.choice(enum.severity, rows),
+        'CWE': rng.choice(CWES, rows),
+    })
+    data = {}
+    for owner, project, sha, sha_p in zip(df['owner'], df['project'], df['sha'], df['sha-p']):
+        for commit in (sha, sha_p):
+            key = bch.BCHCache.get_commit_analysis_storage_key(owner, project, commit)
+            error = rng.random() < ERROR_RATE
+            data[key] = {'error': 'Synthetic analysis error.'} if error \
+                else generate_report(rng, commit)
+    return df, data
+
+def write_cache(path, data):
+    cache = bch.BCHCache(path)
+    cache.set_data(data)
+    cache.save_data()
+    return cache
+
+def load_cache(path):
+    """Read every report of a cache."""
+    cache = bch.BCHCache(path)
+    return {key: cache.get_value(key) for key in cache.keys()}
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class Benchmark:
+    """Times functions and collects the results."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, size, function, setup=None):
+        times = []
+        error = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    function()
+            except Exception as e:
+                error = repr(e)
+                break
+            times.append(time.perf_counter() - start)
+        result = {'name': name, 'size': size, 'times': times,
+                  'min': min(times) if times else None,
+                  'median': statistics.median(times) if times else None}
+        if error is not None:
+            result['error'] = error
+        self.results.append(result)
+        if error is None:
+            print('{:<40} {:>8} {:>10.4f}s {:>10.4f}s'.format(name, size, result['min'], result['median']))
+        else:
+            print('{:<40} {:>8} failed: {}'.format(name, size, error))
+        return result
+
+def benchmark_scoring(benchmark, size, data):
+    reports = [report for report in data.values() if not report.get('error')]
+    benchmark.run('score/compute_maintainability_score', size,
+                  lambda: [bch.compute_maintainability_score(r) for r in reports])
+    benchmark.run('score/compute_maintainability_score_per_guideline', size,
+                  lambda: [bch.compute_maintainability_score_per_guideline(r) for r in reports])
+    benchmark.run('score/compute_maintainability_scores', size,
+                  lambda: bch.compute_maintainability_scores(reports))
+
+def benchmark_cache(benchmark, size, data, workdir):
+    for name, extension in CACHE_FORMATS.items():
+        path = os.path.join(workdir, 'cache' + extension)
+        benchmark.run('cache/store/' + name, size, lambda: write_cache(path, data),
+                      setup=lambda: remove(path))
+        benchmark.run('cache/load/' + name, size, lambda: load_cache(path))
+    # two overlapping caches, as collected by separate runs
+    folder = os.path.join(workdir, 'caches')
+    os.makedirs(folder)
+    keys = list(data)
+    write_cache(os.path.join(folder, 'cache_1.json'), {k: data[k] for k in keys[:len(keys) * 2 // 3]})
+    write_cache(os.path.join(folder, 'cache_2.json'), {k: data[k] for k in keys[len(keys) // 3:]})
+    for name, extension in CACHE_FORMATS.items():
+        output = os.path.join(workdir, 'merged' + extension)
+        benchmark.run('cache/merge/' + name, size, lambda: merge_cache(folder, output),
+                      setup=lambda: remove(output))
+
+def benchmark_export(benchmark, size, df, workdir):
+    path = os.path.join(workdir, 'cache' + SEGMENTS_EXTENSION)
+    cache = bch.BCHCache(path)
+    def reset():
+        remove(get_score_table_path(path))
+        remove(get_projection_path(path))
+    benchmark.run('report/main_calculation/cold', size,
+                  lambda: report.main_calculation(df, cache, 'security'), setup=reset)
+    benchmark.run('report/main_calculation/warm', size,
+                  lambda: report.main_calculation(df, cache, 'security'))
+    return report.main_calculation(df, cache, 'security')
+
+def benchmark_charts(benchmark, size, results, workdir):
+    reports = os.path.join(workdir, 'reports')
+    os.makedirs(reports, exist_ok=True)
+    dfs = {'security': results, 'random': results.sample(frac=0.2, random_state=1),
+           'size': results.sample(frac=0.2, random_state=2)}
+    charts = [
+        ('comparison', chart.main_comparison_chart, (dfs,)),
+        ('guideline', chart.main_per_guideline_chart, (results,)),
+        ('guideline_swarm', chart.main_guideline_swarm_plot, (results,)),
+        ('language', chart.main_per_language_chart, (results[['diff', 'Language']],)),
+        ('severity', chart.main_per_severity, (results[['diff', 'Severity']],)),
+        ('cwe', chart.main_per_cwe_chart, (results[['diff', 'CWE']],)),
+        ('cwe_spec', chart.main_per_cwe_spec_chart, ('CWE_664', results[['diff', 'CWE']])),
+    ]
+    for name, function, args in charts:
+        benchmark.run('chart/' + name, size,
+                      lambda: function(reports, *[a.copy() if isinstance(a, pd.DataFrame) else a
+                                                  for a in args]))
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'matplotlib': matplotlib.__version__}
+
+def run_benchmarks(sizes, output, groups, repeat, resamples, preview, workdir=None):
+    benchmark = Benchmark(repeat)
+    chart.set_preview(preview)
+    chart.FORCE = True
+    tests.RESAMPLES, tests.WORKERS = resamples, 1
+    print('{:<40} {:>8} {:>11} {:>11}'.format('benchmark', 'reports', 'min', 'median'))
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix='benchmark-{}-'.format(size), dir=workdir)
+        try:
+            df, data = generate_dataset(size)
+            if 'score' in groups:
+                benchmark_scoring(benchmark, size, data)
+            if 'cache' in groups:
+                benchmark_cache(benchmark, size, data, directory)
+            if 'export' in groups or 'chart' in groups:
+                path = os.path.join(directory, 'cache' + SEGMENTS_EXTENSION)
+                if not os.path.exists(path):
+                    write_cache(path, data)
+                results = benchmark_export(benchmark, size, df, directory)
+                if 'chart' in groups:
+                    benchmark_charts(benchmark, size, results, directory)
+        finally:
+            shutil.rmtree(directory)
+    with open(output, 'w') as f:
+        json.dump({'environment': get_environment(), 'repeat': repeat, 'resamples': resamples,
+                   'preview': preview, 'results': benchmark.results}, f, indent=2)
+    print('Results written to {}'.format(output))
+    return benchmark.results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic BCH reports')
+    parser.add_argument('-sizes', type=int, nargs='+', default=[1000, 10000], metavar='N',
+                        help='numbers of reports to generate (default: 1000 10000)')
+    parser.add_argument('-output', type=str, default='benchmark.json', metavar='file path',
+                        help='JSON file with the timings')
+    parser.add_argument('-groups', nargs='+', default=['score', 'cache', 'export', 'chart'],
+                        choices=['score', 'cache', 'export', 'chart'], help='benchmarks to run')
+    parser.add_argument('-repeat', type=int, default=3, metavar='N', help='runs of each benchmark')
+    parser.add_argument('-resamples', type=int, default=1000, metavar='N',
+                        help='bootstrap resamples of the chart tests')
+    parser.add_argument('-workdir', type=str, metavar='folder path',
+                        help='folder for the temporary caches (default: system temp)')
+    parser.add_argument('--preview', action='store_true',
+                        help='render charts with mathtext instead of LaTeX')
+
+    args = parser.parse_args()
+    run_benchmarks(args.sizes, args.output, args.groups, args.repeat, args.resamples,
+                   args.preview, args.workdir)
@@ -1,6 +1,4 @@
 from github import Github
-from bs4 import BeautifulSoup
-import requests
 from github.GithubException import UnknownObjectException, GithubException
 from tqdm import tqdm
 from collections import OrderedDict
@@ -8,11 +6,19 @@ from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import datetime
+import os
 import sys
 import re
-import time
+import subprocess
 
 import config
+import log
+import nvd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from maintainability.commit_index import CommitIndex
+from maintainability.ghutils import GithubCloneRepoPersistent
+from stats import enum
 
 
 _GITHUB_API = None
@@ -34,12 +40,27 @@ def get_repo_name(df):
     df['project']  = df['Project'].map(lambda x: x.split('/')[-1])
     return df
 
+def _set_commit_info_from_index(df, idx, commit, index):
+    df.at[idx, 'Date'] = index.get_date(commit.sha)
+    df.at[idx, 'Message'] = commit.message
+    df.at[idx, 'sha-p'] = ':'.join(commit.parents)
+
 # get Date, Message and Sha Parent of each commit
-def get_commits_info(df): 
+def get_commits_info(df, clones_dir=None):
+    """Fill commit info from local clones (owner___project) if given, else from GitHub."""
+    indexes = {}
     # iterating all dataframe rows
     for idx, row in tqdm(df.iterrows()):
         if row['Dataset'] == 'SECBENCH' and row['Date'] is np.nan:
-            repo = g.get_repo('{}/{}'.format(row['owner'], row['project']))
+            clone_dir = os.path.join(clones_dir or '', '{}___{}'.format(row['owner'], row['project']))
+            if clones_dir is not None and os.path.isdir(clone_dir):
+                if clone_dir not in indexes:
+                    indexes[clone_dir] = CommitIndex(clone_dir)
+                commit = indexes[clone_dir].get(row['sha'])
+                if commit is not None:
+                    _set_commit_info_from_index(df, idx, commit, indexes[clone_dir])
+                    continue
+            repo = _get_github_api().get_repo('{}/{}'.format(row['owner'], row['project']))
             c = repo.get_commit(sha=row['sha'])
     
             commit_info = c.commit
@@ -60,14 +81,13 @@ def convert_col_to_datetime(df):
     return df
 
 def get_first_and_last_fix_commits(df):
-    for u in df['Code'].unique():
-        print('============= {} ============='.format(u))
-        first_fix, last_fix = df[df['Code'] == u]['Date'].min(), df[df['Code'] == u]['Date'].max()
-        for i, r in df[df['Code'] == u].iterrows():
-            if r['Date'] == last_fix:
-                df.at[i, 'Type'] = 'LAST'
-            if r['Date'] == first_fix:
-                df.at[i, 'Type'] = 'FIRST'
+    """Tag the first and last fix commits of each CVE, a single fix is FIRST."""
+    dates = df.groupby('Code')['Date']
+    is_first = df['Date'] == dates.transform('min')
+    is_last = df['Date'] == dates.transform('max')
+    if 'Type' in df.columns or (is_first | is_last).any():
+        types = df['Type'] if 'Type' in df.columns else pd.Series(np.nan, index=df.index, dtype=object)
+        df['Type'] = types.mask(is_last, 'LAST').mask(is_first, 'FIRST')
     return df
 
 def filter_non_last_or_first(df):
@@ -77,16 +97,21 @@ def delete_dups(df):
     return df[df['Duplicate'] == 0]
 
 def adjust_multiple_fixes_data(df):
-    final = pd.DataFrame()
-    for u in df['Code'].unique():
-        commits = df[df['Code'] == u]
-        if len(commits) > 1:
-            commits['sha-p'][commits['Type'] == 'LAST'] = commits[commits['Type'] == 'FIRST']['sha-p'].values[0]
-            final = final.append(commits[commits['Type'] == 'LAST'], 
-                                    ignore_index = True)
-        else:
-            final = final.append(commits, ignore_index = True)
-    return final
+    """Keep the last fix of CVEs with several fixes, with the parent of the first fix.
+
+    Rows are grouped by CVE in order of first appearance.
+    """
+    df = df[df['Code'].notnull()]
+    multiple = df.groupby('Code')['Code'].transform('size') > 1
+    first_parents = df[df['Type'] == 'FIRST'].drop_duplicates('Code').set_index('Code')['sha-p']
+    missing = multiple & ~df['Code'].isin(first_parents.index)
+    if missing.any():
+        raise ValueError('No FIRST fix of {}'.format(', '.join(df.loc[missing, 'Code'].unique())))
+    last = multiple & (df['Type'] == 'LAST')
+    final = df[~multiple | last].copy()
+    final.loc[last[~multiple | last], 'sha-p'] = final['Code'].map(first_parents)
+    order = final['Code'].map({code: n for n, code in enumerate(df['Code'].unique())})
+    return final.iloc[order.argsort(kind='stable')].reset_index(drop=True)
     
 def get_cve_from_commit_msg(df):
     expr = 'CVE-\d{4}-\d{4,7}'
@@ -96,95 +121,112 @@ def get_cve_from_commit_msg(df):
     return df
             
 
-def get_score(soup):
-    score_calc = soup.find(id='p_lt_WebPartZone1_zoneCenter_pageplaceholder_p_lt_WebPartZone1_zoneCenter_VulnerabilityDetail_VulnFormView_Cvss2CalculatorAnchor')
-    if score_calc != None:
-        return score_calc.getText().strip().split(' ') 
-    else:
-        return [0, None]
-    
-def get_cwe(soup):
-    cwe_table = soup.find(id='p_lt_WebPartZone1_zoneCenter_pageplaceholder_p_lt_WebPartZone1_zoneCenter_VulnerabilityDetail_VulnFormView_VulnTechnicalDetailsDiv')
-    if cwe_table != None:
-        cwe_tds = cwe_table.find_all('td')
-        if len(cwe_tds) > 0:
-            return cwe_tds[0].getText()
-        else:
-            return None
-    else:
-        return None
-    
-def get_cve_details_from_nvd(df, dataset, out):
-    nvd_url = 'https://nvd.nist.gov/vuln/detail/'
+def get_cve_details_from_nvd(df, dataset, store):
+    """Set the CWE, score and severity of CVE fixes from a local NVD store (see nvd.py).
+
+    Only rows of the dataset without a CWE are set, from their first CVE id.
+    CVEs without a CVSS v2 assessment get a score of 0 and no severity.
+    """
+    details = nvd.load_store(store)
     df['Severity'] = df['Severity'].astype(str)
-    
-    for i, r in tqdm(df.iterrows()):
-        if r['Dataset'] == dataset and r['Code'] is not np.nan:
-            if 'CVE' in r['Code'] and r['CWE'] is np.nan:
-                print(r['Code'])
-                time.sleep(2)
-                results = requests.get('{}{}'.format(nvd_url, r['Code']))
-                soup = BeautifulSoup(results.content, 'html.parser')
-    
-                df.at[i, 'Score'], df.at[i, 'Severity'] = get_score(soup)
-                df.at[i, 'CWE'] = get_cwe(soup)
-                
-            df.to_csv(out, index=False)
-            print('Saving...')
-        
+    df['CWE'] = df['CWE'].astype(object)
+    cve = df['Code'].astype(str).str.extract(nvd.CVE_EXPRESSION, expand=False)
+    rows = (df['Dataset'] == dataset) & df['CWE'].isnull() & cve.isin(details.index)
+    missing = (df['Dataset'] == dataset) & df['CWE'].isnull() & cve.notnull() & ~rows
+    if missing.any():
+        log.warning('{} CVEs are not in {}, import their feeds first'.format(missing.sum(), store))
+
+    found = details.reindex(cve[rows])
+    df.loc[rows, 'Score'] = found['Score'].fillna(0).values
+    df.loc[rows, 'Severity'] = found['Severity'].values
+    df.loc[rows, 'CWE'] = found['CWE'].values
     return df
     
-df = pd.read_csv(sys.argv[1])
-g = _get_github_api()
-out = sys.argv[2]
-
-#df.to_csv(out, index=False)
-print(df)
-
-count = 0; 
-for i, row in tqdm(df.iterrows()):
-    
+def _get_existing_commits(clone_dir, shas):
+    """Return the shas that are commits of a local clone, in one git pass."""
+    process = subprocess.run(['git', '-C', clone_dir, 'cat-file', '--batch-check'],
+                             input='\n'.join(shas) + '\n', capture_output=True, text=True)
+    existing = set()
+    for line in process.stdout.splitlines():
+        fields = line.split()
+        if len(fields) > 1 and fields[1] == 'commit':
+            existing.add(fields[0])
+    return existing
+
+def get_changed_paths(clone_dir, shas):
+    """Stream the paths changed by each commit (against its first parent) from one git log."""
+    if not shas:
+        return {}
+    process = subprocess.Popen(
+        ['git', '-C', clone_dir, 'log', '--stdin', '--no-walk=unsorted', '--name-only',
+         '--diff-merges=first-parent', '--format=%x1e%H %P'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, errors='replace')
+    # git reads all the revisions before logging, so stdin can be written at once
+    process.stdin.write('\n'.join(shas) + '\n')
+    process.stdin.close()
+    changes = {}
+    paths = None
+    for line in process.stdout:
+        line = line.rstrip('\n')
+        if line.startswith('\x1e'):
+            sha, *parents = line[1:].split()
+            paths = []
+            changes[sha] = (parents, paths)
+        elif line and paths is not None:
+            paths.append(line)
+    process.wait()
+    return changes
+
+def _get_diff_paths(clone_dir, base, head):
+    """Paths changed between two commits, like a GitHub compare."""
+    output = subprocess.run(['git', '-C', clone_dir, 'diff', '--name-only', f'{base}...{head}'],
+                            capture_output=True, text=True, errors='replace', check=True).stdout
+    return output.splitlines()
+
+def label_language(paths):
+    """Language label of a change: a file type, a list of file types or ERROR."""
     langs = OrderedDict()
-    
-    if row['Language'] != 'EMPTY':
-        continue
-        
-    user = row['owner']
-    project = row['project']
-    if user == 'torvalds' or user == 'chineking':
-        continue
-    print(user, project)
-    
-    try:
-        repo = g.get_user(user).get_repo(project)
-    except:
-        pass
-    
-    diff_files = repo.compare(row['sha-p'], row['sha']).files
-    files_ext = [i.filename.split('.')[-1] for i in diff_files]
-    
-    for j in files_ext:
-        if j not in ('STATUS'):
-            if j not in langs:
-                langs[j] = 1
-            else:
-                langs[j] += 1
-
-    if len(files_ext) > 1: 
-        df.at[i, 'Language'] = str(list(langs))
-    elif len(files_ext) == 0:
-        df.at[i, 'Language'] = 'ERROR'
-    else:
-        df.at[i, 'Language'] = list(langs)[0]
-
-    count +=1
-    
-    if count == 20:
-        df.to_csv(out, index=False)
-        print('Saving...')
-        count = 0
-    
-df.to_csv(out, index=False)
-
+    for file_type in map(enum.get_file_type, paths):
+        if file_type != 'STATUS':
+            langs[file_type] = langs.get(file_type, 0) + 1
+    if len(paths) > 1:
+        return str(list(langs))
+    if not langs:
+        return 'ERROR'
+    return list(langs)[0]
+
+def get_languages(df, clones_dir):
+    """Label the changed languages of every EMPTY row, with one git pass per repository.
+
+    Rows without a parent commit are skipped.
+    """
+    rows = df[(df['Language'] == 'EMPTY') & df['sha-p'].notnull()]
+    for (user, project), commits in tqdm(rows.groupby(['owner', 'project'], sort=False)):
+        with GithubCloneRepoPersistent(user, project, clones_dir) as clone_dir:
+            pairs = [(i, sha_p.split(':')[0], sha) for i, sha_p, sha
+                     in zip(commits.index, commits['sha-p'], commits['sha'])]
+            existing = _get_existing_commits(clone_dir, [sha for _, _, sha in pairs])
+            changes = get_changed_paths(clone_dir, sorted(existing))
+            for i, sha_p, sha in pairs:
+                if sha not in existing:
+                    log.warning(f'Commit {sha} not found in {user}/{project}.')
+                    continue
+                parents, paths = changes[sha]
+                if parents[:1] != [sha_p]:
+                    try:
+                        paths = _get_diff_paths(clone_dir, sha_p, sha)
+                    except subprocess.CalledProcessError as error:
+                        log.warning(f'Could not compare {sha_p} and {sha} in {user}/{project}: '
+                                    f'{error.stderr.strip()}')
+                        continue
+                df.at[i, 'Language'] = label_language(paths)
+    return df
 
+if __name__ == '__main__':
+    df = pd.read_csv(sys.argv[1])
+    out = sys.argv[2]
+    clones_dir = os.path.abspath(sys.argv[3] if len(sys.argv) > 3 else './tmp')
 
+    print(df)
+    df = get_languages(df, clones_dir)
+    df.to_csv(out, index=False)
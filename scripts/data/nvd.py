@@ -0,0 +1,107 @@
+"""Local store of CVE details imported from NVD JSON data feeds.
+
+The yearly feeds (https://nvd.nist.gov/vuln/data-feeds) are read from disk,
+plain or compressed, in the 1.1 (`CVE_Items`) or 2.0 (`vulnerabilities`)
+format. Only the CWE, CVSS v2 score and severity of each CVE are kept, in a
+CSV file indexed by CVE id, so datasets can be enriched offline with a join.
+"""
+
+import contextlib
+import gzip
+import json
+import os
+import sys
+import zipfile
+
+import pandas as pd
+
+import log
+
+COLUMNS = ['CVE', 'CWE', 'Score', 'Severity', 'Modified']
+CVE_EXPRESSION = r'(CVE-\d{4}-\d{4,7})'
+
+@contextlib.contextmanager
+def open_feed(path):
+    """Open a feed file, decompressing .gz and .zip feeds."""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as feed:
+            yield feed
+    elif path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive, archive.open(archive.namelist()[0]) as feed:
+            yield feed
+    else:
+        with open(path, encoding='utf-8') as feed:
+            yield feed
+
+def _get_english(descriptions):
+    values = [d['value'] for d in descriptions if d.get('lang') == 'en']
+    return values[0] if values else None
+
+def _parse_item(item):
+    """CVE details of an item of a 1.1 feed."""
+    cve = item['cve']
+    cwe = None
+    for problem in cve.get('problemtype', {}).get('problemtype_data', []):
+        cwe = _get_english(problem.get('description', []))
+        if cwe:
+            break
+    v2 = item.get('impact', {}).get('baseMetricV2')
+    return {'CVE': cve['CVE_data_meta']['ID'], 'CWE': cwe,
+            'Score': v2['cvssV2']['baseScore'] if v2 else None,
+            'Severity': v2.get('severity') if v2 else None,
+            'Modified': item.get('lastModifiedDate')}
+
+def _parse_vulnerability(vulnerability):
+    """CVE details of a vulnerability of a 2.0 feed."""
+    cve = vulnerability['cve']
+    # primary weaknesses are the ones assigned by NVD
+    weaknesses = sorted(cve.get('weaknesses', []), key=lambda w: w.get('type') != 'Primary')
+    cwe = None
+    for weakness in weaknesses:
+        cwe = _get_english(weakness.get('description', []))
+        if cwe:
+            break
+    v2 = cve.get('metrics', {}).get('cvssMetricV2')
+    return {'CVE': cve['id'], 'CWE': cwe,
+            'Score': v2[0]['cvssData']['baseScore'] if v2 else None,
+            'Severity': v2[0].get('baseSeverity') if v2 else None,
+            'Modified': cve.get('lastModified')}
+
+def read_feed(path):
+    """Return the CVE details of a feed file as a data frame."""
+    with open_feed(path) as feed:
+        content = json.load(feed)
+    if 'CVE_Items' in content:
+        records = [_parse_item(item) for item in content['CVE_Items']]
+    else:
+        records = [_parse_vulnerability(v) for v in content.get('vulnerabilities', [])]
+    return pd.DataFrame(records, columns=COLUMNS)
+
+def load_store(store):
+    """Return the CVE details of a store indexed by CVE id."""
+    if not os.path.exists(store):
+        return pd.DataFrame(columns=COLUMNS).set_index('CVE')
+    return pd.read_csv(store, dtype={'CWE': str, 'Severity': str, 'Modified': str},
+                       index_col='CVE')
+
+def import_feeds(feeds, store):
+    """Add the CVEs of the feed files to the store, keeping their latest version."""
+    details = [load_store(store).reset_index()]
+    for feed in feeds:
+        details.append(read_feed(feed))
+        log.info("Read {} CVEs from {}.".format(len(details[-1]), feed))
+    details = pd.concat(details, ignore_index=True)
+    # feeds list their CVEs once, the latest modification of each CVE wins;
+    # both feed formats start their dates with an ISO minute (2019-04-01T14:20)
+    modified = details['Modified'].fillna('').str[:16]
+    details = details.iloc[modified.argsort(kind='stable')] \
+        .drop_duplicates('CVE', keep='last').sort_values('CVE')
+    temporary = store + '.tmp'
+    details.to_csv(temporary, index=False)
+    os.replace(temporary, store)
+    log.success("Stored {} CVEs in {}.".format(len(details), store))
+    return details.set_index('CVE')
+
+if __name__ == '__main__':
+    # python nvd.py <store> <feed> [<feed> ...]
+    import_feeds(sys.argv[2:], sys.argv[1])
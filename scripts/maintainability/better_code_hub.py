@@ -1,35 +1,71 @@
 """Module to interact with BetterCodeHub.com."""
 
-from time import sleep
+from time import sleep, monotonic
 from statistics import mean
+import hashlib
+import inspect
 import os
+import threading
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from retry import retry
-import click
-
 from maintainability import log
 from maintainability import config
 from maintainability import ghutils
 from maintainability import gitutils
-from maintainability.cache import BCHCache
+from maintainability.cache import BCHCache, convert_cache
+from maintainability.scan_tracker import ScanTracker
 
 ERROR_REPORT = {
     "error": True
 }
 
 SCRIPT_DIR = os.path.dirname(__file__)
-CACHE = BCHCache(os.path.join(SCRIPT_DIR, "./bch_cache.zip"))
+CACHE_PATH = os.path.join(SCRIPT_DIR, "./bch_cache.seg")
+LEGACY_CACHE_PATH = os.path.join(SCRIPT_DIR, "./bch_cache.zip")
+CACHE = BCHCache(CACHE_PATH)
 
 RETRY_ATTEMPTS = 10
+DEFAULT_BRANCH_DELAY = 5 # seconds for a new default branch to take effect
+
+def migrate_legacy_cache():
+    """Import the legacy .zip cache into CACHE_PATH if it does not exist yet."""
+    if not os.path.exists(CACHE_PATH) and os.path.exists(LEGACY_CACHE_PATH):
+        log.info(f"Importing {LEGACY_CACHE_PATH} into {CACHE_PATH}...")
+        convert_cache(LEGACY_CACHE_PATH, CACHE_PATH)
+
+class BetterCodeHubException(Exception):
+    """Base Class for BCH exceptions."""
+
+class ProjectNotSupported(BetterCodeHubException):
+    """Exception raised when the project is not supported by BCH."""
+
+class ProjectExceedsLOCLimit(ProjectNotSupported):
+    """Exception raised when BCH does not accept the project due to its size."""
+
+class StillProcessing(BetterCodeHubException):
+    """Exception raised when BCH blocks access for too many requests."""
 
-@retry(tries=RETRY_ATTEMPTS, delay=5, backoff=10, max_delay=500)
-def robust_analyze_commit(user, project, commit_sha):
+class WrongSessionDetails(BetterCodeHubException):
+    """Exception Raised when session details in config are outdated."""
+
+class WrongCommitReports(BetterCodeHubException):
+    """Exception Raised when BCH reports are from an unexpected commit."""
+
+class IncompleteCommitReports(BetterCodeHubException):
+    """Exception Raised when BCH reports are incomplete."""
+
+@retry((WrongSessionDetails, StillProcessing, requests.exceptions.RequestException),
+       tries=RETRY_ATTEMPTS, delay=5, backoff=10, max_delay=500)
+def robust_analyze_commit(user, project, commit_sha, store=None, services=None):
     """Analyze any commit without failing."""
+    services = services or SERVICES
     log.info(f"Analyzing {user}/{project}...")
     try:
         report = external_analyze_commit_cached(
-            user, project, commit_sha
+            user, project, commit_sha, store=store, services=services
         )
         if report.get('error'):
             log.warning(f"Commit {commit_sha} in {user}/{project} is out...")
@@ -38,70 +74,92 @@ def robust_analyze_commit(user, project, commit_sha):
         return
     except WrongSessionDetails as error:
         log.error("Your BCH credentials are outdated.")
-        click.pause("Update your config file and press any key to continue...")
+        log.info("Waiting for the session details in the config file to be updated...")
+        services.client.wait_for_credentials()
         raise error
     except StillProcessing as error:
         log.warning(f"BCH is not ready: still processing our projects.")
         raise error
+    except requests.exceptions.RequestException as error:
+        log.warning(f"Could not reach BCH: {error}")
+        raise error
     except WrongCommitReports:
         pass
     except Exception as err:
         log.error(err)
+        if threading.current_thread() is not threading.main_thread():
+            # workers cannot share stdin with a debugger, their caller records the error
+            raise BetterCodeHubException(f"Unexpected error in {user}/{project}: {err}") from err
         import pdb; pdb.set_trace()
     log.error(f"Skipping {user}/{project}.")
 
-def external_analyze_commit_cached(user, project, commit_sha):
-    """Analyze project commit without write privileges and cache results."""
-    report = CACHE.get_stored_commit_analysis(user, project, commit_sha)
+def external_analyze_commit_cached(user, project, commit_sha, store=None, services=None):
+    """Analyze project commit without write privileges and cache results.
+
+    `store` replaces the default write to the cache, e.g., to hand reports over
+    to a single writer when several commits are analyzed concurrently.
+    """
+    services = services or SERVICES
+    report = services.cache.get_stored_commit_analysis(user, project, commit_sha)
     log.info("Report completed.")
     if report:
         return report
-    report = external_analyze_commit(user, project, commit_sha)
-    CACHE.store_commit_analysis(user, project, commit_sha, report)
+    report = external_analyze_commit(user, project, commit_sha, services)
+    if store is None:
+        services.cache.store_commit_analysis(user, project, commit_sha, report)
+    else:
+        store(user, project, commit_sha, report)
     return report
 
-def external_analyze_commit(user, project, commit_sha):
+def external_analyze_commit(user, project, commit_sha, services=None):
     """Analyze project commit without write privileges."""
+    services = services or SERVICES
     try:
-        forked_repo = ghutils.git_fork(user, project)
+        forked_repo = ghutils.git_fork(user, project, services.github)
         log.info(forked_repo)
         log.info(f"Repo {user}/{project} Forked")
-        result = analyze_commit(forked_repo.owner.login, project, commit_sha)
+        result = analyze_commit(forked_repo.owner.login, project, commit_sha, services)
     except ProjectNotSupported:
         log.error(f"Project {user}/{project} is not supported by BCH. Skipping.")
         result = ERROR_REPORT
     return result
 
-def analyze_commit(user, project, commit_sha):
+def analyze_commit(user, project, commit_sha, services=None):
     """Trigger a BCH scan for a specific commit of a GH project."""
-    repo = ghutils.get_repo(user, project)
-    temp_branch = _create_branch_for_commit(repo, commit_sha)
+    services = services or SERVICES
+    repo = ghutils.get_repo(user, project, services.github)
+    temp_branch = _create_branch_for_commit(repo, commit_sha, services.mirror_dir)
     if temp_branch is None:
         log.error(f"Could not create new branch in repo {repo} for commit {commit_sha}.")
         return ERROR_REPORT
-    report = analyze_project_in_branch(repo, temp_branch)
+    report = analyze_project_in_branch(repo, temp_branch, commit_sha, services)
     if report and report.get('sha') != commit_sha:
         log.error("BCH returned reports for a different commit.")
         raise WrongCommitReports
     return report
 
-def analyze_project_in_branch(repo, branch):
+def analyze_project_in_branch(repo, branch, commit_sha=None, services=None):
     """Trigger a BCH scan of specific branch of a GH project."""
+    services = services or SERVICES
     default_branch_original = ghutils.get_default_branch(repo)
     ghutils.set_default_branch(repo, branch)
-    sleep(5) #give time for this to take effect
-    result = analyze_project(repo.owner.login, repo.name)
+    sleep(services.branch_delay)
+    result = analyze_project(repo.owner.login, repo.name, commit_sha, services)
     ghutils.set_default_branch(repo, default_branch_original)
     return result
 
-def _create_branch_for_commit(gh_repo, commit_sha):
+def _create_branch_for_commit(gh_repo, commit_sha, mirror_dir=None):
     branch_name = _get_temporary_branch_name(commit_sha)
     branch = ghutils.get_branch(gh_repo, branch_name)
     if branch:
         log.warning(f"Using existing branch {branch_name} in {gh_repo.clone_url}.")
         return branch_name
+    upstream_url = gh_repo.parent.clone_url if gh_repo.fork else None
     try:
-        gitutils.create_branch_from_commit(gh_repo.clone_url, branch_name, commit_sha)
+        gitutils.create_branch_from_commit(
+            gh_repo.clone_url, branch_name, commit_sha, upstream_url=upstream_url,
+            mirror_dir=mirror_dir
+        )
         return branch_name
     except gitutils.BranchAlreadyExists:
         log.error(
@@ -113,30 +171,9 @@ def _create_branch_for_commit(gh_repo, commit_sha):
         log.error("Commit cannot be reached. Leaving it permanently out of study.")
     return None
 
-@retry(tries=5, delay=30, backoff=5, max_delay=300)
-def collect_report(user, project):
-    """Collect BCH report from last scan."""
-    response = requests.get(
-        "https://bettercodehub.com/edge/report/{}/{}".format(user, project),
-        headers={
-            "Accept":"application/json, text/plain, */*",
-            "Accept-Language":"en-US,en;q=0.9",
-            "Cache-Control": "no-cache",
-            "Connection":"keep-alive",
-            "Content-Type":"application/json;charset=UTF-8",
-            "Origin":"https://bettercodehub.com",
-            "Pragma":"no-cache",
-            "Referer":"https://bettercodehub.com/repositories",
-            "X-XSRF-TOKEN":config.get("bettercodehub_xsrf_token"),
-            "X-Requested-With":"XMLHttpRequest"
-        },
-        cookies={
-            "SESSION":config.get("bettercodehub_session"),
-            "XSRF-TOKEN":config.get("bettercodehub_xsrf_token"),
-            "_ga":"GA1.2.1122828571.1537145587",
-            "_gid":"GA1.2.23643035.1537950088",
-        },
-    )
+def fetch_report(user, project, client=None):
+    """Fetch BCH report from last scan, failing if it is not ready."""
+    response = (client or CLIENT).get(f"/edge/report/{user}/{project}")
     if response.ok:
         report = response.json()
         if 'analysisResults' not in report.keys():
@@ -196,25 +233,169 @@ def _compute_distance_to_thresholds(volumes, bad_thresholds):
         results.append(good_code_loc - bad_code_factor*bad_code_loc)
     return mean(results)
 
+ZERO_SCORE_GUIDELINES = ("Automate Tests", "Keep Your Codebase Small")
+BALANCE_GUIDELINE = "Keep Architecture Components Balanced"
+
+def compute_maintainability_scores(reports, guidelines=None):
+    """Compute maintainability of many reports in one vectorized pass.
+
+    Returns the list of guidelines, a (reports x guidelines) array with the
+    score per guideline and an array with the overall score of each report.
+    Scores are NaN when a report does not have the guideline or when it
+    cannot be computed (e.g., components balance without components).
+    """
+    volumes, thresholds, present, total_loc, guidelines = pack_reports(reports, guidelines)
+    scores, overall = score_packed_reports(volumes, thresholds, present, total_loc, guidelines)
+    return guidelines, scores, overall
+
+def pack_reports(reports, guidelines=None):
+    """Pack volumes and thresholds of reports into zero/NaN-padded arrays."""
+    guidelines = list(guidelines or [])
+    positions = {guideline: index for index, guideline in enumerate(guidelines)}
+    bins = thresholds_size = 1
+    for report in reports:
+        for guideline in report.get("analysisResults"):
+            if guideline['guideline'] not in positions:
+                positions[guideline['guideline']] = len(guidelines)
+                guidelines.append(guideline['guideline'])
+            bins = max(bins, len(guideline['qualityProfileVolume']))
+            thresholds_size = max(thresholds_size,
+                                  len(guideline['qualityProfileComplianceThresholds']) - 1)
+    volumes = np.zeros((len(reports), len(guidelines), bins))
+    thresholds = np.full((len(reports), len(guidelines), thresholds_size), np.nan)
+    present = np.zeros((len(reports), len(guidelines)), dtype=bool)
+    total_loc = np.zeros(len(reports))
+    for index, report in enumerate(reports):
+        total_loc[index] = get_project_loc(report)
+        for guideline in report.get("analysisResults"):
+            position = positions[guideline['guideline']]
+            guideline_volumes = guideline['qualityProfileVolume']
+            bad_thresholds = guideline['qualityProfileComplianceThresholds'][1:]
+            volumes[index, position, :len(guideline_volumes)] = guideline_volumes
+            thresholds[index, position, :len(bad_thresholds)] = bad_thresholds
+            present[index, position] = True
+    return volumes, thresholds, present, total_loc, guidelines
+
+def score_packed_reports(volumes, thresholds, present, total_loc, guidelines):
+    """Vectorized version of _compute_maintainability_for_guideline."""
+    volumes = volumes.copy()
+    if BALANCE_GUIDELINE in guidelines:
+        position = guidelines.index(BALANCE_GUIDELINE)
+        total_components = np.cumsum(volumes[:, position], axis=-1)[:, -1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            volumes[:, position] = volumes[:, position] * total_loc[:, None] \
+                / total_components[:, None]
+        volumes[(total_components == 0) & present[:, position], position] = np.nan
+    good_code_loc = np.cumsum(volumes, axis=-1)
+    bad_code_loc = np.zeros(volumes.shape)
+    for index in range(volumes.shape[-1] - 1):
+        # summed left to right like sum(volumes[index+1:]), rescaled volumes are floats
+        bad_code_loc[..., index] = np.cumsum(volumes[..., index + 1:], axis=-1)[..., -1]
+    size = min(thresholds.shape[-1], volumes.shape[-1])
+    granularity = 0.01 # thresholds have a minimum of 0.01
+    bad_code_factor = (1 - thresholds) / (thresholds + granularity)
+    results = good_code_loc[..., :size] - bad_code_factor[..., :size] * bad_code_loc[..., :size]
+    if thresholds.shape[-1] > size:
+        # thresholds beyond the last volume compare all code against nothing
+        results = np.concatenate(
+            (results, np.repeat(good_code_loc[..., -1:], thresholds.shape[-1] - size, axis=-1)),
+            axis=-1)
+    scores = _masked_mean(results, ~np.isnan(thresholds))
+    for guideline in ZERO_SCORE_GUIDELINES:
+        if guideline in guidelines:
+            scores[:, guidelines.index(guideline)] = 0
+    scores[~present] = np.nan
+    return scores, _masked_mean(scores, present)
+
+def _masked_mean(values, mask):
+    """Mean of the last axis, correctly rounded like statistics.mean.
+
+    The sum is kept exactly as a float and its rounding error, so the rounded
+    mean can be checked against the exact remainder of the division. Means too
+    close to halfway between two floats are computed by statistics.mean.
+    """
+    values = np.where(mask, values, 0.0)
+    count = mask.sum(axis=-1).astype(float)
+    total = np.zeros(values.shape[:-1])
+    error = np.zeros(values.shape[:-1])
+    error_magnitude = np.zeros(values.shape[:-1])
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for index in range(values.shape[-1]):
+            total, rounding = _two_sum(total, values[..., index])
+            error += rounding
+            error_magnitude += np.abs(rounding)
+        means = total / count
+        for attempt in range(4):
+            product, product_error = _two_product(means, count)
+            difference = total - product # exact, product is close to total
+            remainder = (difference - product_error) + error
+            bound = (values.shape[-1] + 4) * np.finfo(float).eps * \
+                (np.abs(difference) + np.abs(product_error) + error_magnitude)
+            magnitude = np.abs(means)
+            ulp = np.where(remainder * means > 0, np.spacing(magnitude),
+                           magnitude - np.nextafter(magnitude, 0))
+            half = count * ulp / 2
+            step = np.isfinite(means) & (means != 0) & (np.abs(remainder) > half + bound)
+            if attempt == 3 or not step.any():
+                break
+            means = np.where(step, np.nextafter(means, np.copysign(np.inf, remainder)), means)
+        exact = np.isnan(means) | (count == 0) | \
+            ((means != 0) & (np.abs(remainder) < half - bound)) | \
+            ((means == 0) & (total == 0) & (error_magnitude == 0))
+    for position in zip(*np.nonzero(~exact)):
+        means[position] = mean(values[position][mask[position]])
+    return means
+
+def _two_sum(a, b):
+    """Sum of two floats and its rounding error."""
+    total = a + b
+    b_virtual = total - a
+    return total, (a - (total - b_virtual)) + (b - b_virtual)
+
+def _split(a):
+    c = 134217729.0 * a # 2**27 + 1
+    high = c - (c - a)
+    return high, a - high
+
+def _two_product(a, b):
+    """Product of two floats and its rounding error."""
+    product = a * b
+    a_high, a_low = _split(a)
+    b_high, b_low = _split(b)
+    return product, ((a_high * b_high - product) + a_high * b_low + a_low * b_high) + a_low * b_low
+
+def get_scoring_version():
+    """Hash of the code of the vectorized scores, to discard scores stored by other versions."""
+    functions = (pack_reports, get_project_loc, score_packed_reports, _masked_mean,
+                 _two_sum, _split, _two_product)
+    source = ''.join(inspect.getsource(function) for function in functions)
+    source += repr((ZERO_SCORE_GUIDELINES, BALANCE_GUIDELINE))
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
 def get_project_loc(report):
     """Get number of lines of code of the project."""
     first_guideline = report.get("analysisResults")[0]
     return sum(first_guideline['qualityProfileVolume'])
 
-def analyze_project(user, project):
+def analyze_project(user, project, commit_sha=None, services=None):
     "Scan and collect results from project."
+    services = services or SERVICES
     log.info("Adding project {}/{} to BetterCodeHub...".format(user, project))
-    scan_project(user, project)
+    scan_project(user, project, services.client)
+    started = monotonic()
     log.success("Successfully added project to BCH!")
-    log.info("Giving time for BCH to start analysis.")
-    sleep(20)
-    report = collect_report(user, project)
-    return report
+    log.info("Waiting for BCH to finish the analysis.")
+    is_ready = None
+    if commit_sha is not None:
+        # reports of previous scans stay available until the new one is ready
+        is_ready = lambda report: report.get('sha') == commit_sha
+    return services.tracker.wait_for_report(user, project, started, is_ready)
 
-def scan_project(user, project):
+def scan_project(user, project, client=None):
     """Analyze GitHub project with BetterCodeHub."""
-    response = _bch_request_post(
-        "https://bettercodehub.com/edge/schedule/scan",
+    client = client or CLIENT
+    response = client.post(
+        "/edge/schedule/scan",
         {"repositoryName":f"{user}/{project}"}
     )
     if response.ok:
@@ -238,7 +419,7 @@ def scan_project(user, project):
         raise WrongSessionDetails
     elif response.status_code == 429:
         log.error("Scan Project: still busy with another project")
-        _reset_bch()
+        _reset_bch(client)
         raise StillProcessing
     else:
         log.error(f"Unknown failure with BCH in project {user}/{project}: "
@@ -247,65 +428,125 @@ def scan_project(user, project):
         raise BetterCodeHubException
     return response
 
-def _reset_bch():
+def _reset_bch(client=None):
     "Fetch BCH main page in case it is behaving unexpectedly."
-    requests.get(
-        "https://bettercodehub.com/repositories",
-        cookies={
-            "SESSION":config.get("bettercodehub_session"),
-            "XSRF-TOKEN":config.get("bettercodehub_xsrf_token"),
-            "_ga":"GA1.2.1122828571.1537145587",
-            "_gid":"GA1.2.23643035.1537950088",
-        },
-    )
+    (client or CLIENT).get("/repositories")
 
-def _bch_request_post(url, data=None):
-    return requests.post(
-        url,
-        json=data,
-        cookies={
-            "SESSION":config.get("bettercodehub_session"),
-            "XSRF-TOKEN":config.get("bettercodehub_xsrf_token"),
-            "_ga":"GA1.2.1122828571.1537145587",
-            "_gid":"GA1.2.23643035.1537950088",
-        },
-        headers={
-            "Accept":"application/json, text/plain, */*",
-            "Accept-Language":"en-US,en;q=0.9",
-            "Cache-Control": "no-cache",
-            "Connection":"keep-alive",
-            "Content-Type":"application/json;charset=UTF-8",
-            "Origin":"https://bettercodehub.com",
-            "Pragma":"no-cache",
-            "Referer":"https://bettercodehub.com/repositories",
-            "X-XSRF-TOKEN":config.get("bettercodehub_xsrf_token"),
-            "X-Requested-With":"XMLHttpRequest"
-        }
-    )
+class BCHClient:
+    """Keep-alive session with BCH, credentials are refreshed on config changes.
+
+    The BCH url can be changed with `bettercodehub_url` in the config file,
+    e.g., to test against a local server (see fake_services).
+    """
+
+    BASE_URL = "https://bettercodehub.com"
+    TIMEOUT = (10, 60) # seconds to connect, seconds between bytes received
+
+    def __init__(self, base_url=None, credentials=None, pool_size=16):
+        """`base_url` and `credentials` (`bettercodehub_session` and
+        `bettercodehub_xsrf_token`) replace the settings of the config file."""
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+        self.base_url = (base_url or self.BASE_URL).rstrip('/')
+        self._base_url = base_url
+        self._credentials = credentials
+        self.config_version = None
+        self._headers = None
+        self._cookies = None
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Send a GET request to a BCH endpoint."""
+        return self.request('GET', path)
+
+    def post(self, path, data=None):
+        """Send a POST request with a JSON body to a BCH endpoint."""
+        return self.request('POST', path, json=data)
+
+    def request(self, method, path, **kwargs):
+        """Send a request with the current credentials."""
+        headers, cookies = self._get_credentials()
+        return self.session.request(
+            method, self.base_url + path,
+            headers=headers, cookies=cookies, timeout=self.TIMEOUT, **kwargs
+        )
+
+    def wait_for_credentials(self):
+        """Block until the credentials in the config file are updated."""
+        if self._credentials is None:
+            config.wait_for_change(self.config_version)
+
+    def _get_setting(self, name):
+        if self._credentials is not None:
+            return self._credentials.get(name)
+        return config.get(name)
+
+    def _get_credentials(self):
+        with self._lock:
+            version = config.get_version() if self._credentials is None else None
+            if self._headers is None or version != self.config_version:
+                if self._base_url is None:
+                    self.base_url = config.load().get("bettercodehub_url",
+                                                      self.BASE_URL).rstrip('/')
+                xsrf_token = self._get_setting("bettercodehub_xsrf_token")
+                self._headers = {
+                    "Accept":"application/json, text/plain, */*",
+                    "Accept-Language":"en-US,en;q=0.9",
+                    "Cache-Control": "no-cache",
+                    "Connection":"keep-alive",
+                    "Content-Type":"application/json;charset=UTF-8",
+                    "Origin":self.base_url,
+                    "Pragma":"no-cache",
+                    "Referer":self.base_url + "/repositories",
+                    "X-XSRF-TOKEN":xsrf_token,
+                    "X-Requested-With":"XMLHttpRequest"
+                }
+                self._cookies = {
+                    "SESSION":self._get_setting("bettercodehub_session"),
+                    "XSRF-TOKEN":xsrf_token,
+                    "_ga":"GA1.2.1122828571.1537145587",
+                    "_gid":"GA1.2.23643035.1537950088",
+                }
+                self.config_version = version
+            return self._headers, self._cookies
+
+CLIENT = BCHClient()
 
 def _get_temporary_branch_name(commit_sha):
     return "security_test_{}".format(commit_sha[:7])
 
-class BetterCodeHubException(Exception):
-    """Base Class for BCH exceptions."""
+def create_scan_tracker(client, **settings):
+    """Scan tracker polling reports with `client`, `settings` are passed to ScanTracker."""
+    return ScanTracker(
+        lambda user, project: fetch_report(user, project, client),
+        pending=(StillProcessing, IncompleteCommitReports, requests.exceptions.RequestException),
+        timeout_error=StillProcessing,
+        **settings
+    )
 
-class ProjectNotSupported(BetterCodeHubException):
-    """Exception raised when the project is not supported by BCH."""
+SCAN_TRACKER = create_scan_tracker(CLIENT)
 
-class ProjectExceedsLOCLimit(ProjectNotSupported):
-    """Exception raised when BCH does not accept the project due to its size."""
+class Services:
+    """BCH client, scan tracker, cache and GitHub settings used to analyze commits.
 
-class StillProcessing(BetterCodeHubException):
-    """Exception raised when BCH blocks access for too many requests."""
-
-class WrongSessionDetails(BetterCodeHubException):
-    """Exception Raised when session details in config are outdated."""
+    Defaults are the module client, tracker and cache, the GitHub API of the
+    config file and the default mirror pool. A tracker is created for a given
+    client unless one is given too.
+    """
 
-class WrongCommitReports(BetterCodeHubException):
-    """Exception Raised when BCH reports are from an unexpected commit."""
+    def __init__(self, client=None, tracker=None, cache=None, github=None, mirror_dir=None,
+                 branch_delay=DEFAULT_BRANCH_DELAY):
+        self.client = CLIENT if client is None else client
+        if tracker is None:
+            tracker = SCAN_TRACKER if client is None else create_scan_tracker(client)
+        self.tracker = tracker
+        self.cache = CACHE if cache is None else cache
+        self.github = github
+        self.mirror_dir = mirror_dir
+        self.branch_delay = branch_delay
 
-class IncompleteCommitReports(BetterCodeHubException):
-    """Exception Raised when BCH reports are incomplete."""
+SERVICES = Services()
 
 if __name__ == '__main__':
     pass
@@ -1,10 +1,22 @@
 """Module with a class utility for cache in JSON."""
 
-from os.path import splitext
+from os import listdir, makedirs, remove, replace
+from os.path import splitext, join, getsize, exists
+import hashlib
+import io
 import json
+import re
+import struct
+import threading
+import zlib
+from os.path import abspath
 from pathlib import Path
 from zipfile import ZipFile, ZIP_DEFLATED
 
+from maintainability.jsonl import read_json_lines
+
+SEGMENTS_EXTENSION = '.seg'
+
 class JsonLib:
     def load(self, file_path):
         with open(file_path, 'r') as cache_file:
@@ -30,15 +42,287 @@ class ZipLib:
         with ZipFile(file_path, 'w', compression=ZIP_DEFLATED) as myzip:
             myzip.writestr(json_filename, datas)
 
+class SegmentStore:
+    """Append-only segment files with an on-disk key index.
+
+    Each record is appended to the active segment as a header (key length,
+    value length), the key and the deflated JSON value. Every append also
+    adds a line to `index.log` so that a single value can be read back with
+    one seek, without decoding the rest of the store. Stale records left
+    behind by overwrites and removals are dropped by `compact`.
+
+    Use `get_segment_store` to share a single store (and index) per path.
+    """
+
+    INDEX_FILE = 'index.log'
+    SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+    COMPACTION_MIN_BYTES = 16 * 1024 * 1024
+    COMPACTION_RATIO = 0.5
+    _HEADER = struct.Struct('>II')
+    _SEGMENT_PATTERN = re.compile(r'^segment-(\d+)\.log$')
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._index = None
+        self._segment = 1
+        self._total_bytes = 0
+        self._live_bytes = 0
+
+    @property
+    def index(self):
+        """Return dict with the location of every live key."""
+        if self._index is None or not exists(self._index_path()):
+            with self._lock:
+                if self._index is None or not exists(self._index_path()):
+                    self._open()
+        return self._index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        """Return value for given key or None."""
+        raw = self.get_raw(key)
+        if raw is None:
+            return None
+        return json.loads(zlib.decompress(raw))
+
+    def get_raw(self, key):
+        """Return the encoded value for given key without decoding it."""
+        with self._lock:
+            location = self.index.get(key)
+            if location is None:
+                return None
+            segment, offset, length = location
+            with open(self._segment_path(segment), 'rb') as segment_file:
+                segment_file.seek(offset)
+                return segment_file.read(length)
+
+    def items(self):
+        """Iterate over all live (key, value) pairs."""
+        for key in self.keys():
+            value = self.get(key)
+            if value is not None:
+                yield key, value
+
+    def put(self, key, value):
+        """Append value for given key."""
+        self.put_raw(key, self._encode(value))
+
+    def put_raw(self, key, raw):
+        with self._lock:
+            previous = self.index.get(key)
+            self._index[key] = self._append(key, raw)
+            self._live_bytes += len(raw)
+            if previous is not None:
+                self._live_bytes -= previous[2]
+                self._maybe_compact()
+
+    def delete(self, key):
+        """Append a tombstone for given key."""
+        with self._lock:
+            if key not in self.index:
+                raise KeyError(key)
+            self._append(key, b'')
+            self._live_bytes -= self._index.pop(key)[2]
+            self._maybe_compact()
+
+    def rewrite(self, data):
+        """Replace the whole content of the store with the given dict."""
+        with self._lock:
+            self._rewrite((key, self._encode(value)) for key, value in data.items())
+
+    def compact(self):
+        """Rewrite live records into fresh segments and drop the old ones."""
+        with self._lock:
+            self._rewrite((key, self.get_raw(key)) for key in self.keys())
+
+    def rewrite_raw(self, items):
+        """Replace the whole content of the store with (key, encoded value) pairs."""
+        with self._lock:
+            self._rewrite(items)
+
+    @staticmethod
+    def decode_raw(raw):
+        """Return the JSON text of an encoded value."""
+        return zlib.decompress(raw).decode()
+
+    def _maybe_compact(self):
+        stale_bytes = self._total_bytes - self._live_bytes
+        if stale_bytes > self.COMPACTION_MIN_BYTES and \
+                stale_bytes > self.COMPACTION_RATIO * self._total_bytes:
+            self.compact()
+
+    @staticmethod
+    def _encode(value):
+        return zlib.compress(json.dumps(value).encode())
+
+    def _segment_path(self, segment):
+        return join(self.path, 'segment-{:05d}.log'.format(segment))
+
+    def _index_path(self):
+        return join(self.path, self.INDEX_FILE)
+
+    def _segments(self):
+        if not exists(self.path):
+            return []
+        matches = [self._SEGMENT_PATTERN.match(name) for name in listdir(self.path)]
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def _open(self):
+        makedirs(self.path, exist_ok=True)
+        segments = self._segments()
+        self._index = {}
+        try:
+            lines = read_json_lines(self._index_path()) if exists(self._index_path()) else None
+        except ValueError:
+            lines = None  # lost index lines, rebuild the index from the segments
+        indexed_end = {}
+        if lines is None:
+            with open(self._index_path(), 'w'):
+                pass
+            recover = segments
+        else:
+            for key, segment, offset, length in lines:
+                if not length:
+                    self._index.pop(key, None)
+                else:
+                    self._index[key] = (segment, offset, length)
+                if segment is not None:
+                    indexed_end[segment] = max(indexed_end.get(segment, 0), offset + length)
+            # records are indexed in order, only the last one can miss its line
+            recover = segments[-1:]
+        for segment in recover:
+            self._recover_tail(segment, indexed_end.get(segment, 0))
+        self._segment = segments[-1] if segments else 1
+        self._total_bytes = sum(getsize(self._segment_path(s)) for s in segments)
+        self._live_bytes = sum(length for _, _, length in self._index.values())
+
+    def _recover_tail(self, segment, position):
+        """Index records appended after the last index line was written."""
+        path = self._segment_path(segment)
+        with open(path, 'rb') as segment_file:
+            segment_file.seek(position)
+            tail = segment_file.read()
+        cursor = 0
+        while cursor + self._HEADER.size <= len(tail):
+            key_length, value_length = self._HEADER.unpack_from(tail, cursor)
+            value_offset = cursor + self._HEADER.size + key_length
+            if value_offset + value_length > len(tail):
+                break
+            key = tail[cursor + self._HEADER.size:value_offset].decode()
+            location = (segment, position + value_offset, value_length)
+            if value_length == 0:
+                self._index.pop(key, None)
+            else:
+                self._index[key] = location
+            self._write_index_line(key, *location)
+            cursor = value_offset + value_length
+        if cursor < len(tail):
+            with open(path, 'r+b') as segment_file:
+                segment_file.truncate(position + cursor)
+
+    def _append(self, key, raw):
+        segment_path = self._segment_path(self._segment)
+        if exists(segment_path) and getsize(segment_path) >= self.SEGMENT_MAX_BYTES:
+            self._segment += 1
+        segment = self._segment
+        encoded_key = key.encode()
+        with open(self._segment_path(segment), 'ab') as segment_file:
+            offset = segment_file.tell()
+            segment_file.write(self._HEADER.pack(len(encoded_key), len(raw)))
+            segment_file.write(encoded_key)
+            segment_file.write(raw)
+        record_length = self._HEADER.size + len(encoded_key) + len(raw)
+        self._total_bytes += record_length
+        value_offset = offset + self._HEADER.size + len(encoded_key)
+        self._write_index_line(key, segment, value_offset, len(raw))
+        return (segment, value_offset, len(raw))
+
+    def _write_index_line(self, key, segment, offset, length):
+        with open(self._index_path(), 'a') as index_file:
+            index_file.write(json.dumps([key, segment, offset, length]) + '\n')
+
+    def _rewrite(self, items):
+        makedirs(self.path, exist_ok=True)
+        old_segments = self._segments()
+        segment = old_segments[-1] + 1 if old_segments else 1
+        segment_file = open(self._segment_path(segment), 'wb')
+        index = {}
+        lines = []
+        try:
+            for key, raw in items:
+                if segment_file.tell() >= self.SEGMENT_MAX_BYTES:
+                    segment_file.close()
+                    segment += 1
+                    segment_file = open(self._segment_path(segment), 'wb')
+                encoded_key = key.encode()
+                segment_file.write(self._HEADER.pack(len(encoded_key), len(raw)))
+                segment_file.write(encoded_key)
+                value_offset = segment_file.tell()
+                segment_file.write(raw)
+                index[key] = (segment, value_offset, len(raw))
+                lines.append(json.dumps([key, segment, value_offset, len(raw)]) + '\n')
+        finally:
+            segment_file.close()
+        tmp_index_path = self._index_path() + '.tmp'
+        with open(tmp_index_path, 'w') as index_file:
+            index_file.writelines(lines)
+        replace(tmp_index_path, self._index_path())
+        for old_segment in old_segments:
+            remove(self._segment_path(old_segment))
+        self._index = index
+        self._segment = segment
+        self._total_bytes = sum(getsize(self._segment_path(s)) for s in self._segments())
+        self._live_bytes = sum(length for _, _, length in index.values())
+
+_SEGMENT_STORES = {}
+_SEGMENT_STORES_LOCK = threading.Lock()
+
+def get_segment_store(path):
+    """Return the segment store of a path, shared by every cache of the same path.
+
+    Separate stores of a path would drop segments that the others still index
+    when they compact.
+    """
+    path = abspath(path)
+    with _SEGMENT_STORES_LOCK:
+        if path not in _SEGMENT_STORES:
+            _SEGMENT_STORES[path] = SegmentStore(path)
+        return _SEGMENT_STORES[path]
+
+class SegmentLib:
+    """Storage of a cache as a directory of append-only segments."""
+    def store(self, file_path):
+        return get_segment_store(file_path)
+
+    def load(self, file_path):
+        return dict(self.store(file_path).items())
+
+    def dump(self, data, file_path):
+        self.store(file_path).rewrite(data)
+
+def get_json_lib(file_path):
+    """Return the storage library that matches the extension of a cache path."""
+    _, extension = splitext(file_path)
+    if extension == '.zip':
+        return ZipLib()
+    if extension == SEGMENTS_EXTENSION:
+        return SegmentLib()
+    return JsonLib()
+
 class Cache():
     """Cache in json."""
     def __init__(self, storage_path):
         self.storage_path = storage_path
-        _, extension = splitext(storage_path)
-        if extension == '.zip':
-            self._json_lib = ZipLib()
-        else:
-            self._json_lib = JsonLib()
+        self._json_lib = get_json_lib(storage_path)
         self._data = None
 
     @property
@@ -58,22 +342,94 @@ class Cache():
         self._data = cache
     
     def set_storage_path(self, path):
+        self.set_data(self.data)
         self.storage_path = path
+        self._json_lib = get_json_lib(path)
+
+    def _segments(self):
+        """Return the segment store backing this cache, if any."""
+        if isinstance(self._json_lib, SegmentLib):
+            return self._json_lib.store(self.storage_path)
+        return None
 
     def get_value(self, key):
         """Return value for given key."""
+        segments = self._segments()
+        if segments is not None and self._data is None:
+            return segments.get(key)
         return self.data.get(key)
 
+    def keys(self):
+        """Return all cached keys."""
+        segments = self._segments()
+        if segments is not None and self._data is None:
+            return segments.keys()
+        return list(self.data.keys())
+
+    def get_digest(self, key):
+        """Return a hash of the content stored for given key, None if missing.
+
+        Segment caches hash the stored bytes without decoding the value. JSON
+        and zip caches decode the whole cache, see get_storage_digest.
+        """
+        segments = self._segments()
+        if segments is not None and self._data is None:
+            raw = segments.get_raw(key)
+        else:
+            value = self.data.get(key)
+            raw = None if value is None else json.dumps(value, sort_keys=True).encode()
+        if raw is None:
+            return None
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def get_storage_digest(self):
+        """Return a hash of a whole JSON or zip cache as stored, without decoding it.
+
+        Reports of a stored cache with the same hash are unchanged. Returns None
+        for segment caches, which have digests per key, and for caches already
+        loaded, which may differ from the stored ones.
+        """
+        if self._segments() is not None or self._data is not None \
+                or not exists(self.storage_path):
+            return None
+        if isinstance(self._json_lib, ZipLib):
+            with ZipFile(self.storage_path, 'r') as myzip:
+                member = myzip.getinfo(change_extension(self.storage_path, '.json'))
+                return f"zip:{member.CRC:08x}:{member.file_size}"
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.storage_path, 'rb') as cache_file:
+            for chunk in iter(lambda: cache_file.read(1 << 20), b''):
+                digest.update(chunk)
+        return "json:" + digest.hexdigest()
+
     def set_value(self, key, value):
         """Set value for given key."""
+        segments = self._segments()
+        if segments is not None:
+            segments.put(key, value)
+            if self._data is not None:
+                self._data[key] = value
+            return
         self.data[key] = value
         self.save_data()
 
     def remove_key(self, key):
         """Remove a key from cache."""
+        segments = self._segments()
+        if segments is not None:
+            segments.delete(key)
+            if self._data is not None:
+                del self._data[key]
+            return
         del self.data[key]
         self.save_data()
 
+    def compact(self):
+        """Drop stale records of append-only storages."""
+        segments = self._segments()
+        if segments is not None:
+            segments.compact()
+
     def save_data(self):
         """Store data in designated json file."""
         self._json_lib.dump(self.data, self.storage_path)
@@ -89,18 +445,119 @@ class BCHCache(Cache):
     """Cache for Better Code Hub results"""
     def get_stored_commit_analysis(self, user, project, commit_sha):
         """Get analysis results of commit that were previously processed."""
-        key = BCHCache._get_commit_analysis_storage_key(user, project, commit_sha)
+        key = BCHCache.get_commit_analysis_storage_key(user, project, commit_sha)
         return self.get_value(key)
 
     def store_commit_analysis(self, user, project, commit_sha, report):
         """Store better code hub result."""
-        key = BCHCache._get_commit_analysis_storage_key(user, project, commit_sha)
+        key = BCHCache.get_commit_analysis_storage_key(user, project, commit_sha)
         self.set_value(key, report)
 
     @staticmethod
-    def _get_commit_analysis_storage_key(user, project, commit_sha):
+    def get_commit_analysis_storage_key(user, project, commit_sha):
+        """Key of the report of a commit."""
         return '/'.join([user, project, commit_sha])
 
+def _iter_json_object(text_file, chunk_size=1 << 20):
+    """Iterate over the (key, value) pairs of a JSON object without loading it whole."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = text_file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+        return not eof
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+        if position == len(buffer):
+            raise ValueError("Unexpected end of JSON cache.")
+
+    def skip(expected=None):
+        nonlocal position
+        skip_whitespace()
+        char = buffer[position]
+        if expected is not None and char not in expected:
+            raise ValueError(f"Unexpected '{char}' in JSON cache.")
+        position += 1
+        return char
+
+    def decode():
+        nonlocal position
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof or not fill():
+                    raise
+                continue
+            if end == len(buffer) and not eof and fill():
+                continue  # a number might continue in the next chunk
+            position = end
+            return value
+
+    skip('{')
+    if skip() == '}':
+        return
+    position -= 1
+    while True:
+        key = decode()
+        skip(':')
+        yield key, decode()
+        if skip(',}') == '}':
+            return
+
+def iter_cache_records(file_path):
+    """Iterate over the (key, value) records of a cache, one at a time."""
+    _, extension = splitext(file_path)
+    if extension == SEGMENTS_EXTENSION:
+        yield from get_segment_store(file_path).items()
+    elif extension == '.zip':
+        with ZipFile(file_path, 'r') as myzip:
+            with myzip.open(change_extension(file_path, '.json'), 'r') as cache_file:
+                yield from _iter_json_object(io.TextIOWrapper(cache_file, encoding='utf-8'))
+    else:
+        with open(file_path, 'r') as cache_file:
+            yield from _iter_json_object(cache_file)
+
+def _write_json_object(text_file, items):
+    text_file.write('{')
+    for count, (key, value) in enumerate(items):
+        text_file.write((', ' if count else '') + json.dumps(key) + ': ' + value)
+    text_file.write('}')
+
+def write_cache_records(file_path, store):
+    """Write all records of a segment store to a cache of any format in one pass."""
+    _, extension = splitext(file_path)
+    if extension == SEGMENTS_EXTENSION:
+        get_segment_store(file_path).rewrite_raw((key, store.get_raw(key)) for key in store.keys())
+        return
+    items = ((key, store.decode_raw(store.get_raw(key))) for key in store.keys())
+    if extension == '.zip':
+        with ZipFile(file_path, 'w', compression=ZIP_DEFLATED) as myzip:
+            with myzip.open(change_extension(file_path, '.json'), 'w') as cache_file:
+                with io.TextIOWrapper(cache_file, encoding='utf-8') as text_file:
+                    _write_json_object(text_file, items)
+    else:
+        with open(file_path, 'w') as cache_file:
+            _write_json_object(cache_file, items)
+
+def convert_cache(source_path, output_path):
+    """Copy a cache into another storage format (e.g., .zip to .seg)."""
+    cache = Cache(source_path)
+    cache.set_storage_path(output_path)
+    cache.save_data()
+    return cache
+
 if __name__ == "__main__":
     # execute only if run as a script
     cache = Cache('./cache_test.zip')
@@ -0,0 +1,132 @@
+"""Per-repository index of commit metadata.
+
+The index is built from a single streaming `git log --numstat` pass over a
+local clone and persisted as JSON lines in the git directory of the clone.
+Later updates only log the commits that are not reachable from the tips that
+were already indexed (e.g., after a fetch).
+"""
+
+import codecs
+import json
+import os
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timezone
+
+from git import Repo
+
+from maintainability import log
+from maintainability.jsonl import read_json_lines
+
+INDEX_FILE = 'commit_index.jsonl'
+
+Commit = namedtuple('Commit', ['sha', 'parents', 'date', 'files', 'additions', 'deletions', 'message'])
+
+_RECORD_SEPARATOR = '\x1e'
+_FIELD_SEPARATOR = '\x1f'
+_LOG_FORMAT = '%x1e%H%x1f%P%x1f%at%x1f%B%x1f'
+_CHUNK_SIZE = 1 << 16
+
+class CommitIndex:
+    """Commit metadata (parents, author date, diff size) of a local clone."""
+
+    def __init__(self, repo_dir, rev='HEAD'):
+        self.repo = Repo(repo_dir)
+        self.rev = rev
+        self.path = os.path.join(self.repo.git_dir, INDEX_FILE)
+        self._commits = OrderedDict()
+        self._tips = []
+        self._load()
+        self.update()
+
+    def __contains__(self, commit_sha):
+        return commit_sha in self._commits
+
+    def __len__(self):
+        return len(self._commits)
+
+    def get(self, commit_sha):
+        """Return indexed metadata of a commit or None."""
+        return self._commits.get(commit_sha)
+
+    def shas(self):
+        """Return all indexed commit shas."""
+        return list(self._commits.keys())
+
+    def first_parent(self, commit_sha):
+        """Return the first parent of a commit, None for root commits."""
+        commit = self._commits.get(commit_sha)
+        if commit is None or not commit.parents:
+            return None
+        return commit.parents[0]
+
+    def get_date(self, commit_sha):
+        """Return the author date of a commit as a naive UTC datetime."""
+        date = datetime.fromtimestamp(self._commits[commit_sha].date, timezone.utc)
+        return date.replace(tzinfo=None)
+
+    def update(self, rev=None):
+        """Index commits reachable from rev that are not indexed yet."""
+        tip = self.repo.commit(rev or self.rev).hexsha
+        if tip in self._commits:
+            return 0
+        exclude = ['^' + known_tip for known_tip in self._tips]
+        count = 0
+        with open(self.path, 'a') as index_file:
+            for commit in self._log([tip] + exclude):
+                self._commits[commit.sha] = commit
+                index_file.write(json.dumps(commit._asdict()) + '\n')
+                count += 1
+            self._tips.append(tip)
+            index_file.write(json.dumps({'tip': tip}) + '\n')
+        log.info(f"Indexed {count} commits of {self.repo.working_dir}.")
+        return count
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            records = read_json_lines(self.path)
+        except ValueError as error:
+            log.warning(f"{error} Indexing {self.repo.working_dir} again.")
+            os.remove(self.path)
+            return
+        for record in records:
+            if 'tip' in record:
+                self._tips.append(record['tip'])
+            else:
+                self._commits[record['sha']] = Commit(**record)
+
+    def _log(self, revs):
+        """Stream commits from git log, merges are compared to their first parent."""
+        process = self.repo.git.log(
+            *revs, '--numstat', '--diff-merges=first-parent', f'--format={_LOG_FORMAT}',
+            as_process=True
+        )
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buffer = ''
+        while True:
+            chunk = process.stdout.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += decoder.decode(chunk)
+            *records, buffer = buffer.split(_RECORD_SEPARATOR)
+            for record in records:
+                if record:
+                    yield _parse_record(record)
+        if buffer:
+            yield _parse_record(buffer)
+        process.wait()
+
+def _parse_record(record):
+    sha, parents, timestamp, message, numstat = record.split(_FIELD_SEPARATOR)
+    files = additions = deletions = 0
+    for line in numstat.splitlines():
+        stats = line.split('\t')
+        if len(stats) < 3:
+            continue
+        files += 1
+        # binary files have no line counts
+        additions += int(stats[0]) if stats[0] != '-' else 0
+        deletions += int(stats[1]) if stats[1] != '-' else 0
+    return Commit(sha, parents.split(), int(timestamp), files, additions, deletions,
+                  message.strip())
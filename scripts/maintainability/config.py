@@ -1,18 +1,58 @@
-"""Module to read config file."""
+"""Module to read config file.
+
+The file is parsed once and reloaded whenever its modification time changes,
+so refreshed credentials are picked up by running workers.
+"""
 
 import json
 import os
+import threading
+import time
 
 from maintainability import log
 
 SCRIPT_DIR = os.path.dirname(__file__)
 CONFIG_PATH = os.path.join(SCRIPT_DIR, './config.json')
+POLL_INTERVAL = 2
+
+_LOCK = threading.Lock()
+_CONFIG = {}
+_MTIME = None
+
+def load():
+    """Return the parsed config file, reloading it if it has changed."""
+    global _CONFIG, _MTIME
+    mtime = os.stat(CONFIG_PATH).st_mtime_ns
+    with _LOCK:
+        if mtime != _MTIME:
+            with open(CONFIG_PATH) as config_file:
+                _CONFIG = json.load(config_file)
+            if _MTIME is not None:
+                log.info("Reloaded config file.")
+            _MTIME = mtime
+        return _CONFIG
 
-def get(property):
+def get_version():
+    """Return an identifier of the currently loaded config."""
+    load()
+    return _MTIME
+
+def get(property, default=None):
     """Get value of a configuration property."""
-    with open(CONFIG_PATH) as config_file:
-        config = json.load(config_file)
-        value = config.get(property)
-        if not value:
-            log.warning("No config value found for {}.".format(property))
-        return value
+    value = load().get(property, default)
+    if not value:
+        log.warning("No config value found for {}.".format(property))
+    return value
+
+def wait_for_change(version=None, timeout=None):
+    """Block until the config file differs from `version` (default: current one).
+
+    Return True if it changed, False on timeout.
+    """
+    version = get_version() if version is None else version
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while get_version() == version:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_INTERVAL)
+    return True
@@ -8,7 +8,9 @@ from contexttimer import timer
 import pandas as pd
 import click
 
-from maintainability import ghutils, gitutils, log
+from maintainability import ghutils, log
+from maintainability.commit_index import CommitIndex
+from maintainability.journal import Journal
 
 CLONAGE_DIR = "./tmp"
 
@@ -20,27 +22,33 @@ CLONAGE_DIR = "./tmp"
 def tool(security_dataset, regular_dataset):
     """CLI to collect random commits and analyze maintainability."""
     df = pd.read_csv(security_dataset)
-    add_random_regular_commits(df, regular_dataset)
+    journal = Journal(regular_dataset, df)
+    try:
+        add_random_regular_commits(df, journal)
+    except:
+        journal.close()
+        raise
+    journal.close(df)
 
 @timer()
-def add_random_regular_commits(rows, regular_dataset):
+def add_random_regular_commits(rows, journal):
     """Add refactoring commits in the dataset."""
     log.info(f"Will analyze {len(rows)} commits.")
     for i, row in rows[~pd.notnull(rows['sha-reg'])][::-1].iterrows():        
-        if 'random_commit' not in row.keys():
+        if 'random_commit' not in row.keys() and i not in journal:
             user = row['owner']
             project = row['project']
             with ghutils.GithubCloneRepoPersistent(user, project, CLONAGE_DIR):
                 try:
-                    commits = gitutils.get_all_commits('.')
-                    regular_commit = random.choice(commits)
-                    rows.at[i, 'sha-reg'] = regular_commit
-                    rows.at[i, 'sha-reg-p'] = gitutils.resolve_commit('.', f"{regular_commit}^1")
-                except:
-                    rows.at[i, 'sha-reg'] = 'Error'
-                    rows.at[i, 'sha-reg-p'] = 'Error'
-                    import pdb; pdb.set_trace()
-        rows.to_csv(regular_dataset, index=False)
+                    index = CommitIndex('.')
+                    regular_commit = random.choice(index.shas())
+                    journal.record(i, **{
+                        'sha-reg': regular_commit,
+                        'sha-reg-p': index.first_parent(regular_commit),
+                    })
+                except Exception as error:
+                    log.error(f"Could not pick a random commit of {user}/{project}: {error}")
+                    journal.record(i, **{'sha-reg': 'Error', 'sha-reg-p': 'Error', 'ERROR': 'YES'})
 
 if __name__ == '__main__':
     tool() # pylint: disable=no-value-for-parameter
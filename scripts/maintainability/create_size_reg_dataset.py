@@ -10,7 +10,9 @@ import click
 import time
 import pandas as pd
 
-from maintainability import ghutils, gitutils, log
+from maintainability import ghutils, log
+from maintainability.commit_index import CommitIndex
+from maintainability.journal import Journal
 
 CLONAGE_DIR = "./tmp"
 
@@ -22,72 +24,79 @@ CLONAGE_DIR = "./tmp"
 def tool(security_dataset, regular_dataset):
     """CLI to collect random commits and analyze maintainability."""
     df = pd.read_csv(security_dataset)
-    rows = add_random_regular_commits(df, regular_dataset)
+    journal = Journal(regular_dataset, df)
+    try:
+        add_random_regular_commits(df, journal)
+    except:
+        journal.close()
+        raise
+    journal.close(df)
+    ghutils.log_cache_stats()
+
+def _get_diff_size(commit):
+    """Return files changed, additions and deletions of an indexed commit."""
+    return commit.files, commit.additions, commit.deletions
 
 @timer()
-def add_random_regular_commits(rows, regular_dataset):
+def add_random_regular_commits(rows, journal):
     """Add refactoring commits in the dataset."""
     log.info(f"Will analyze {len(rows)} commits.")
 
     for i, row in rows.iterrows():        
-        if 'random_commit' not in row.keys() and row['reg'] != 'FOUND':
+        if 'random_commit' not in row.keys() and row['reg'] != 'FOUND' and i not in journal:
             user = row['owner']
             project = row['project']
             sha = row['sha']
             sha_p = row['sha-p']
 
-            repo = ghutils.get_repo(user, project)
-            print(user, project, sha, sha_p)
-            diff_files = repo.compare(sha_p, sha).files
-            size = len(diff_files)
-            adds = sum([i.additions for i in diff_files])
-            dels = sum([i.deletions for i in diff_files])
-            print(user, project, sha, sha_p, adds, dels)
-
             with ghutils.GithubCloneRepoPersistent(user, project, CLONAGE_DIR):
 
-                commits = gitutils.get_all_commits('.')
+                index = CommitIndex('.')
+                if sha in index and index.first_parent(sha) == sha_p:
+                    size, adds, dels = _get_diff_size(index.get(sha))
+                else:
+                    repo = ghutils.get_repo(user, project)
+                    diff_files = ghutils.compare(repo, sha_p, sha).files
+                    size = len(diff_files)
+                    adds = sum([i.additions for i in diff_files])
+                    dels = sum([i.deletions for i in diff_files])
+                log.info(f"{user}/{project} {sha}: {adds} additions, {dels} deletions.")
+
+                commits = index.shas()
                 
                 count = 0; step = 1; limit = 301
                 while count < limit:
 
                     regular_commit = random.choice(commits)
-                    regular_commit_parent = gitutils.resolve_commit('.', f"{regular_commit}^1")
-
-                    if regular_commit_parent == None:
-                        continue
+                    regular_commit_parent = index.first_parent(regular_commit)
 
-                    diff_files_reg = repo.compare(regular_commit_parent, regular_commit).files
+                    # root commits have no diff to compare
+                    if regular_commit_parent != None and sha != regular_commit:
+                        size_reg, adds_reg, dels_reg = _get_diff_size(index.get(regular_commit))
 
-                    size_reg = len(diff_files_reg)
-                    adds_reg = sum([i.additions for i in diff_files_reg])
-                    dels_reg = sum([i.deletions for i in diff_files_reg])
+                        adds_reg_n = [adds+i for i in range(-step, 1+step, 1) if adds+i > 0]
+                        dels_reg_n = [dels+i for i in range(-step, 1+step, 1) if dels+i > 0]
 
-                    adds_reg_n = [adds+i for i in range(-step, 1+step, 1) if adds+i > 0]
-                    dels_reg_n = [dels+i for i in range(-step, 1+step, 1) if dels+i > 0]
-
-                    if adds_reg in adds_reg_n and dels_reg in dels_reg_n and sha != regular_commit:
-                        print('match')
-                        print(user, project, regular_commit, regular_commit_parent, adds_reg, dels_reg)
-                        rows.at[i, 'sha-reg'] = regular_commit
-                        rows.at[i, 'sha-reg-p'] = regular_commit_parent
-                        rows.at[i, 'reg'] = 'FOUND'
-                        break
-                    else:
-                        print('no match', adds_reg, dels_reg)
+                        if adds_reg in adds_reg_n and dels_reg in dels_reg_n:
+                            log.success(f"Found {regular_commit} with {adds_reg} additions"
+                                        f" and {dels_reg} deletions.")
+                            journal.record(i, **{
+                                'sha-reg': regular_commit,
+                                'sha-reg-p': regular_commit_parent,
+                                'reg': 'FOUND',
+                            })
+                            break
 
                     count+=1
 
                     if count % 10 == 0:
                         step+=1
-                        print('Step growth. step =', step)
 
                     if count == limit:
-                        rows.at[i, 'reg'] = 'REPEAT'
+                        log.warning(f"No commit of similar size found in {user}/{project}.")
+                        journal.record(i, reg='REPEAT')
 
-        rows.to_csv(regular_dataset, index=False)
-                
-    return rows
+    return journal.apply(rows)
     
 if __name__ == '__main__':
     tool() # pylint: disable=no-value-for-parameter
@@ -2,54 +2,135 @@
 
 import csv
 import logging
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 from contexttimer import timer
 import pandas as pd
 
-from maintainability import log
+from maintainability import ghutils, log
+from maintainability.journal import Journal
 import maintainability.better_code_hub as bch
 
 RETRY_ATTEMPTS = 10
+MESSAGE_TIMEOUT = 1 # seconds between checks of the workers
 
 @click.command()
 @click.option('--dataset', prompt=True, default="../dataset/db_release_security_fixes.csv",
               help="Dataset with commits for comparison.")
 @click.option('--commit', prompt=True, default="security",
               help="type of dataset")
-def tool(dataset, commit):
+@click.option('--workers', default=1, show_default=True,
+              help="Number of forks analyzed in parallel.")
+def tool(dataset, commit, workers):
     """CLI to evaluate maintainability."""
     log.info('Starting dataset analysis!')
     logging.basicConfig(level='INFO')
+    bch.migrate_legacy_cache()
     df = pd.read_csv(dataset)
-    collect_maintainability(df, commit, dataset)
+    journal = Journal(dataset, df)
+    try:
+        if workers > 1:
+            collect_maintainability_parallel(df, commit, journal, workers)
+        else:
+            collect_maintainability(df, commit, journal)
+    except:
+        journal.close()
+        raise
+    journal.close(df)
+    ghutils.log_cache_stats()
+
+def _get_commit_shas(row, commit):
+    if commit == 'regular':
+        return row['sha-reg'], row['sha-reg-p']
+    return row['sha'], row['sha-p']
 
 @timer()
-def collect_maintainability(rows, commit, dataset):
+def collect_maintainability(rows, commit, journal, services=None):
     """Collect maintainability of regular/random commits"""
-    for i, row in rows[::-1].iterrows():        
+    for i, row in rows[::-1].iterrows():
+        if i in journal:
+            continue
         user = row['owner']
         project = row['project']
-        
-        if commit == 'regular':            
-            commit_sha = row['sha-reg']
-            parent_commit_sha = row['sha-reg-p']
-        else:
-            commit_sha = row['sha']
-            parent_commit_sha = row['sha-p']
-               
+        commit_sha, parent_commit_sha = _get_commit_shas(row, commit)
+
         try:
-            bch.robust_analyze_commit(user, project, commit_sha)
-            bch.robust_analyze_commit(user, project, parent_commit_sha)
+            bch.robust_analyze_commit(user, project, commit_sha, services=services)
+            bch.robust_analyze_commit(user, project, parent_commit_sha, services=services)
+            journal.record(i)
         except Exception as error:
             log.error(error)
-            rows.at[i, 'ERROR'] = 'YES'
+            journal.record(i, ERROR='YES')
             log.error("Exception not expected")
             if not isinstance(error, bch.BetterCodeHubException):
                 import pdb; pdb.set_trace()
             log.error(f"Skipping {user}/{project}.")
-        
-        rows.to_csv(dataset, index=False)
+
+def _group_rows_by_fork(rows, journal):
+    """Group row indexes by the fork used to analyze them.
+
+    Forks are named after the project, so rows of projects with the same name
+    share a fork (and a default branch) even if their owners differ.
+    """
+    groups = OrderedDict()
+    for i, row in rows[::-1].iterrows():
+        if i not in journal:
+            groups.setdefault(row['project'], []).append(i)
+    return groups
+
+def _analyze_fork_rows(rows, indexes, commit, messages, services):
+    """Analyze rows of one fork, one commit at a time."""
+    def store(user, project, commit_sha, report):
+        messages.put(('report', user, project, commit_sha, report))
+
+    for i in indexes:
+        try:
+            row = rows.loc[i]
+            for commit_sha in _get_commit_shas(row, commit):
+                bch.robust_analyze_commit(row['owner'], row['project'], commit_sha, store=store,
+                                          services=services)
+            messages.put(('row', i, None))
+        except Exception as error:
+            messages.put(('row', i, error))
+
+@timer()
+def collect_maintainability_parallel(rows, commit, journal, workers, services=None):
+    """Collect maintainability with several forks analyzed at the same time.
+
+    Commits of the same fork are analyzed serially since each scan changes the
+    default branch of the fork. Reports are stored by this thread only.
+    """
+    services = services or bch.SERVICES
+    messages = queue.Queue()
+    groups = _group_rows_by_fork(rows, journal)
+    pending = sum(len(indexes) for indexes in groups.values())
+    log.info(f"Analyzing {pending} rows from {len(groups)} forks with {workers} workers.")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_analyze_fork_rows, rows, indexes, commit, messages, services)
+                   for indexes in groups.values()]
+        while pending:
+            try:
+                kind, *content = messages.get(timeout=MESSAGE_TIMEOUT)
+            except queue.Empty:
+                if all(future.done() for future in futures):
+                    for future in futures:
+                        future.result() # raises the error of a failed worker
+                    raise RuntimeError(f"Workers stopped with {pending} rows left.")
+                continue
+            if kind == 'report':
+                services.cache.store_commit_analysis(*content)
+                continue
+            i, error = content
+            pending -= 1
+            if error is None:
+                journal.record(i)
+            else:
+                log.error(error)
+                journal.record(i, ERROR='YES')
+                log.error(f"Skipping {rows.at[i, 'owner']}/{rows.at[i, 'project']}.")
 
 if __name__ == '__main__':
     tool() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,383 @@
+"""Local stand-ins for BCH and GitHub, to run the collection end to end.
+
+FakeGitHub serves the repo, fork, branch and default branch endpoints used by
+ghutils, backed by bare repositories exported by a local `git daemon` (so
+gitutils can fetch from and push to them). FakeBCH schedules scans of the
+default branch of those repositories and serves their reports once a random
+scan duration has passed. Both servers can add latency and inject failures.
+
+Point the pipeline to them with `bettercodehub_url`, `github_api_url` and
+`github_url` in the config file.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import click
+import numpy as np
+
+from maintainability import log
+from maintainability.better_code_hub import BALANCE_GUIDELINE, ZERO_SCORE_GUIDELINES
+from maintainability.unit_metrics import GUIDELINES as UNIT_GUIDELINES
+from stats import enum
+
+GUIDELINES = list(enum.guidelines) + list(ZERO_SCORE_GUIDELINES)
+_, _, THRESHOLDS = UNIT_GUIDELINES['Write Short Units of Code']
+FAKE_LOGIN = 'fake-bot'
+
+def generate_report(rng, sha):
+    """Random report with the schema of BCH reports."""
+    loc = int(rng.integers(500, 200000))
+    results = []
+    for guideline in GUIDELINES:
+        if guideline == BALANCE_GUIDELINE:
+            # component sizes instead of a risk profile
+            volumes = rng.integers(0, loc, int(rng.integers(1, 12))).tolist()
+        else:
+            volumes = rng.multinomial(loc, rng.dirichlet([8, 3, 2, 1])).tolist()
+        results.append({'guideline': guideline, 'qualityProfileVolume': volumes,
+                        'qualityProfileComplianceThresholds': THRESHOLDS})
+    return {'sha': sha, 'analysisResults': results}
+
+def _get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _git(*args, cwd=None):
+    return subprocess.run(['git'] + list(args), cwd=cwd, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, payload, headers = self.server.service.serve(
+            self.command, urlparse(self.path).path, json.loads(body) if body else None,
+            self.headers
+        )
+        content = b'' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if content:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeService:
+    """HTTP server in a background thread with latency and failure injection.
+
+    Each request waits `latency` plus up to `jitter` seconds. `failures` maps
+    HTTP statuses to the probability of answering with them; subclasses
+    decide which endpoints they apply to.
+    """
+
+    def __init__(self, latency=0, jitter=0, failures=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failures = dict(failures or {})
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve(self, method, path, body, headers):
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        status, payload, response_headers = self.handle(method, path, body, headers)
+        with self._lock:
+            self.stats[f"{method} {self.get_endpoint(path)} {status}"] += 1
+        return status, payload, response_headers
+
+    def inject_failure(self, statuses):
+        """Return one of the given statuses with its failure probability, or None."""
+        with self._lock:
+            draw = self._random.random()
+        for status in statuses:
+            rate = self.failures.get(status, 0)
+            if draw < rate:
+                return status
+            draw -= rate
+        return None
+
+    def handle(self, method, path, body, headers):
+        raise NotImplementedError
+
+    def get_endpoint(self, path):
+        return path
+
+class FakeGitHub(FakeService):
+    """GitHub API of repositories in `root` (owner/name.git), served by git daemon.
+
+    Failures of any status in `failures` are injected in every API request.
+    """
+
+    def __init__(self, root, login=FAKE_LOGIN, **kwargs):
+        super().__init__(**kwargs)
+        self.root = os.path.abspath(root)
+        self.login = login
+        self.parents = {}
+        self._repos_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.git_port = _get_free_port()
+        self._daemon = None
+
+    @property
+    def git_url(self):
+        return f"git://127.0.0.1:{self.git_port}"
+
+    def start(self):
+        self._daemon = subprocess.Popen(
+            ['git', 'daemon', '--reuseaddr', '--export-all', '--enable=receive-pack',
+             '--max-connections=0', '--listen=127.0.0.1', f'--port={self.git_port}',
+             f'--base-path={self.root}', self.root],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.git_port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        return super().start()
+
+    def stop(self):
+        super().stop()
+        if self._daemon is not None:
+            self._daemon.terminate()
+            self._daemon.wait()
+
+    def add_repository(self, owner, name, source):
+        """Serve a bare copy of a local repository as owner/name."""
+        _git('clone', '--bare', '--quiet', os.path.abspath(source), self._path(owner, name))
+        return f"{owner}/{name}"
+
+    def get_head(self, owner, name):
+        """Sha of the default branch of a repository, None if it does not exist."""
+        path = self._path(owner, name)
+        if not os.path.exists(path):
+            return None
+        return _git('rev-parse', 'HEAD', cwd=path)
+
+    def _path(self, owner, name):
+        return os.path.join(self.root, owner, name + '.git')
+
+    def _repo(self, owner, name, parent=True):
+        path = self._path(owner, name)
+        full_name = f"{owner}/{name}"
+        url = f"{self.url}/repos/{full_name}"
+        repo = {
+            'id': int(hashlib.md5(full_name.encode()).hexdigest()[:8], 16),
+            'name': name, 'full_name': full_name, 'private': False,
+            'owner': {'login': owner, 'type': 'User', 'url': f"{self.url}/users/{owner}"},
+            'url': url, 'html_url': f"{self.git_url}/{full_name}",
+            'clone_url': f"{self.git_url}/{full_name}.git",
+            'git_url': f"{self.git_url}/{full_name}.git",
+            'default_branch': _git('symbolic-ref', '--short', 'HEAD', cwd=path),
+            'fork': full_name in self.parents,
+        }
+        if parent and full_name in self.parents:
+            repo['parent'] = self._repo(*self.parents[full_name].split('/'), parent=False)
+        return repo
+
+    def get_endpoint(self, path):
+        return re.sub(r'^/repos/[^/]+/[^/]+', '/repos/{repo}',
+                      re.sub(r'/branches/.+$', '/branches/{branch}', path))
+
+    def handle(self, method, path, body, headers):
+        failure = self.inject_failure(sorted(self.failures))
+        if failure is not None:
+            return failure, {'message': 'Injected failure'}, {}
+        if path == '/user':
+            return 200, {'login': self.login, 'type': 'User', 'url': f"{self.url}/user"}, {}
+        match = re.match(r'^/repos/([^/]+)/([^/]+)(/.*)?$', path)
+        if not match or not os.path.exists(self._path(match.group(1), match.group(2))):
+            return 404, {'message': 'Not Found'}, {}
+        owner, name, rest = match.groups()
+        if method == 'GET' and not rest:
+            repo = self._repo(owner, name)
+            etag = '"{}"'.format(hashlib.md5(json.dumps(repo, sort_keys=True).encode())
+                                 .hexdigest())
+            if headers.get('If-None-Match') == etag:
+                return 304, None, {'ETag': etag}
+            return 200, repo, {'ETag': etag}
+        if method == 'GET' and rest and rest.startswith('/branches/'):
+            return self._branch(owner, name, rest[len('/branches/'):])
+        with self._repos_lock:
+            if method == 'PATCH' and not rest:
+                return self._edit(owner, name, body or {})
+            if method == 'POST' and rest == '/forks':
+                return self._fork(owner, name)
+        return 404, {'message': 'Not Found'}, {}
+
+    def _edit(self, owner, name, body):
+        path = self._path(owner, name)
+        branch = body.get('default_branch')
+        if branch:
+            try:
+                _git('rev-parse', '--verify', '--quiet', f"refs/heads/{branch}", cwd=path)
+            except subprocess.CalledProcessError:
+                return 422, {'message': f"No branch {branch}"}, {}
+            _git('symbolic-ref', 'HEAD', f"refs/heads/{branch}", cwd=path)
+        return 200, self._repo(owner, name), {}
+
+    def _fork(self, owner, name):
+        fork = self._path(self.login, name)
+        if not os.path.exists(fork):
+            # the fork borrows the objects of its upstream, like GitHub forks
+            _git('clone', '--bare', '--shared', '--quiet', self._path(owner, name), fork)
+            self.parents[f"{self.login}/{name}"] = f"{owner}/{name}"
+        return 202, self._repo(self.login, name), {}
+
+    def _branch(self, owner, name, branch):
+        try:
+            sha = _git('rev-parse', '--verify', '--quiet', f"refs/heads/{branch}",
+                       cwd=self._path(owner, name))
+        except subprocess.CalledProcessError:
+            return 404, {'message': 'Branch not found'}, {}
+        return 200, {'name': branch, 'protected': False,
+                     'commit': {'sha': sha, 'url': f"{self.url}/repos/{owner}/{name}/commits/{sha}"}}, {}
+
+class FakeBCH(FakeService):
+    """BCH scan and report endpoints for the repositories of a FakeGitHub.
+
+    A scan reports the default branch at the time it is scheduled and takes
+    `scan_duration` (min, max) seconds. At most `max_scans` scans run at once,
+    further scans are rejected with 429 like BCH does. Injected failures are
+    429 and 412 for scans and 400 for reports.
+    """
+
+    def __init__(self, github, scan_duration=(1, 5), max_scans=None, **kwargs):
+        super().__init__(**kwargs)
+        self.github = github
+        self.scan_duration = scan_duration
+        self.max_scans = max_scans
+        self.scans = {}
+
+    def get_endpoint(self, path):
+        return re.sub(r'^/edge/report/.+$', '/edge/report/{repo}', path)
+
+    def handle(self, method, path, body, headers):
+        if method == 'POST' and path == '/edge/schedule/scan':
+            return self._schedule((body or {}).get('repositoryName', ''))
+        if method == 'GET' and path.startswith('/edge/report/'):
+            return self._report(path[len('/edge/report/'):])
+        if method == 'GET' and path == '/repositories':
+            return 200, {}, {}
+        return 404, {'message': 'Not Found'}, {}
+
+    def _schedule(self, full_name):
+        failure = self.inject_failure([429, 412])
+        if failure == 429:
+            return 429, {'message': 'Injected failure'}, {}
+        if failure == 412:
+            return 412, {'message': 'The repository contains no supported technologies.'}, {}
+        sha = self.github.get_head(*full_name.split('/', 1)) if '/' in full_name else None
+        if sha is None:
+            return 412, {'message': 'The repository contains no supported technologies.'}, {}
+        now = time.monotonic()
+        with self._lock:
+            running = sum(1 for scans in self.scans.values() for scan in scans if scan[0] > now)
+            if self.max_scans is not None and running >= self.max_scans:
+                return 429, {'message': 'Still busy with another project.'}, {}
+            duration = self._random.uniform(*self.scan_duration)
+            self.scans.setdefault(full_name, []).append((now + duration, sha))
+        return 200, {}, {}
+
+    def _report(self, full_name):
+        if self.inject_failure([400]):
+            return 400, {'message': 'Injected failure'}, {}
+        now = time.monotonic()
+        with self._lock:
+            finished = [sha for ready, sha in self.scans.get(full_name, []) if ready <= now]
+        if not finished:
+            return 400, {'message': 'The analysis is not ready yet.'}, {}
+        sha = finished[-1]
+        return 200, generate_report(np.random.default_rng(int(sha[:12], 16)), sha), {}
+
+def parse_failures(failures):
+    """Parse STATUS=RATE options."""
+    return {int(status): float(rate) for status, rate in (f.split('=') for f in failures)}
+
+@click.command()
+@click.option('--root', default='./fake_github', show_default=True,
+              help="Folder of the served repositories.")
+@click.option('--source', multiple=True, metavar='OWNER/NAME=PATH',
+              help="Local repository to serve, can be repeated.")
+@click.option('--latency', default=0.0, show_default=True, help="Seconds added to requests.")
+@click.option('--jitter', default=0.0, show_default=True, help="Random extra seconds.")
+@click.option('--scan-duration', nargs=2, type=float, default=(1, 5), show_default=True,
+              help="Minimum and maximum seconds of a scan.")
+@click.option('--max-scans', type=int, default=None, help="Scans running at the same time.")
+@click.option('--bch-failure', multiple=True, metavar='STATUS=RATE',
+              help="Inject 429, 412 (scan) or 400 (report) failures.")
+@click.option('--github-failure', multiple=True, metavar='STATUS=RATE',
+              help="Inject failures in GitHub API requests.")
+def tool(root, source, latency, jitter, scan_duration, max_scans, bch_failure, github_failure):
+    """CLI to serve fake BCH and GitHub services until interrupted."""
+    github = FakeGitHub(root, latency=latency, jitter=jitter,
+                        failures=parse_failures(github_failure))
+    for item in source:
+        full_name, path = item.split('=', 1)
+        if github.get_head(*full_name.split('/')) is None:
+            github.add_repository(*full_name.split('/'), path)
+    bch = FakeBCH(github, scan_duration=scan_duration, max_scans=max_scans, latency=latency,
+                  jitter=jitter, failures=parse_failures(bch_failure))
+    github.start()
+    bch.start()
+    log.success("Serving fake services, set in the config file:")
+    print(json.dumps({'bettercodehub_url': bch.url, 'github_api_url': github.url,
+                      'github_url': github.git_url}, indent=2))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bch.stop()
+        github.stop()
+        log.info(dict(bch.stats))
+        log.info(dict(github.stats))
+
+if __name__ == '__main__':
+    tool() # pylint: disable=no-value-for-parameter
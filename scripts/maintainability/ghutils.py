@@ -1,13 +1,29 @@
 """Functions to interact with the Github API."""
 
 import os
+import re
+from collections import Counter
 from urllib.parse import urlparse
-from github import Github
+from github import Github, Consts
+from github.Commit import Commit
+from github.Comparison import Comparison
+from github.GitCommit import GitCommit
 from github.GithubException import UnknownObjectException, GithubException
 from requests.exceptions import ReadTimeout
 from retry import retry
 
 from maintainability import log, config, gitutils
+from maintainability.cache import Cache
+
+SCRIPT_DIR = os.path.dirname(__file__)
+# `github_api_url` and `github_url` in the config file point to other servers
+GITHUB_URL = "https://github.com"
+# Responses addressed by commit shas never change, so they are cached forever.
+RESPONSES_CACHE = Cache(os.path.join(SCRIPT_DIR, "./github_cache.seg"))
+CACHE_STATS = Counter()
+
+_SHA_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+_REPOS = {}
 
 _GITHUB_API = None
 def _get_github_api():
@@ -16,17 +32,78 @@ def _get_github_api():
     global _GITHUB_API
     if _GITHUB_API is None:
         _GITHUB_API = Github(
-            login_or_token=config.get('github_token')
+            login_or_token=config.get('github_token'),
+            base_url=config.load().get('github_api_url', Consts.DEFAULT_BASE_URL)
         )
     return _GITHUB_API
 
-def get_repo(user, project):
-    """Get repo of a repository."""
+def get_repo(user, project, github=None):
+    """Get repo of a repository from `github` (default: the API of the config file).
+
+    Repos are kept in memory and revalidated with conditional requests
+    (If-None-Match), which do not count against the rate limit when the repo
+    did not change.
+    """
+    key = (github, f"{user}/{project}")
+    repo = _REPOS.get(key)
+    if repo is not None:
+        try:
+            CACHE_STATS['repo_modified' if repo.update() else 'repo_not_modified'] += 1
+            return repo
+        except GithubException:
+            del _REPOS[key]
+    CACHE_STATS['repo_miss'] += 1
     try:
-        return _get_github_api().get_user(user).get_repo(project)
+        repo = (github or _get_github_api()).get_repo(key[1])
     except:
-        pass
-    return None
+        return None
+    _REPOS[key] = repo
+    return repo
+
+def _get_immutable(kind, repo, key, request, klass):
+    """Get a response from the cache if it is addressed by commit shas."""
+    if not all(_SHA_PATTERN.match(sha) for sha in key.split('...')):
+        CACHE_STATS[f'{kind}_uncacheable'] += 1
+        return request()
+    cache_key = '/'.join([kind, repo.full_name, key])
+    raw_data = RESPONSES_CACHE.get_value(cache_key)
+    if raw_data is not None:
+        CACHE_STATS[f'{kind}_hit'] += 1
+        return _get_github_api().create_from_raw_data(klass, raw_data)
+    CACHE_STATS[f'{kind}_miss'] += 1
+    response = request()
+    RESPONSES_CACHE.set_value(cache_key, response.raw_data)
+    return response
+
+def compare(repo, base_sha, head_sha):
+    """Compare two commits of a repo."""
+    return _get_immutable('compare', repo, f"{base_sha}...{head_sha}",
+                          lambda: repo.compare(base_sha, head_sha), Comparison)
+
+def get_commit(repo, commit_sha):
+    """Get commit (with stats and files) of a repo."""
+    return _get_immutable('commit', repo, commit_sha,
+                          lambda: repo.get_commit(commit_sha), Commit)
+
+def get_git_commit(repo, commit_sha):
+    """Get git commit of a repo."""
+    return _get_immutable('git_commit', repo, commit_sha,
+                          lambda: repo.get_git_commit(commit_sha), GitCommit)
+
+def get_cache_stats():
+    """Return counts of cached GitHub requests and the share of saved requests."""
+    stats = dict(CACHE_STATS)
+    saved = sum(count for name, count in stats.items()
+                if name.endswith(('_hit', '_not_modified')))
+    total = sum(stats.values())
+    stats['hit_rate'] = saved / total if total else 0.0
+    return stats
+
+def log_cache_stats():
+    """Log how many GitHub requests were answered by caches."""
+    stats = get_cache_stats()
+    log.info("GitHub cache hit rate: {:.1%} {}".format(
+        stats.pop('hit_rate'), ', '.join(f"{k}={v}" for k, v in sorted(stats.items()))))
 
 def _get_path_items_from_url(url):
     parse = urlparse(url)
@@ -47,12 +124,12 @@ def get_commits_from_pull_request(pr_url):
         log.warning('Warning: merge commit is None:\n{}'.format(pr_url))
     base_commit = pull.base.sha
     try:
-        commit_url = repo.get_git_commit(merge_commit).html_url
+        commit_url = get_git_commit(repo, merge_commit).html_url
     except UnknownObjectException:
         merge_commit = pull.head.sha
-        commit_url = repo.get_git_commit(merge_commit).html_url
+        commit_url = get_git_commit(repo, merge_commit).html_url
         log.warning('Warning: merge commit is not reachable:\n{}'.format(pr_url))
-    base_commit_url = repo.get_git_commit(base_commit).html_url
+    base_commit_url = get_git_commit(repo, base_commit).html_url
     return commit_url, base_commit_url
 
 def get_repo_url_from_commit(commit_url):
@@ -62,7 +139,10 @@ def get_repo_url_from_commit(commit_url):
 
 def get_repo_url(user, project):
     """Get the Github repo url given its user and project name. """
-    return f"https://github.com/{user}/{project}.git"
+    # public clones do not need a config file
+    settings = config.load() if os.path.exists(config.CONFIG_PATH) else {}
+    github_url = settings.get('github_url', GITHUB_URL).rstrip('/')
+    return f"{github_url}/{user}/{project}.git"
 
 def parse_commit_url(url):
     """Parse commit url."""
@@ -72,7 +152,7 @@ def parse_commit_url(url):
 @retry(ReadTimeout, tries=3)
 def _get_commit(repo, commit_sha):
     try:
-        return repo.get_git_commit(commit_sha)
+        return get_git_commit(repo, commit_sha)
     except ReadTimeout:
         log.error("Error when trying to get commit {} from repo {}".format(commit_sha, repo))
         raise
@@ -99,18 +179,18 @@ def get_parent_commit(commit_url):
         return base_parent.html_url
     return None
 
-def get_logged_user():
+def get_logged_user(github=None):
     """Get Github user that is logged in."""
-    return _get_github_api().get_user()
+    return (github or _get_github_api()).get_user()
 
-def git_fork(user, project):
+def git_fork(user, project, github=None):
     """Fork Github project."""
-    repo = get_repo(user, project)
-    logged_user = get_logged_user()
-    forked_repo = get_repo(logged_user.login, project)
+    repo = get_repo(user, project, github)
+    logged_user = get_logged_user(github)
+    forked_repo = get_repo(logged_user.login, project, github)
     if forked_repo is None:
         logged_user.create_fork(repo)
-        forked_repo = get_repo(logged_user.login, project)
+        forked_repo = get_repo(logged_user.login, project, github)
     return forked_repo
 
 
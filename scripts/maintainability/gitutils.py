@@ -1,12 +1,20 @@
 """Utils to manipulate local git repos."""
 
-import tempfile
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
 
 from git import Repo
 from git.exc import GitCommandError
 
 from maintainability import log
 
+MIRROR_DIR = "./mirrors"
+
+_MIRROR_LOCKS = defaultdict(threading.Lock)
+_MIRROR_LOCKS_LOCK = threading.Lock()
+
 def git_clone(url, repo_dir):
     """Clone repo into a directory directory."""
     try:
@@ -61,24 +69,91 @@ class BranchAlreadyExists(GitUtilsExeption):
         self.commit_sha = commit_sha
         super().__init__()
 
-def create_branch_from_commit(repo_url, branch_name, commit_sha):
+class DefaultBranchNotFound(GitUtilsExeption):
+    """Exception raised when the default branch of a remote is unknown.
+
+    Attributes:
+        repo -- identification of the repo (e.g., url)
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        super().__init__(f"Could not find the default branch of {repo}.")
+
+def _get_mirror_path(repo_url, mirror_dir):
+    *_, user, project = urlparse(repo_url).path.rstrip('/').split('/')
+    if project.endswith('.git'):
+        project = project[:-len('.git')]
+    return os.path.join(os.path.abspath(mirror_dir or MIRROR_DIR), f"{user}___{project}.git")
+
+def _get_mirror_lock(path):
+    with _MIRROR_LOCKS_LOCK:
+        return _MIRROR_LOCKS[path]
+
+def _has_commit(repo, commit_sha):
+    try:
+        repo.git.cat_file('-e', f"{commit_sha}^{{commit}}")
+        return True
+    except GitCommandError:
+        return False
+
+def _disable_auto_gc(repo):
+    config = repo.config_reader('repository')
+    if not config.has_option('gc', 'auto') or config.get_value('gc', 'auto') != 0:
+        with repo.config_writer() as config:
+            config.set_value('gc', 'auto', 0)
+
+def get_mirror(repo_url, mirror_dir=None, alternate=None, commit_sha=None, shared=False):
+    """Get a bare mirror of a repo from the local pool.
+
+    The mirror is created on first use and then only updated with incremental
+    fetches, skipped when `commit_sha` is already available. A mirror of a
+    fork can borrow the objects of its upstream mirror (`alternate`), so it
+    only stores objects that are not in the upstream. Automatic gc is disabled
+    in `shared` mirrors (used as alternates), as it would delete objects of
+    pruned refs that forks still need.
+    """
+    path = _get_mirror_path(repo_url, mirror_dir)
+    with _get_mirror_lock(path):
+        if not os.path.exists(path):
+            repo = Repo.init(path, bare=True)
+            repo.create_remote('origin', repo_url)
+            repo.git.config('remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+            if alternate is not None:
+                alternates = os.path.join(path, 'objects', 'info', 'alternates')
+                with open(alternates, 'w') as alternates_file:
+                    alternates_file.write(os.path.join(alternate.git_dir, 'objects') + '\n')
+        repo = Repo(path)
+        if shared:
+            _disable_auto_gc(repo)
+        if commit_sha is None or not _has_commit(repo, commit_sha):
+            log.info(f"Fetching {repo_url} into {path}")
+            repo.git.fetch('origin', '--prune', '--tags')
+        return repo
+
+def get_fork_mirror(repo_url, commit_sha=None, upstream_url=None, mirror_dir=None):
+    """Get mirror of a fork that shares the objects of its upstream mirror."""
+    upstream = None
+    if upstream_url is not None:
+        upstream = get_mirror(upstream_url, mirror_dir, commit_sha=commit_sha, shared=True)
+    return get_mirror(repo_url, mirror_dir, alternate=upstream, commit_sha=commit_sha)
+
+def create_branch_from_commit(repo_url, branch_name, commit_sha, upstream_url=None,
+                              mirror_dir=None):
     """Create a new branch to push commit."""
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        log.info(commit_sha)
-        log.info(tmpdirname)
-        repo = git_clone(repo_url, tmpdirname)
-        try:
-            repo.git.branch(branch_name, commit_sha)
-        except GitCommandError as git_error:
-            log.error('create_branch_from_commit')
-            log.error(git_error)
-            _, _, error_message, *_ = git_error.args
-            if "Not a valid branch point" in error_message.decode():
-                log.error("Commit {} does not exist for {}".format(commit_sha, repo))
-                raise CommitNotFound(repo_url, commit_sha)
-            if "fatal: A branch named " in error_message.decode():
-                raise BranchAlreadyExists(repo_url, commit_sha)
-        repo.git.push("-f", repo.remote().name, branch_name)
+    log.info(commit_sha)
+    repo = get_fork_mirror(repo_url, commit_sha, upstream_url, mirror_dir)
+    if not _has_commit(repo, commit_sha):
+        log.error("Commit {} does not exist for {}".format(commit_sha, repo_url))
+        raise CommitNotFound(repo_url, commit_sha)
+    if repo.git.ls_remote('--heads', 'origin', f"refs/heads/{branch_name}"):
+        raise BranchAlreadyExists(repo_url, commit_sha)
+    try:
+        repo.git.push("origin", f"{commit_sha}:refs/heads/{branch_name}")
+    except GitCommandError as git_error:
+        log.error('create_branch_from_commit')
+        log.error(git_error)
+        raise
 
 def clone_full(repo_url, tmpdirname):
     """Clone and fetch all content."""
@@ -86,14 +161,26 @@ def clone_full(repo_url, tmpdirname):
     return repo
 
 
-def git_push_commit(repo_url, commit_sha):
-    """Force a Github repo to HEAD to an old commit."""
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        log.info(commit_sha)
-        log.info(tmpdirname)
-        repo = clone_full(repo_url, tmpdirname)
-        _reset_to_commit(repo, commit_sha)
-        _force_push(repo)
+def _get_remote_default_branch(repo):
+    for line in repo.git.ls_remote('--symref', 'origin', 'HEAD').splitlines():
+        if line.startswith('ref: '):
+            return line[len('ref: '):].split('\t')[0]
+    return None
+
+def git_push_commit(repo_url, commit_sha, upstream_url=None, default_branch=None,
+                    mirror_dir=None):
+    """Force a Github repo to HEAD to an old commit.
+
+    The default branch is read from the remote unless given (e.g., from the GitHub API).
+    """
+    log.info(commit_sha)
+    repo = get_fork_mirror(repo_url, commit_sha, upstream_url, mirror_dir)
+    if not _has_commit(repo, commit_sha):
+        raise CommitNotFound(repo_url, commit_sha)
+    default_branch = default_branch or _get_remote_default_branch(repo)
+    if default_branch is None:
+        raise DefaultBranchNotFound(repo_url)
+    repo.git.push("-f", "origin", f"{commit_sha}:{default_branch}")
 
 def get_commit_message(repo_dir, commit_sha):
     """Get commit message."""
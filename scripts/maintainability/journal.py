@@ -0,0 +1,158 @@
+"""Append-only journal of the rows processed by the collection scripts.
+
+Each processed row appends one JSON line with the values it sets, instead of
+rewriting the whole dataset. Interrupted runs resume from the journal and the
+dataset is only written (atomically) at the end of a run or on demand.
+"""
+
+import json
+import os
+import threading
+
+import click
+import pandas as pd
+
+from maintainability import log
+from maintainability.jsonl import read_json_lines
+
+JOURNAL_EXTENSION = '.journal'
+LOCK_EXTENSION = '.lock'
+
+def get_journal_path(dataset):
+    """Path of the journal of a dataset."""
+    return dataset + JOURNAL_EXTENSION
+
+class JournalLocked(Exception):
+    """Exception raised when another process writes the journal."""
+
+class Journal:
+    """Outcomes of the rows of a dataset processed so far.
+
+    A lock file with the id of the writing process is kept next to the journal
+    until it is closed, so that only one process writes it at a time.
+    """
+
+    def __init__(self, dataset, rows):
+        self.dataset = dataset
+        self.path = get_journal_path(dataset)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._acquire()
+        try:
+            self._load(len(rows))
+        except:
+            self._release()
+            raise
+        self._file = open(self.path, 'a')
+        if self._file.tell() == 0:
+            self._write({'rows': len(rows)})
+        elif self.entries:
+            log.info(f"Resuming from {len(self.entries)} rows in {self.path}.")
+
+    def __contains__(self, index):
+        return index in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, index, **values):
+        """Record that a row was processed, setting the given columns."""
+        values = {column: _to_json(value) for column, value in values.items()}
+        with self._lock:
+            self._write({'row': _to_json(index), 'values': values})
+            self.entries.setdefault(index, {}).update(values)
+
+    def apply(self, rows):
+        """Set the recorded values in the rows."""
+        for index, values in self.entries.items():
+            for column, value in values.items():
+                rows.at[index, column] = value
+        return rows
+
+    def materialize(self, rows, output=None):
+        """Write the rows with the recorded values to the dataset."""
+        output = output or self.dataset
+        self.apply(rows)
+        temporary = output + '.tmp'
+        rows.to_csv(temporary, index=False)
+        os.replace(temporary, output)
+        log.success(f"Wrote {len(rows)} rows to {output}.")
+
+    def close(self, rows=None):
+        """Close the journal, materializing and removing it if rows are given."""
+        with self._lock:
+            self._file.close()
+        try:
+            if rows is not None:
+                self.materialize(rows)
+                os.remove(self.path)
+        finally:
+            self._release()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def _acquire(self):
+        lock_path = self.path + LOCK_EXTENSION
+        for _ in range(2):
+            try:
+                with open(lock_path, 'x') as lock_file:
+                    lock_file.write(str(os.getpid()))
+                return
+            except FileExistsError:
+                with open(lock_path) as lock_file:
+                    owner = lock_file.read().strip()
+                if owner.isdigit() and _is_running(int(owner)):
+                    raise JournalLocked(f"{self.path} is being written by process {owner}.")
+                log.warning(f"Removing stale lock of {self.path}.")
+                os.remove(lock_path)
+        raise JournalLocked(f"Could not lock {self.path}.")
+
+    def _release(self):
+        os.remove(self.path + LOCK_EXTENSION)
+
+    def _load(self, length):
+        if not os.path.exists(self.path):
+            return
+        for record in read_json_lines(self.path):
+            if 'rows' in record:
+                if record['rows'] != length:
+                    raise ValueError(
+                        f"Journal {self.path} is from a dataset with {record['rows']} rows."
+                    )
+                continue
+            self.entries.setdefault(record['row'], {}).update(record['values'])
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # running as another user
+    return True
+
+def _to_json(value):
+    """Convert numpy scalars and missing values to JSON values."""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and pd.isnull(value):
+        return None
+    return value
+
+@click.command()
+@click.option('--dataset', prompt=True, help="Dataset written by the collection.")
+@click.option('--source', default=None, help="Input dataset of the collection (default: dataset).")
+def tool(dataset, source):
+    """CLI to write the progress of an interrupted collection to its dataset."""
+    rows = pd.read_csv(source or dataset)
+    try:
+        journal = Journal(dataset, rows)
+    except JournalLocked as error:
+        raise click.ClickException(f"{error} Wait for it to finish or stop it first.")
+    journal.materialize(rows)
+    journal.close()
+
+if __name__ == '__main__':
+    tool() # pylint: disable=no-value-for-parameter
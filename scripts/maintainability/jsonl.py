@@ -0,0 +1,28 @@
+"""Utils for append-only JSON lines files (journals and indexes)."""
+
+import json
+import os
+
+def read_json_lines(path):
+    """Return the records of a JSON lines file, dropping a partially written last line.
+
+    An interrupted append leaves a partial last line, which is truncated so that
+    the next append starts on a line of its own. Invalid lines followed by more
+    lines raise ValueError.
+    """
+    records = []
+    valid = 0
+    with open(path, 'rb') as lines_file:
+        for line in lines_file:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("Missing end of line.")
+                records.append(json.loads(line))
+            except ValueError:
+                if lines_file.read(1):
+                    raise ValueError(f"Invalid line {len(records) + 1} in {path}.")
+                break  # partially written line from an interrupted run
+            valid += len(line)
+    if valid < os.path.getsize(path):
+        os.truncate(path, valid)
+    return records
@@ -0,0 +1,142 @@
+"""Throughput of the collection against local fake BCH and GitHub services.
+
+Each run analyzes the same synthetic projects with a given number of workers
+(collect_maintainability_parallel), with its own fake services, cache, forks
+and mirrors, so runs do not share any state.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import click
+from github import Github
+import pandas as pd
+
+from maintainability import log
+from maintainability.eval_maintainability import collect_maintainability_parallel
+from maintainability.fake_services import FakeBCH, FakeGitHub, parse_failures
+from maintainability.journal import Journal
+import maintainability.better_code_hub as bch
+
+UPSTREAM_OWNER = 'upstream'
+
+def create_projects(folder, projects, commits):
+    """Create local repositories with a file changed in each commit."""
+    shas = {}
+    for n in range(projects):
+        name = f"project{n}"
+        path = os.path.join(folder, name)
+        subprocess.run(['git', 'init', '--quiet', '--initial-branch=main', path], check=True)
+        git = ['git', '-C', path, '-c', 'user.name=load', '-c', 'user.email=load@example.com']
+        shas[name] = []
+        for commit in range(commits):
+            with open(os.path.join(path, 'Main.java'), 'a') as source:
+                source.write(f"class {name.title()}{commit} {{ void run() {{ }} }}\n")
+            subprocess.run(git + ['add', '-A'], check=True)
+            subprocess.run(git + ['commit', '--quiet', '-m', f"Commit {commit}"], check=True)
+            shas[name].append(subprocess.run(git + ['rev-parse', 'HEAD'], check=True,
+                                             capture_output=True, text=True).stdout.strip())
+    return shas
+
+def get_dataset(shas):
+    """Rows of fixes and parents of the synthetic projects."""
+    rows = [{'owner': UPSTREAM_OWNER, 'project': name, 'sha': commits[n], 'sha-p': commits[n - 1]}
+            for name, commits in shas.items() for n in range(len(commits) - 1, 0, -1)]
+    return pd.DataFrame(rows)
+
+def create_services(folder, github, fake_bch, scan_duration, branch_delay):
+    """BCH client, tracker and GitHub API of the fake services, with fresh local state."""
+    client = bch.BCHClient(base_url=fake_bch.url,
+                           credentials={'bettercodehub_session': 'fake-session',
+                                        'bettercodehub_xsrf_token': 'fake-token'})
+    tracker = bch.create_scan_tracker(client, default_duration=sum(scan_duration) / 2,
+                                      min_poll_interval=min(scan_duration) / 4)
+    return bch.Services(client=client, tracker=tracker,
+                        cache=bch.BCHCache(os.path.join(folder, 'bch_cache.seg')),
+                        github=Github(login_or_token='fake-token', base_url=github.url),
+                        mirror_dir=os.path.join(folder, 'mirrors'), branch_delay=branch_delay)
+
+def run(sources, df, workers, folder, scan_duration, max_scans, latency, jitter,
+        bch_failures, github_failures, branch_delay):
+    """Analyze the dataset with the given number of workers and return its throughput."""
+    github = FakeGitHub(os.path.join(folder, 'github'), latency=latency, jitter=jitter,
+                        failures=github_failures, seed=workers)
+    for name, path in sources.items():
+        github.add_repository(UPSTREAM_OWNER, name, path)
+    fake_bch = FakeBCH(github, scan_duration=scan_duration, max_scans=max_scans,
+                       latency=latency, jitter=jitter, failures=bch_failures, seed=workers)
+    github.start()
+    fake_bch.start()
+    try:
+        services = create_services(folder, github, fake_bch, scan_duration, branch_delay)
+        dataset = os.path.join(folder, 'dataset.csv')
+        journal = Journal(dataset, df)
+        started = time.monotonic()
+        try:
+            collect_maintainability_parallel(df, 'security', journal, workers, services)
+        finally:
+            elapsed = time.monotonic() - started
+            journal.close()
+        errors = sum(1 for values in journal.entries.values() if values.get('ERROR'))
+        scans = sum(count for request, count in fake_bch.stats.items()
+                    if request == 'POST /edge/schedule/scan 200')
+    finally:
+        fake_bch.stop()
+        github.stop()
+    return {'workers': workers, 'rows': len(df), 'errors': errors, 'scans': scans,
+            'seconds': elapsed, 'rows_per_minute': 60 * len(df) / elapsed,
+            'bch_requests': dict(fake_bch.stats), 'github_requests': dict(github.stats)}
+
+@click.command()
+@click.option('--workers', '-w', multiple=True, type=int, default=(1, 8, 32), show_default=True,
+              help="Numbers of workers to compare.")
+@click.option('--projects', default=32, show_default=True, help="Synthetic projects (forks).")
+@click.option('--rows', default=2, show_default=True, help="Rows (fix and parent) per project.")
+@click.option('--scan-duration', nargs=2, type=float, default=(1, 3), show_default=True,
+              help="Minimum and maximum seconds of a scan.")
+@click.option('--max-scans', type=int, default=None, help="Scans BCH runs at the same time.")
+@click.option('--latency', default=0.05, show_default=True, help="Seconds added to requests.")
+@click.option('--jitter', default=0.05, show_default=True, help="Random extra seconds.")
+@click.option('--bch-failure', multiple=True, metavar='STATUS=RATE',
+              help="Inject 429, 412 (scan) or 400 (report) failures.")
+@click.option('--github-failure', multiple=True, metavar='STATUS=RATE',
+              help="Inject failures in GitHub API requests.")
+@click.option('--branch-delay', default=0.0, show_default=True,
+              help="Seconds to wait after changing the default branch of a fork.")
+@click.option('--output', default='load_test.json', show_default=True,
+              help="JSON file with the results.")
+def tool(workers, projects, rows, scan_duration, max_scans, latency, jitter, bch_failure,
+         github_failure, branch_delay, output):
+    """CLI to measure collection throughput against fake services."""
+    folder = tempfile.mkdtemp(prefix='load-test-')
+    try:
+        sources = os.path.join(folder, 'sources')
+        shas = create_projects(sources, projects, rows + 1)
+        df = get_dataset(shas)
+        results = []
+        for count in workers:
+            log.info(f"Analyzing {len(df)} rows of {projects} projects with {count} workers.")
+            run_folder = os.path.join(folder, f'run-{count}')
+            os.makedirs(run_folder)
+            result = run({name: os.path.join(sources, name) for name in shas}, df, count,
+                         run_folder, scan_duration, max_scans, latency, jitter,
+                         parse_failures(bch_failure), parse_failures(github_failure),
+                         branch_delay)
+            results.append(result)
+            log.success("{workers} workers: {rows} rows in {seconds:.1f}s "
+                        "({rows_per_minute:.1f} rows/min, {errors} errors)".format(**result))
+    finally:
+        shutil.rmtree(folder)
+    with open(output, 'w') as output_file:
+        json.dump({'projects': projects, 'rows': rows, 'scan_duration': scan_duration,
+                   'max_scans': max_scans, 'latency': latency, 'jitter': jitter,
+                   'bch_failures': list(bch_failure), 'github_failures': list(github_failure),
+                   'results': results}, output_file, indent=2)
+    log.success(f"Results written to {output}.")
+
+if __name__ == '__main__':
+    tool() # pylint: disable=no-value-for-parameter
@@ -1,25 +1,82 @@
 import argparse
+from collections import Counter
 from os import listdir
-from os.path import isfile, join
+from os.path import isfile, join, dirname, abspath
 import json
+import shutil
+import tempfile
 from pathlib import Path
-from zipfile import ZipFile, ZIP_DEFLATED
 
-from maintainability.cache import Cache
+from maintainability.cache import SEGMENTS_EXTENSION, SegmentStore, iter_cache_records, \
+    write_cache_records
 
 def change_extension(file_path, extension):
     return Path(file_path).stem + extension
 
+def _canonical(value):
+    return json.dumps(value, sort_keys=True)
+
+def _is_error(value):
+    return isinstance(value, dict) and bool(value.get('error'))
+
+def _completeness(value):
+    if not isinstance(value, dict):
+        return 0
+    return len(value.get('analysisResults') or [])
+
+def resolve_conflict(current, new):
+    """Pick one of two different values of a key, independently of the input order.
+
+    Real reports win over error reports, then reports with more guidelines,
+    then the smallest canonical JSON.
+    """
+    def rank(value):
+        return (_is_error(value), -_completeness(value), _canonical(value))
+    return new if rank(new) < rank(current) else current
 
 def merge_cache(cache, output):
-    cache_files = [f for f in listdir(cache) if isfile(join(cache, f)) and 'cache' in f]
-    caches = [Cache(join(cache, f)) for f in cache_files]    
-    merged_cache = caches[0]
-    for cache in caches[1::]:
-        merged_cache = merged_cache.merge_cache(cache)
-
-    merged_cache.set_storage_path(output)
-    merged_cache.save_data()
+    cache_files = sorted(f for f in listdir(cache)
+                         if (isfile(join(cache, f)) or f.endswith(SEGMENTS_EXTENSION))
+                         and 'cache' in f)
+    stats = Counter()
+    staging_dir = tempfile.mkdtemp(dir=dirname(abspath(output)))
+    try:
+        staging = SegmentStore(join(staging_dir, 'merge' + SEGMENTS_EXTENSION))
+        for cache_file in cache_files:
+            records = 0
+            for key, value in iter_cache_records(join(cache, cache_file)):
+                records += 1
+                current = staging.get(key)
+                if current is None:
+                    staging.put(key, value)
+                    continue
+                if _canonical(current) == _canonical(value):
+                    stats['duplicates'] += 1
+                    continue
+                chosen = resolve_conflict(current, value)
+                if _is_error(current) != _is_error(value):
+                    # the report wins, whichever cache it comes from
+                    if chosen is value:
+                        stats['errors replaced by reports'] += 1
+                    else:
+                        stats['errors ignored'] += 1
+                else:
+                    stats['conflicts'] += 1
+                if chosen is value:
+                    staging.put(key, value)
+            stats['records'] += records
+            print(f'{cache_file}: {records} records')
+        write_cache_records(output, staging)
+        stats['keys'] = len(staging)
+    finally:
+        shutil.rmtree(staging_dir)
+    print(f"Merged {stats['records']} records from {len(cache_files)} caches "
+          f"into {stats['keys']} keys.")
+    print(f"Duplicates: {stats['duplicates']}, "
+          f"errors replaced by reports: {stats['errors replaced by reports']}, "
+          f"errors ignored: {stats['errors ignored']}, "
+          f"conflicts: {stats['conflicts']}.")
+    return stats
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""Compact projection of the scoring inputs of cached BCH reports.
+
+Scoring only needs the guideline names, risk profile volumes and compliance
+thresholds of each report. The projection keeps them in fixed-layout arrays
+next to the cache, so they can be loaded at once without decoding the JSON
+reports. It is kept in sync with the cache using a hash of each report.
+"""
+
+import os
+
+import numpy as np
+
+from maintainability import log
+import maintainability.better_code_hub as bch
+
+PROJECTION_EXTENSION = '.projection.npz'
+
+def get_projection_path(cache_path):
+    """Path of the projection of a cache."""
+    return cache_path.rstrip('/') + PROJECTION_EXTENSION
+
+def load_projection(cache):
+    """Return the projection of a cache, updated with its latest reports."""
+    projection = ReportProjection(get_projection_path(cache.storage_path))
+    projection.sync(cache)
+    return projection
+
+class ReportProjection:
+    """Scoring inputs of cached reports in (reports x guidelines x bins) arrays."""
+
+    def __init__(self, path):
+        self.path = path
+        self.guidelines = []
+        self.keys = []
+        self.digests = []
+        self.errors = np.zeros(0, dtype=bool)
+        self.total_loc = np.zeros(0)
+        self.volumes = np.zeros((0, 0, 1))
+        self.thresholds = np.zeros((0, 0, 1))
+        # position of each guideline in the report, -1 when missing
+        self.positions = np.zeros((0, 0), dtype=np.int16)
+        # hash of the whole JSON or zip cache the projection was synced with
+        self.storage_digest = ''
+        self._rows = {}
+        self._changed = False
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_rows(self, keys):
+        """Return rows of the given keys, -1 for keys that are not projected."""
+        return np.array([self._rows.get(key, -1) for key in keys], dtype=int)
+
+    def get_packed(self, rows):
+        """Return the inputs of score_packed_reports for the given rows."""
+        return (self.volumes[rows], self.thresholds[rows], self.positions[rows] >= 0,
+                self.total_loc[rows], list(self.guidelines))
+
+    def get_report(self, cache, key):
+        """Return the raw report of a key."""
+        return cache.get_value(key)
+
+    def sync(self, cache, keys=None):
+        """Project new or changed reports of the cache and return rows of the keys.
+
+        All cached keys are synced by default. Rows are -1 for keys that are
+        not in the cache. JSON and zip caches are only decoded if they changed
+        since the last sync, and then all their keys are synced.
+        """
+        storage_digest = cache.get_storage_digest()
+        if storage_digest is not None:
+            if storage_digest != self.storage_digest:
+                cached = set(cache.keys()) # decodes the cache, later syncs hash each report
+                self.sync(cache)
+                for key, row in self._rows.items():
+                    if key not in cached:
+                        self.digests[row] = '' # removed from the cache
+                self.storage_digest = storage_digest
+                self._changed = True
+                self.save()
+            if keys is None:
+                keys = [key for key, digest in zip(self.keys, self.digests) if digest]
+            return np.array([row if row >= 0 and self.digests[row] else -1
+                             for row in self.get_rows(keys)], dtype=int)
+        keys = cache.keys() if keys is None else keys
+        digests = {key: cache.get_digest(key) for key in set(keys)}
+        stale = [key for key, digest in digests.items() if digest is not None
+                 and (key not in self._rows or self.digests[self._rows[key]] != digest)]
+        if stale:
+            log.info(f"Projecting {len(stale)} new or changed reports.")
+            self._project(stale, [cache.get_value(key) for key in stale],
+                          [digests[key] for key in stale])
+            self.save()
+        return np.array([self._rows[key] if digests[key] is not None else -1 for key in keys],
+                        dtype=int)
+
+    def save(self):
+        """Store the projection if it has changed."""
+        if not self._changed:
+            return
+        temporary = self.path + '.tmp.npz'
+        np.savez(
+            temporary,
+            version=np.array(bch.get_scoring_version()),
+            guidelines=np.array(self.guidelines, dtype=str),
+            keys=np.array(self.keys, dtype=str),
+            digests=np.array(self.digests, dtype=str),
+            storage_digest=np.array(self.storage_digest),
+            errors=self.errors, total_loc=self.total_loc,
+            volumes=self.volumes, thresholds=self.thresholds, positions=self.positions,
+        )
+        os.replace(temporary, self.path)
+        self._changed = False
+
+    def _load(self):
+        with np.load(self.path) as projection:
+            if 'version' not in projection or str(projection['version']) != bch.get_scoring_version():
+                log.info(f"Discarding {self.path} of another scoring version.")
+                return
+            self.guidelines = projection['guidelines'].tolist()
+            self.keys = projection['keys'].tolist()
+            self.digests = projection['digests'].tolist()
+            self.storage_digest = str(projection['storage_digest'])
+            self.errors = projection['errors']
+            self.total_loc = projection['total_loc']
+            self.volumes = projection['volumes']
+            self.thresholds = projection['thresholds']
+            self.positions = projection['positions']
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def _project(self, keys, reports, digests):
+        errors = np.array([bool(report.get('error')) for report in reports], dtype=bool)
+        valid = [report for report, error in zip(reports, errors) if not error]
+        volumes, thresholds, present, total_loc, guidelines = \
+            bch.pack_reports(valid, self.guidelines)
+        self._resize(len(guidelines), volumes.shape[-1], thresholds.shape[-1])
+        self.guidelines = guidelines
+        size = (len(reports),) + self.volumes.shape[1:]
+        new_volumes = np.zeros(size)
+        new_thresholds = np.full((len(reports),) + self.thresholds.shape[1:], np.nan)
+        new_positions = np.full(size[:2], -1, dtype=np.int16)
+        new_total_loc = np.zeros(len(reports))
+        valid_rows = np.flatnonzero(~errors)
+        new_volumes[valid_rows, :, :volumes.shape[-1]] = volumes
+        new_thresholds[valid_rows, :, :thresholds.shape[-1]] = thresholds
+        new_total_loc[valid_rows] = total_loc
+        columns = {guideline: index for index, guideline in enumerate(guidelines)}
+        for row, report in zip(valid_rows, valid):
+            for position, result in enumerate(report.get("analysisResults")):
+                new_positions[row, columns[result['guideline']]] = position
+
+        existing = np.array([key in self._rows for key in keys], dtype=bool)
+        rows = np.array([self._rows[key] for key in keys if key in self._rows], dtype=int)
+        for key, digest in zip(keys, digests):
+            if key in self._rows:
+                self.digests[self._rows[key]] = digest
+            else:
+                self._rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.digests.append(digest)
+        for name, new in (('errors', errors), ('total_loc', new_total_loc),
+                          ('volumes', new_volumes), ('thresholds', new_thresholds),
+                          ('positions', new_positions)):
+            current = getattr(self, name)
+            current[rows] = new[existing]
+            setattr(self, name, np.concatenate((current, new[~existing])))
+        self._changed = True
+
+    def _resize(self, guidelines, bins, thresholds):
+        """Pad the arrays to fit more guidelines, volume bins or thresholds."""
+        def pad(array, shape, value):
+            if array.shape[1:] == shape:
+                return array
+            padded = np.full((array.shape[0],) + shape, value, dtype=array.dtype)
+            padded[tuple(slice(0, size) for size in array.shape)] = array
+            return padded
+        bins = max(bins, self.volumes.shape[-1])
+        thresholds = max(thresholds, self.thresholds.shape[-1])
+        self.volumes = pad(self.volumes, (guidelines, bins), 0)
+        self.thresholds = pad(self.thresholds, (guidelines, thresholds), np.nan)
+        self.positions = pad(self.positions, (guidelines,), -1)
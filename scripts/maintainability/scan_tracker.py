@@ -0,0 +1,106 @@
+"""Adaptive polling of BCH scans.
+
+A single event loop, running in a background thread, keeps track of every
+scheduled scan and polls its report endpoint. Polls are scheduled at the
+quantiles of the scan durations observed so far, so reports are collected
+shortly after they are ready instead of after fixed sleeps and retries.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from maintainability import log
+
+class ScanTracker:
+    """Poll the reports of many scheduled scans at the same time."""
+
+    DEFAULT_DURATION = 20
+    HISTORY_SIZE = 200
+    QUANTILES = (0.25, 0.5, 0.75, 0.9)
+    EARLY_FACTOR = 0.8 # poll a bit earlier than expected to learn shorter durations
+    MIN_POLL_INTERVAL = 5
+    MAX_POLL_INTERVAL = 300
+    BACKOFF = 0.5
+    TIMEOUT = 1800
+    MAX_FAILURES = 5
+
+    def __init__(self, fetch_report, pending=(Exception,), timeout_error=TimeoutError,
+                 max_requests=16, default_duration=DEFAULT_DURATION,
+                 min_poll_interval=MIN_POLL_INTERVAL):
+        """`fetch_report(user, project)` raises one of `pending` until a report exists.
+
+        Scans without any report after TIMEOUT raise `timeout_error`. Scans are
+        expected to last `default_duration` seconds until some have finished,
+        and are polled at most every `min_poll_interval` seconds.
+        """
+        self.default_duration = default_duration
+        self.min_poll_interval = min_poll_interval
+        self._fetch_report = fetch_report
+        self._pending = pending
+        self._timeout_error = timeout_error
+        self._executor = ThreadPoolExecutor(max_workers=max_requests)
+        self._lock = threading.Lock()
+        self._loop = None
+        self.durations = deque(maxlen=self.HISTORY_SIZE)
+
+    def next_delay(self, elapsed):
+        """Seconds to wait before the next poll of a scan started `elapsed` seconds ago."""
+        durations = sorted(self.durations) or [self.default_duration]
+        for quantile in self.QUANTILES:
+            expected = self.EARLY_FACTOR * durations[int(quantile * (len(durations) - 1))]
+            if expected > elapsed:
+                return max(expected - elapsed, self.min_poll_interval)
+        return min(self.MAX_POLL_INTERVAL, max(self.min_poll_interval, elapsed * self.BACKOFF))
+
+    async def track(self, user, project, started, is_ready=None):
+        """Poll the report of a scan until it is ready.
+
+        `is_ready(report)` can reject reports of previous scans. If the scan
+        does not finish before TIMEOUT, the last report (if any) is returned,
+        otherwise the last pending exception (or `timeout_error`) is raised.
+        Other errors are retried up to MAX_FAILURES times.
+        """
+        loop = asyncio.get_running_loop()
+        report, error = None, None
+        failures = 0
+        while time.monotonic() - started < self.TIMEOUT:
+            await asyncio.sleep(self.next_delay(time.monotonic() - started))
+            try:
+                report = await loop.run_in_executor(
+                    self._executor, self._fetch_report, user, project
+                )
+            except self._pending as pending_error:
+                error = pending_error
+                continue
+            except Exception as failure:
+                failures += 1
+                if failures >= self.MAX_FAILURES:
+                    raise
+                log.warning(f"Could not poll the scan of {user}/{project}: {failure}")
+                error = failure
+                continue
+            if is_ready is None or is_ready(report):
+                self.durations.append(time.monotonic() - started)
+                return report
+        log.warning(f"Scan of {user}/{project} did not finish in {self.TIMEOUT}s.")
+        if report is not None:
+            return report
+        if error is not None:
+            raise error
+        raise self._timeout_error(f"Scan of {user}/{project} did not finish in {self.TIMEOUT}s.")
+
+    def wait_for_report(self, user, project, started=None, is_ready=None):
+        """Block the calling thread until the report of a scan is ready."""
+        started = time.monotonic() if started is None else started
+        coroutine = self.track(user, project, started, is_ready)
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
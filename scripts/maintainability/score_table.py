@@ -0,0 +1,142 @@
+"""Memoized maintainability scores of cached reports.
+
+The table keeps the scores of every report it has seen, together with a hash
+of the cached content they were computed from. Only reports that are new or
+changed since the last export are scored, from the projection of the cache.
+"""
+
+import os
+
+import numpy as np
+
+from maintainability import log
+from maintainability.projection import ReportProjection, get_projection_path
+import maintainability.better_code_hub as bch
+
+SCORES_EXTENSION = '.scores.npz'
+
+def get_score_table_path(cache_path):
+    """Path of the score table of a cache."""
+    return cache_path.rstrip('/') + SCORES_EXTENSION
+
+class ScoreTable:
+    """Scores of cached reports keyed by cache key and content hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self.guidelines = []
+        self.keys = []
+        self.digests = []
+        self.errors = np.zeros(0, dtype=bool)
+        self.overall = np.zeros(0)
+        self.scores = np.zeros((0, 0))
+        # position of each guideline in the report, -1 when missing
+        self.positions = np.zeros((0, 0), dtype=np.int16)
+        self._rows = {}
+        self._changed = False
+        if os.path.exists(path):
+            self._load()
+
+    def lookup(self, cache, keys, projection=None):
+        """Return table rows of the given cache keys, scoring new reports.
+
+        Reports are read from the projection of the cache. Rows are -1 for
+        keys that are not in the cache.
+        """
+        if projection is None:
+            projection = ReportProjection(get_projection_path(cache.storage_path))
+        projected = dict(zip(keys, projection.sync(cache, keys)))
+        stale = [key for key, row in projected.items() if row >= 0
+                 and (key not in self._rows
+                      or self.digests[self._rows[key]] != projection.digests[row])]
+        if stale:
+            log.info(f"Scoring {len(stale)} new or changed reports.")
+            self._score(stale, projection, np.array([projected[key] for key in stale], dtype=int))
+        return np.array([self._rows[key] if projected[key] >= 0 else -1 for key in keys],
+                        dtype=int)
+
+    def get_guideline_order(self, rows):
+        """Guidelines in order of first appearance, as found by pack_reports."""
+        if len(rows) == 0:
+            return []
+        positions = self.positions[rows]
+        present = positions >= 0
+        first = np.where(present.any(axis=0), present.argmax(axis=0), len(rows))
+        position = positions[first.clip(max=len(rows) - 1), np.arange(len(self.guidelines))]
+        found = [g for g in range(len(self.guidelines)) if first[g] < len(rows)]
+        found.sort(key=lambda g: (first[g], position[g]))
+        return found
+
+    def save(self):
+        """Store the table if it has changed."""
+        if not self._changed:
+            return
+        temporary = self.path + '.tmp.npz'
+        np.savez(
+            temporary,
+            version=np.array(bch.get_scoring_version()),
+            guidelines=np.array(self.guidelines, dtype=str),
+            keys=np.array(self.keys, dtype=str),
+            digests=np.array(self.digests, dtype=str),
+            errors=self.errors, overall=self.overall,
+            scores=self.scores, positions=self.positions,
+        )
+        os.replace(temporary, self.path)
+        self._changed = False
+
+    def _load(self):
+        with np.load(self.path) as table:
+            if 'version' not in table or str(table['version']) != bch.get_scoring_version():
+                log.info(f"Discarding {self.path} of another scoring version.")
+                return
+            self.guidelines = table['guidelines'].tolist()
+            self.keys = table['keys'].tolist()
+            self.digests = table['digests'].tolist()
+            self.errors = table['errors']
+            self.overall = table['overall']
+            self.scores = table['scores'].reshape(len(self.keys), len(self.guidelines))
+            self.positions = table['positions'].reshape(len(self.keys), len(self.guidelines))
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def _score(self, keys, projection, projected_rows):
+        digests = [projection.digests[row] for row in projected_rows]
+        errors = projection.errors[projected_rows]
+        valid = projected_rows[~errors]
+        scores, overall = bch.score_packed_reports(*projection.get_packed(valid))
+        self._add_guidelines(projection.guidelines)
+        columns = [self.guidelines.index(guideline) for guideline in projection.guidelines]
+        new_scores = np.full((len(keys), len(self.guidelines)), np.nan)
+        new_overall = np.full(len(keys), np.nan)
+        new_positions = np.full((len(keys), len(self.guidelines)), -1, dtype=np.int16)
+        new_scores[np.ix_(~errors, columns)] = scores
+        new_overall[~errors] = overall
+        new_positions[np.ix_(~errors, columns)] = projection.positions[valid]
+        existing = np.array([key in self._rows for key in keys], dtype=bool)
+        rows = np.array([self._rows[key] for key in keys if key in self._rows], dtype=int)
+        for key, digest in zip(keys, digests):
+            if key in self._rows:
+                self.digests[self._rows[key]] = digest
+            else:
+                self._rows[key] = len(self.keys)
+                self.keys.append(key)
+                self.digests.append(digest)
+        self.errors[rows] = errors[existing]
+        self.overall[rows] = new_overall[existing]
+        self.scores[rows] = new_scores[existing]
+        self.positions[rows] = new_positions[existing]
+        self.errors = np.concatenate((self.errors, errors[~existing]))
+        self.overall = np.concatenate((self.overall, new_overall[~existing]))
+        self.scores = np.vstack((self.scores, new_scores[~existing]))
+        self.positions = np.vstack((self.positions, new_positions[~existing]))
+        self._changed = True
+
+    def _add_guidelines(self, guidelines):
+        missing = [guideline for guideline in guidelines if guideline not in self.guidelines]
+        if missing:
+            self.scores = np.hstack(
+                (self.scores, np.full((len(self.keys), len(missing)), np.nan))
+            )
+            self.positions = np.hstack(
+                (self.positions, np.full((len(self.keys), len(missing)), -1, dtype=np.int16))
+            )
+            self.guidelines = self.guidelines + missing
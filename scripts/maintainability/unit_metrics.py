@@ -0,0 +1,278 @@
+"""Local computation of the unit-level BCH guidelines.
+
+Computes the risk profiles of Write Short Units of Code, Write Simple Units of
+Code and Keep Unit Interfaces Small straight from a commit in a local clone,
+following the SIG maintainability model (Visser, Building Maintainable
+Software, 2016). Reports have the same schema as BCH reports, so they can be
+stored in a BCHCache and scored by better_code_hub.
+"""
+
+import ast
+import bisect
+import os
+import re
+from collections import namedtuple, OrderedDict
+
+import click
+import pandas as pd
+from git import Repo
+from git.exc import BadName
+
+from maintainability import ghutils, log
+from maintainability.cache import BCHCache
+
+CLONAGE_DIR = "./tmp"
+SCRIPT_DIR = os.path.dirname(__file__)
+
+# bumped when units are parsed differently, so that cached reports are recomputed
+ANALYZER_VERSION = 2
+
+Unit = namedtuple('Unit', ['name', 'loc', 'complexity', 'parameters'])
+
+# guideline -> (unit metric, upper limit of low/medium/high risk, compliance thresholds)
+# Thresholds are the maximum share of code allowed above each risk level,
+# the first one (low risk) has no limit.
+GUIDELINES = OrderedDict([
+    ('Write Short Units of Code', ('loc', (15, 30, 60), [1.0, 0.437, 0.223, 0.069])),
+    ('Write Simple Units of Code', ('complexity', (5, 10, 25), [1.0, 0.252, 0.1, 0.015])),
+    ('Keep Unit Interfaces Small', ('parameters', (2, 4, 6), [1.0, 0.138, 0.054, 0.022])),
+])
+
+PYTHON_EXTENSIONS = ('py',)
+C_LIKE_EXTENSIONS = ('java', 'scala', 'groovy', 'js', 'ts', 'php', 'inc', 'c', 'h', 'cc',
+                     'cpp', 'hpp', 'cxx', 'm', 'mm', 'cs', 'go', 'kt', 'swift')
+
+_C_LIKE_KEYWORDS = {'if', 'for', 'foreach', 'while', 'switch', 'catch', 'return', 'sizeof',
+                    'synchronized', 'function', 'func', 'new', 'else', 'do', 'try', 'using',
+                    'lock'}
+# name, parameters, then return types, throws clauses or initializer lists up to the body
+_C_LIKE_UNIT = re.compile(
+    r'\b([A-Za-z_$][\w$]*)\s*\(((?:[^;{}()]|\([^;{}()]*\))*)\)'
+    r'(?:[\w\s,.:<>\[\]&*$@]|\([^;{}()]*\))*\{'
+)
+_C_LIKE_INSTANTIATION = re.compile(r'\bnew\s+[\w$.]*$')
+_C_LIKE_DECISIONS = re.compile(r'\b(?:if|for|foreach|while|case|catch)\b|&&|\|\||\s\?\s')
+_C_LIKE_NOISE = re.compile(
+    r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'',
+    re.DOTALL
+)
+
+def get_units(path, source):
+    """Return units (functions, methods) declared in a source file."""
+    extension = path.split('.')[-1]
+    if extension in PYTHON_EXTENSIONS:
+        return _get_python_units(source)
+    if extension in C_LIKE_EXTENSIONS:
+        return _get_c_like_units(source)
+    return []
+
+def _get_python_units(source):
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    lines = source.splitlines()
+    units = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            units.append(_get_python_unit(node, lines))
+    return units
+
+def _is_python_unit(node):
+    return isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef))
+
+def _walk_python_unit(node):
+    """Walk the body of a unit without entering nested units."""
+    nodes = list(ast.iter_child_nodes(node))
+    while nodes:
+        child = nodes.pop()
+        yield child
+        if not _is_python_unit(child):
+            nodes.extend(ast.iter_child_nodes(child))
+
+def _python_span(node):
+    end = getattr(node, 'end_lineno', None)
+    if end is None:
+        end = max(getattr(child, 'lineno', node.lineno) for child in ast.walk(node))
+    return set(range(node.lineno, end + 1))
+
+def _get_python_unit(node, lines):
+    span = _python_span(node)
+    if ast.get_docstring(node, clean=False) is not None:
+        span -= _python_span(node.body[0])
+    complexity = 1
+    for child in _walk_python_unit(node):
+        if _is_python_unit(child) and not isinstance(child, ast.Lambda):
+            span -= _python_span(child)
+        elif isinstance(child, (ast.If, ast.For, ast.AsyncFor, ast.While,
+                                ast.IfExp, ast.ExceptHandler)):
+            complexity += 1
+        elif isinstance(child, ast.comprehension):
+            complexity += 1 + len(child.ifs)
+        elif isinstance(child, ast.BoolOp):
+            complexity += len(child.values) - 1
+    loc = sum(1 for number in span
+              if number <= len(lines) and _is_python_code(lines[number-1]))
+    args = node.args
+    parameters = [arg.arg for arg in getattr(args, 'posonlyargs', []) + args.args + args.kwonlyargs]
+    parameters += [arg.arg for arg in (args.vararg, args.kwarg) if arg is not None]
+    if parameters and parameters[0] in ('self', 'cls'):
+        parameters = parameters[1:]
+    return Unit(node.name, loc, complexity, len(parameters))
+
+def _is_python_code(line):
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith('#')
+
+def _strip_c_like_noise(source):
+    """Blank out comments and string literals, keeping line breaks."""
+    def blank(match):
+        text = match.group(0)
+        if text.startswith(('"', "'")):
+            return text[0] + re.sub(r'[^\n]', ' ', text[1:-1]) + text[-1]
+        return re.sub(r'[^\n]', ' ', text)
+    return _C_LIKE_NOISE.sub(blank, source)
+
+def _find_closing_brace(code, start):
+    depth = 0
+    for position in range(start, len(code)):
+        if code[position] == '{':
+            depth += 1
+        elif code[position] == '}':
+            depth -= 1
+            if depth == 0:
+                return position
+    return None
+
+def _count_c_like_parameters(parameters):
+    parameters = parameters.strip()
+    if not parameters or parameters == 'void':
+        return 0
+    depth, count = 0, 1
+    for char in parameters:
+        if char in '<([':
+            depth += 1
+        elif char in '>)]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            count += 1
+    return count
+
+def _find_c_like_units(code):
+    """Return (name, parameters, start, body start, end) of units, nested ones included."""
+    spans = []
+    position = 0
+    while True:
+        match = _C_LIKE_UNIT.search(code, position)
+        if match is None:
+            break
+        name, parameters = match.group(1), match.group(2)
+        if (name in _C_LIKE_KEYWORDS
+                or _C_LIKE_INSTANTIATION.search(code, max(0, match.start() - 200), match.start())):
+            position = match.start(2)
+            continue
+        end = _find_closing_brace(code, match.end() - 1)
+        if end is None:
+            break
+        spans.append((name, parameters, match.start(), match.end(), end))
+        position = match.end()
+    return spans
+
+def _get_c_like_units(source):
+    code = _strip_c_like_noise(source)
+    lines = code.split('\n')
+    line_starts = [0] + [match.end() for match in re.finditer('\n', code)]
+    def line_numbers(start, end):
+        return set(range(bisect.bisect_right(line_starts, start),
+                         bisect.bisect_right(line_starts, end) + 1))
+    spans = _find_c_like_units(code)
+    units = []
+    for index, (name, parameters, start, body, end) in enumerate(spans):
+        nested = []
+        for _, _, nested_start, _, nested_end in spans[index + 1:]:
+            if nested_start > end:
+                break
+            if nested_end < end:
+                nested.append((nested_start, nested_end))
+        numbers = line_numbers(start, end)
+        for nested_start, nested_end in nested:
+            numbers -= line_numbers(nested_start, nested_end)
+        loc = sum(1 for number in numbers if lines[number-1].strip())
+        decisions = [match.start() for match in _C_LIKE_DECISIONS.finditer(code, body, end)
+                     if not any(s <= match.start() <= e for s, e in nested)]
+        units.append(Unit(name, loc, 1 + len(decisions), _count_c_like_parameters(parameters)))
+    return units
+
+def get_risk_profile(units, metric, limits):
+    """Sum the lines of code of units in each risk level."""
+    volumes = [0] * (len(limits) + 1)
+    for unit in units:
+        level = sum(1 for limit in limits if getattr(unit, metric) > limit)
+        volumes[level] += unit.loc
+    return volumes
+
+def get_commit_units(repo_dir, commit_sha):
+    """Return units of all supported source files of a commit."""
+    commit = Repo(repo_dir).commit(commit_sha)
+    units = []
+    for blob in commit.tree.traverse():
+        if blob.type != 'blob':
+            continue
+        extension = blob.path.split('.')[-1]
+        if extension not in PYTHON_EXTENSIONS and extension not in C_LIKE_EXTENSIONS:
+            continue
+        source = blob.data_stream.read().decode('utf-8', errors='replace')
+        units.extend(get_units(blob.path, source))
+    return units
+
+def analyze_commit(repo_dir, commit_sha):
+    """Compute a BCH-like report of the unit guidelines for a commit."""
+    units = get_commit_units(repo_dir, commit_sha)
+    results = []
+    for guideline, (metric, limits, thresholds) in GUIDELINES.items():
+        results.append({
+            'guideline': guideline,
+            'qualityProfileVolume': get_risk_profile(units, metric, limits),
+            'qualityProfileComplianceThresholds': thresholds,
+        })
+    return {'sha': commit_sha, 'analyzer': 'local', 'analyzerVersion': ANALYZER_VERSION,
+            'analysisResults': results}
+
+def analyze_commit_cached(cache, user, project, commit_sha, repo_dir='.'):
+    """Analyze commit locally unless it is already in the cache by this analyzer version."""
+    report = cache.get_stored_commit_analysis(user, project, commit_sha)
+    if report and report.get('analyzerVersion') == ANALYZER_VERSION:
+        return report
+    report = analyze_commit(repo_dir, commit_sha)
+    cache.store_commit_analysis(user, project, commit_sha, report)
+    return report
+
+@click.command()
+@click.option('--dataset', prompt=True, default="../dataset/db_security_changes.csv",
+              help="Dataset with commits for comparison.")
+@click.option('--commit', prompt=True, default="security",
+              help="type of dataset")
+@click.option('--cache', default=os.path.join(SCRIPT_DIR, "./local_cache.seg"), show_default=True,
+              help="Cache where local reports are stored.")
+def tool(dataset, commit, cache):
+    """CLI to compute the unit guidelines of a dataset locally."""
+    rows = pd.read_csv(dataset)
+    cache = BCHCache(os.path.abspath(cache))
+    for _, row in rows.iterrows():
+        user, project = row['owner'], row['project']
+        if commit == 'regular':
+            commit_shas = (row['sha-reg'], row['sha-reg-p'])
+        else:
+            commit_shas = (row['sha'], row['sha-p'])
+        with ghutils.GithubCloneRepoPersistent(user, project, CLONAGE_DIR):
+            for commit_sha in commit_shas:
+                if not isinstance(commit_sha, str):
+                    continue
+                try:
+                    analyze_commit_cached(cache, user, project, commit_sha)
+                except (BadName, ValueError):
+                    log.error(f"Commit {commit_sha} not found in {user}/{project}.")
+        log.success(f"Analyzed {user}/{project}.")
+
+if __name__ == '__main__':
+    tool() # pylint: disable=no-value-for-parameter
@@ -1,4 +1,5 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from os import listdir
 from os.path import isfile, join
 from math import sqrt
@@ -13,11 +14,15 @@ import matplotlib.pyplot as plt
 from collections import OrderedDict
 
 import maintainability.better_code_hub as bch
+from maintainability.score_table import ScoreTable, get_score_table_path
 import stats.chart as chart
+import stats.data as data
+import stats.enum as enum
+import stats.tests as tests
 
 
 
-def main_calculation(df, cache, dataset):
+def main_calculation(df, cache, dataset, score_table=None):
     
     none = 0; error = 0    
 
@@ -28,44 +33,54 @@ def main_calculation(df, cache, dataset):
         sha_key = 'sha'
         sha_p_key = 'sha-p'
     
-    for i, r in df.iterrows():
-        if r[sha_key] is np.nan or r[sha_p_key] is np.nan:
-            continue
-            
-        info_f = cache.get_stored_commit_analysis(r['owner'], r['project'], r[sha_key])
-        info_p = cache.get_stored_commit_analysis(r['owner'], r['project'], r[sha_p_key])
-                    
-        if info_f is None or info_p is None:
-            none+=1
-            df.at[i, 'diff'] = np.nan
-            continue
-            
-        if info_f.get('error') or info_p.get('error'):
-            error+=1
-            df.at[i, 'diff'] = np.nan
+    if score_table is None:
+        score_table = ScoreTable(get_score_table_path(cache.storage_path))
+
+    rows, keys = [], []
+    commits = zip(df['owner'].values, df['project'].values, df[sha_key].values, df[sha_p_key].values)
+    for n, (owner, project, sha, sha_p) in enumerate(commits):
+        if pd.isnull(sha) or pd.isnull(sha_p):
             continue
-        
-        try:
-            main_f = bch.compute_maintainability_score_per_guideline(info_f)
-            main_p = bch.compute_maintainability_score_per_guideline(info_p)
-            
-            score_f = bch.compute_maintainability_score(info_f)
-            score_p = bch.compute_maintainability_score(info_p)
-
-            df.at[i, 'main_fix'] = score_f
-            df.at[i, 'main_prev'] = score_p
-            df.at[i, 'diff'] = score_f - score_p
-            
-            for k in main_f.keys():
-                df.at[i, k+'-fix'] = main_f[k]
-                df.at[i, k+'-prev'] = main_p[k]
-                df.at[i, k+'-diff'] = main_f[k] - main_p[k]
-                
-        except ZeroDivisionError as e:
-            df.at[i, 'diff'] = np.nan
-            error+=1
-    
-    return df    
+        rows.append(n)
+        keys += [cache.get_commit_analysis_storage_key(owner, project, sha),
+                 cache.get_commit_analysis_storage_key(owner, project, sha_p)]
+
+    # fix and parent reports are interleaved, only new or changed reports are scored
+    table_rows = score_table.lookup(cache, keys)
+    score_table.save()
+    rows = np.array(rows, dtype=int)
+    found = (table_rows[0::2] >= 0) & (table_rows[1::2] >= 0)
+    none += int((~found).sum())
+    rows, table_rows = rows[found], table_rows.reshape(-1, 2)[found]
+    failed = score_table.errors[table_rows].any(axis=1)
+    error += int(failed.sum())
+    rows, table_rows = rows[~failed], table_rows[~failed]
+
+    order = score_table.get_guideline_order(table_rows.ravel())
+    guidelines = [score_table.guidelines[g] for g in order]
+    overall = score_table.overall[table_rows]
+    scored = ~np.isnan(overall).any(axis=1)
+    error += int((~scored).sum())
+    rows, table_rows, overall = rows[scored], table_rows[scored], overall[scored]
+    scores_f = score_table.scores[table_rows[:, 0]][:, order]
+    scores_p = score_table.scores[table_rows[:, 1]][:, order]
+
+    def column(values):
+        full = np.full(len(df), np.nan)
+        full[rows] = values
+        return full
+
+    results = OrderedDict()
+    results['main_fix'] = column(overall[:, 0])
+    results['main_prev'] = column(overall[:, 1])
+    results['diff'] = results['main_fix'] - results['main_prev']
+    for g, k in enumerate(guidelines):
+        results[k+'-fix'] = column(scores_f[:, g])
+        results[k+'-prev'] = column(scores_p[:, g])
+        results[k+'-diff'] = results[k+'-fix'] - results[k+'-prev']
+
+    df = df.drop(columns=[c for c in results if c in df.columns])
+    return pd.concat([df, pd.DataFrame(results, index=df.index)], axis=1)
         
 def main_calculation_by_db(db, results, cache, dataset, baseline=""):
     df = pd.read_csv(db)
@@ -77,49 +92,83 @@ def main_calculation_by_db(db, results, cache, dataset, baseline=""):
     df = main_calculation(df, cache, dataset)
     return df, path
 
-def export(secdb, regdb, results, cache_path, baseline):
+def export(secdb, regdb, results, cache_path, baseline, columnar=None):
     
     cache = bch.BCHCache(cache_path)
     
     # df_sec, sec_res_path = main_calculation_by_db(secdb, results, cache, 'security')
-    # df_sec.to_csv(sec_res_path, index=False)
+    # data.write_results(df_sec, sec_res_path, columnar)
     
     df_reg, reg_res_path = main_calculation_by_db(regdb, results, cache, 'regular', baseline=baseline)
-    df_reg.to_csv(reg_res_path, index=False)
+    data.write_results(df_reg, reg_res_path, columnar)
         
 def language(secdb, reports):
-    df_sec = pd.read_csv(secdb)
+    df_sec = data.read_results(secdb, columns=['diff', 'Language'])
     chart.main_per_language_chart(reports, df_sec)
 
 def severity(secdb, reports):
-    df_sec = pd.read_csv(secdb)
+    df_sec = data.read_results(secdb, columns=['diff', 'Severity'])
     chart.main_per_severity(reports, df_sec)
 
 def guideline(secdb, reports):
-    df_sec = pd.read_csv(secdb)
+    df_sec = data.read_results(secdb, columns=[g+'-diff' for g in enum.guidelines])
     chart.main_per_guideline_chart(reports, df_sec)
 
 def cwe(secdb, reports):
-    df_sec = pd.read_csv(secdb)
+    df_sec = data.read_results(secdb, columns=['diff', 'CWE'])
     chart.main_per_cwe_chart(reports, df_sec)
     
 def cwe_spec(secdb, reports, cwe):
-    df_sec = pd.read_csv(secdb)
+    df_sec = data.read_results(secdb, columns=['diff', 'CWE'])
     chart.main_per_cwe_spec_chart(reports, cwe, df_sec)
 
-def comparison(results, reports):
+def read_comparison_results(results):
     files = [f for f in listdir(results) if isfile(join(results, f)) and '.csv' in f]
-    dfs = {f.split('_')[2]:pd.read_csv("{}{}".format(results, f)) for f in files}
-    chart.main_comparison_chart(reports, dfs)
+    return {f.split('_')[2]:data.read_results("{}{}".format(results, f), columns=['diff']) for f in files}
+
+def comparison(results, reports):
+    chart.main_comparison_chart(reports, read_comparison_results(results))
     
-def guideline_swarm(secdb, reports):
-    df_sec = pd.read_csv(secdb)
-    chart.main_guideline_swarm_plot(reports, df_sec)
+def guideline_swarm(secdb, reports, binned=False):
+    # the test report is joined with every column of the results
+    df_sec = data.read_results(secdb)
+    chart.main_guideline_swarm_plot(reports, df_sec, binned)
+
+def _render(function, args, preview, resamples, force):
+    """Render one chart in a worker process."""
+    matplotlib.use('Agg')
+    chart.set_preview(preview)
+    chart.FORCE = force
+    # charts already run in parallel, groups are resampled in the worker itself
+    tests.RESAMPLES, tests.WORKERS = resamples, 1
+    function(*args)
+    return function.__name__
+
+def render_all(secdb, reports, results=None, cwe=None, workers=None, preview=False, binned=False):
+    """Render every chart from the data loaded once, one chart per worker process."""
+    df_sec = data.read_results(secdb)
+    jobs = [(chart.main_guideline_swarm_plot, (reports, df_sec, binned)),
+            (chart.main_per_language_chart, (reports, df_sec[['diff', 'Language']])),
+            (chart.main_per_severity, (reports, df_sec[['diff', 'Severity']])),
+            (chart.main_per_cwe_chart, (reports, df_sec[['diff', 'CWE']]))]
+    if cwe != None:
+        jobs.append((chart.main_per_cwe_spec_chart, (reports, cwe, df_sec[['diff', 'CWE']])))
+    if results != None:
+        jobs.append((chart.main_comparison_chart, (reports, read_comparison_results(results))))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render, function, args, preview, tests.RESAMPLES,
+                                   chart.FORCE)
+                   for function, args in jobs]
+        for (function, _), future in zip(jobs, futures):
+            try:
+                print('Rendered {}'.format(future.result()))
+            except Exception as e:
+                print('Failed to render {}: {!r}'.format(function.__name__, e))
     
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Report results')    
-    parser.add_argument('--report', dest='goal', choices=['export', 'comparison', 'severity', 'guideline', 'language', 'cwe', 'cwe-spec'],
+    parser.add_argument('--report', dest='goal', choices=['export', 'comparison', 'severity', 'guideline', 'language', 'cwe', 'cwe-spec', 'all'],
                         help='choose a report goal')
                         
     parser.add_argument('-results', type=str, metavar='folder path', help='results folder path')  
@@ -129,21 +178,36 @@ if __name__ == "__main__":
     parser.add_argument('-cache', type=str, metavar='file path', help='cache path')   
     parser.add_argument('-cwe', type=str, metavar='file path', help='cache path')    
     parser.add_argument('-baseline', type=str, metavar='baseline name', help='baseline name')    
+    parser.add_argument('-columnar', type=str, choices=['parquet', 'feather'],
+                        help='also export results in a columnar format')
+    parser.add_argument('-resamples', type=int, default=tests.RESAMPLES, metavar='N',
+                        help='bootstrap resamples and permutations per group in test reports (default: off)')
+    parser.add_argument('-workers', type=int, metavar='N',
+                        help='processes used to resample groups, or to render charts with --report all')
+    parser.add_argument('--preview', action='store_true',
+                        help='render labels with mathtext instead of LaTeX for quick iteration')
+    parser.add_argument('--force', action='store_true',
+                        help='render charts even if their inputs have not changed')
+    parser.add_argument('--binned-swarm', action='store_true',
+                        help='place guideline swarm points by binning them, for large datasets')
      
     args = parser.parse_args()
+    tests.RESAMPLES, tests.WORKERS = args.resamples, args.workers
+    chart.set_preview(args.preview)
+    chart.FORCE = args.force
 
     if args.goal == 'export':  
         if args.secdb != None and args.regdb != None \
             and args.results != None and args.cache != None \
             and (args.baseline == "random" or args.baseline == "size"):
-            export(secdb=args.secdb, regdb=args.regdb, results=args.results, cache_path=args.cache, baseline=args.baseline)
+            export(secdb=args.secdb, regdb=args.regdb, results=args.results, cache_path=args.cache, baseline=args.baseline, columnar=args.columnar)
     elif args.goal == 'comparison':
         if args.results != None \
             and args.reports != None:
             comparison(results=args.results, reports=args.reports)
     elif args.goal == 'guideline':
         if args.secdb != None and args.reports != None:
-            guideline_swarm(secdb=args.secdb, reports=args.reports)
+            guideline_swarm(secdb=args.secdb, reports=args.reports, binned=args.binned_swarm)
     elif args.goal == 'language':
         if args.secdb != None and args.reports != None:
             language(secdb=args.secdb, reports=args.reports)
@@ -156,5 +220,10 @@ if __name__ == "__main__":
     elif args.goal == 'cwe-spec':
         if args.secdb != None and args.reports != None and args.cwe != None:
             cwe_spec(secdb=args.secdb, reports=args.reports, cwe=args.cwe)
+    elif args.goal == 'all':
+        if args.secdb != None and args.reports != None:
+            render_all(secdb=args.secdb, reports=args.reports, results=args.results,
+                       cwe=args.cwe, workers=args.workers, preview=args.preview,
+                       binned=args.binned_swarm)
     else:
         print('Something is wrong. Verify your parameters')
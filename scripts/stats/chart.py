@@ -1,3 +1,9 @@
+import functools
+import hashlib
+import inspect
+import os
+import re
+
 import matplotlib.pyplot as plt
 from matplotlib import rc
 from matplotlib import rcParams
@@ -9,6 +15,7 @@ import seaborn as sns
 from scipy.stats import wilcoxon
 import numpy as np
 
+from maintainability import log
 from . import enum
 from . import tests
 from . import data
@@ -18,6 +25,93 @@ rcParams['font.family'] = 'serif'
 rcParams['mathtext.fontset'] = 'cm'
 
 BAR_WIDTH = 0.25
+PREVIEW = False
+SWARM_POINT_SIZE = 4.3 # marker diameter in points
+SWARM_WIDTH = 0.8 # share of a category band used by its points
+
+def set_preview(preview):
+    """Render with mathtext instead of LaTeX, much faster but not for publication."""
+    global PREVIEW
+    PREVIEW = preview
+    rc('text', usetex=not preview)
+
+FORCE = False
+FINGERPRINT_EXTENSION = '.fingerprint'
+
+def _update_with_frame(digest, df):
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+
+def get_fingerprint(name, arguments, tables=()):
+    """Hash of everything a chart is drawn from.
+
+    That is its data frames, its other parameters, the grouping tables it
+    reads, the chart code and the test and rendering settings.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in [__file__, enum.__file__, data.__file__, tests.__file__] + list(tables):
+        if os.path.exists(path):
+            with open(path, 'rb') as source:
+                digest.update(source.read())
+        digest.update(path.encode())
+    params = [name, tests.RESAMPLES, tests.CONFIDENCE, tests.SEED, rcParams['text.usetex']]
+    for key, value in arguments.items():
+        if isinstance(value, pd.DataFrame):
+            _update_with_frame(digest, value)
+        elif isinstance(value, dict):
+            for k in sorted(value):
+                digest.update(str(k).encode())
+                _update_with_frame(digest, value[k])
+        else:
+            params.append((key, value))
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+def cached_chart(*outputs, tables=()):
+    """Skip a chart when its outputs were rendered from the same inputs.
+
+    The fingerprint of the inputs is stored next to the first output. Output
+    and table paths are formatted with the arguments of the chart, or outputs
+    is a function of some of these arguments returning the output names.
+    """
+    def get_outputs(arguments):
+        if len(outputs) == 1 and callable(outputs[0]):
+            names = inspect.signature(outputs[0]).parameters
+            return outputs[0](**{name: arguments[name] for name in names})
+        return [output.format(**arguments) for output in outputs]
+
+    def decorator(chart):
+        signature = inspect.signature(chart)
+        @functools.wraps(chart)
+        def wrapper(reports, *args, **kwargs):
+            arguments = signature.bind(reports, *args, **kwargs)
+            arguments.apply_defaults()
+            arguments = dict(arguments.arguments)
+            del arguments['reports']
+            paths = ['{}/{}'.format(reports, output) for output in get_outputs(arguments)]
+            stored = paths[0] + FINGERPRINT_EXTENSION
+            fingerprint = get_fingerprint(chart.__name__, arguments,
+                                          [table.format(**arguments) for table in tables])
+            if not FORCE and all(os.path.exists(path) for path in paths + [stored]):
+                with open(stored) as f:
+                    if f.read() == fingerprint:
+                        log.info('{} is up to date'.format(paths[0]))
+                        return
+            if os.path.exists(stored):
+                # outputs of an interrupted render must not look up to date
+                os.remove(stored)
+            chart(reports, *args, **kwargs)
+            plt.close('all')
+            with open(stored, 'w') as f:
+                f.write(fingerprint)
+        return wrapper
+    return decorator
+
+def format_label(label):
+    """Drop LaTeX-only commands from labels in preview mode."""
+    if PREVIEW:
+        return re.sub(r'\\textbf\{([^}]*)\}', r'\1', label)
+    return label
 
 def set_bars(df, idx):
     plt.barh(idx, df['pos'], BAR_WIDTH, alpha=0.7, align='center', color='green', label='Positive')
@@ -36,33 +130,36 @@ def config_report(data, yaxs_size, x, y, plt_config):
     fig = plt.figure(figsize=(x,y))
     return pd.DataFrame(data), np.arange(yaxs_size), fig, fig.add_subplot(plt_config)
 
+def outcome_report(results, types):
+    """Chart data of outcomes aggregated by stats.data, one row per group."""
+    return {'neg': pd.Series((results['neg_abs']/results['N']).values),
+        'neg_abs': pd.Series(results['neg_abs'].values),
+        'pos': pd.Series((results['pos_abs']/results['N']).values),
+        'pos_abs': pd.Series(results['pos_abs'].values),
+        'nul': pd.Series((results['nul_abs']/results['N']).values),
+        'nul_abs': pd.Series(results['nul_abs'].values),
+        'N': pd.Series(results['N'].values),
+        'type': pd.Series(types)}
+
 def save_report(path, name):
     plt.gca().xaxis.grid(True, linestyle='--')
     plt.tight_layout()
     plt.savefig('{}/{}'.format(path, name))
 
+@cached_chart('baseline.pdf', 'baseline_stats_report.csv')
 def main_comparison_chart(reports, dfs):   
         
         df_sec, df_rand_reg, df_size_reg = dfs['security'], dfs['random'], dfs['size']
 
-        test = pd.concat((tests.hypothesis_test(df_rand_reg['diff'], 'random-reg'), 
-                            tests.hypothesis_test(df_size_reg['diff'], 'size-reg'),
-                            tests.hypothesis_test(df_sec['diff'], 'security')),
-                            ignore_index=True)
+        test = tests.hypothesis_tests(((df_rand_reg['diff'], 'random-reg'), 
+                            (df_size_reg['diff'], 'size-reg'),
+                            (df_sec['diff'], 'security')))
                         
-        total_sec, total_rand_reg, total_size_reg = data.filter_results(df_sec), \
-                                                    data.filter_results(df_rand_reg[pd.notnull(df_rand_reg['diff'])]),  \
-                                                    data.filter_results(df_size_reg)    
-        db_size = len(df_sec)  
-        db_rand_size = len(df_rand_reg[pd.notnull(df_rand_reg['diff'])])
-
-        rep = {'neg' : pd.Series([total_rand_reg['neg']/db_rand_size, total_size_reg['neg']/db_size , total_sec['neg']/db_size]),
-                'neg_abs' : pd.Series([total_rand_reg['neg'],  total_size_reg['neg'], total_sec['neg']]),
-                'pos' : pd.Series([total_rand_reg['pos']/db_rand_size, total_size_reg['pos']/db_size , total_sec['pos']/db_size]),
-                'pos_abs' : pd.Series([total_rand_reg['pos'],  total_size_reg['pos'], total_sec['pos']]),
-                'nul' : pd.Series([total_rand_reg['nul']/db_rand_size, total_size_reg['nul']/db_size , total_sec['nul']/db_size]),
-                'nul_abs' : pd.Series([total_rand_reg['nul'],  total_size_reg['nul'], total_sec['nul']]),
-                'type' : pd.Series(['Regular Changes\n(random-baseline)', 'Regular Changes\n(size-baseline)', 'Security Patches'])}
+        results = pd.concat([data.aggregate_columns(d, ['diff']) for d in (df_rand_reg, df_size_reg, df_sec)])
+        # shares of the size baseline and security patches are over all security patches
+        results['N'] = [results['N'].iloc[0], len(df_sec), len(df_sec)]
+        rep = outcome_report(results, ['Regular Changes\n(random-baseline)', 'Regular Changes\n(size-baseline)', 'Security Patches'])
+        del rep['N']
         
         df, idx, fig, ax = config_report(rep, len(rep['type']), 7, 5, 111)
         
@@ -82,26 +179,23 @@ def main_comparison_chart(reports, dfs):
         save_report(reports, 'baseline.pdf')
         test.join(df).to_csv(reports+'/baseline_stats_report.csv', index=False)
 
+def cwe_spec_outputs(cwe):
+    """Chart and test report names of a CWE, e.g., main_per_cwe_spec_664.pdf for CWE_664."""
+    return ('main_per_cwe_spec_{}.pdf'.format(cwe[4:]),
+            'cwe_spec_test_report_{}.csv'.format(cwe[4:]))
+
+@cached_chart(cwe_spec_outputs, tables=['stats/{cwe}'])
 def main_per_cwe_spec_chart(reports, cwe, df, wilcoxon = True):
     
-    composites = enum.read_cwe_composites('stats/{}'.format(cwe))
-    
-    for i, r in df.iterrows():
-        if not enum.check_if_belongs_to_cwe(composites, r['CWE']):
-            df = df.drop(i)
+    index = enum.get_cwe_index('stats/{}'.format(cwe))
+    df = df[df['CWE'].map(lambda c: any(index.belongs_to(c, composite)
+                                        for composite in index.composites))]
 
     cwes = data.add_others_group(df, tests.filter_small_cwe_groups(df), 'CWE', 'MISC')
-    results = {c:data.filter_results_per_field(df, c, 'CWE') for c in cwes}
-    test = pd.concat([tests.hypothesis_test(df[df['CWE'] == c]['diff'], c) for c in cwes], ignore_index=True)
-    
-    rep = {'neg': pd.Series([results[i][0]/sum(results[i]) for i in cwes]),
-        'neg_abs': pd.Series([results[i][0] for i in cwes]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in cwes]),
-        'pos_abs': pd.Series([results[i][1] for i in cwes]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in cwes]),
-        'nul_abs': pd.Series([results[i][2] for i in cwes]),
-        'N': pd.Series([sum(results[i]) for i in cwes]),
-        'type': pd.Series(cwes)}
+    results = data.aggregate_outcomes(df, 'CWE', cwes)
+    test = tests.hypothesis_tests(data.group_values(df, 'CWE', cwes))
+    
+    rep = outcome_report(results, cwes)
 
     df, idx, fig, ax = config_report(rep, len(rep['type']), 5, 8, 111)
 
@@ -118,33 +212,21 @@ def main_per_cwe_spec_chart(reports, cwe, df, wilcoxon = True):
             ax.text(0.5, boxes_start, box_text , bbox={'facecolor':'white', 'alpha':0.8, 'pad':3}, fontsize=9)
             boxes_start -= 1.0 
 
-    save_report(reports, 'main_per_cwe_spec.pdf')
-    test.join(df).to_csv(reports+'/cwe_spec_test_report.csv', index=False)
+    chart_name, report_name = cwe_spec_outputs(cwe)
+    save_report(reports, chart_name)
+    test.join(df).to_csv(reports+'/'+report_name, index=False)
     
+@cached_chart('main_per_cwe.pdf', 'cwe_test_report.csv', tables=['stats/cwe'])
 def main_per_cwe_chart(reports, df, wilcoxon = True):
     
-    composites = enum.read_cwe_composites('stats/CWE')
-    
-    for i, r in df.iterrows():
-        if r['CWE'] is not np.nan:
-            cwe = enum.check_if_belongs_to_cwe(composites, r['CWE'])
-            if cwe != None:
-                df.at[i, 'CWE'] = cwe
-        else:
-            df.at[i, 'CWE'] = 'MISC'
+    index = enum.get_cwe_index('stats/cwe')
+    df['CWE'] = index.relabel(df['CWE']).where(df['CWE'].notnull(), 'MISC')
     
     cwes = data.add_others_group(df, tests.filter_small_cwe_groups(df), 'CWE', 'MISC') 
-    results = {c:data.filter_results_per_field(df, c, 'CWE') for c in cwes}          
-    test = pd.concat([tests.hypothesis_test(df[df['CWE'] == c]['diff'], c) for c in cwes], ignore_index=True)
+    results = data.aggregate_outcomes(df, 'CWE', cwes)
+    test = tests.hypothesis_tests(data.group_values(df, 'CWE', cwes))
         
-    rep = {'neg': pd.Series([results[i][0]/sum(results[i]) for i in cwes]),
-        'neg_abs': pd.Series([results[i][0] for i in cwes]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in cwes]),
-        'pos_abs': pd.Series([results[i][1] for i in cwes]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in cwes]),
-        'nul_abs': pd.Series([results[i][2] for i in cwes]),
-        'N': pd.Series([sum(results[i]) for i in cwes]),
-        'type': pd.Series(cwes)}
+    rep = outcome_report(results, cwes)
 
     df, idx, fig, ax = config_report(rep, len(rep['type']), 5, 8, 111)
     
@@ -163,25 +245,16 @@ def main_per_cwe_chart(reports, df, wilcoxon = True):
     save_report(reports, 'main_per_cwe.pdf')
     test.join(df).to_csv(reports+'/cwe_test_report.csv', index=False)
 
+@cached_chart('main_per_guideline.pdf', 'guidelines_test_report.csv')
 def main_per_guideline_chart(reports, df, wilcoxon = True):
     
-    results = {g:data.filter_results_per_guideline(df, g) 
-                for g in enum.guidelines}    
-    
-    keys = results.keys() 
+    keys = list(enum.guidelines)
+    results = data.aggregate_columns(df, [i+'-diff' for i in keys])
     
-    test = pd.concat([tests.hypothesis_test(df[i+'-diff'], i) 
-                            for i in keys],
-                            ignore_index=True)
+    test = tests.hypothesis_tests([(df[i+'-diff'], i) 
+                            for i in keys])
     
-    rep = {'neg': pd.Series([results[i][0]/sum(results[i]) for i in keys]),
-        'neg_abs': pd.Series([results[i][0] for i in keys]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in keys]),
-        'pos_abs': pd.Series([results[i][1] for i in keys]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in keys]),
-        'nul_abs': pd.Series([results[i][2] for i in keys]),
-        'N': pd.Series([sum(results[i]) for i in keys]),
-        'type': pd.Series([enum.guidelines[i] for i in keys])}
+    rep = outcome_report(results, [format_label(enum.guidelines[i]) for i in keys])
         
     df, idx, fig, ax = config_report(rep, len(rep['type']), 5, 7, 111)
     
@@ -202,28 +275,18 @@ def main_per_guideline_chart(reports, df, wilcoxon = True):
     save_report(reports, 'main_per_guideline.pdf')
     test.join(df).to_csv(reports+'/guidelines_test_report.csv', index=False)
 
+@cached_chart('main_per_language.pdf', 'language_test_report.csv')
 def main_per_language_chart(reports, df, wilcoxon = True):
     
-    for i, r in df.iterrows():
-        lang = enum.get_language(r['Language'])
-        if lang != None:
-            df.at[i, 'Language'] = lang
+    langs = df['Language'].map(enum.file_types)
+    df['Language'] = langs.where(langs.notnull(), df['Language'])
     
     langs = tests.filter_small_sample_groups(df, 'Language')
         
-    results = {l:data.filter_results_per_field(df, l, 'Language') for l in langs}
-    test = pd.concat([tests.hypothesis_test(df[df['Language'] == i]['diff'], i) 
-                            for i in langs],
-                            ignore_index=True)    
+    results = data.aggregate_outcomes(df, 'Language', langs)
+    test = tests.hypothesis_tests(data.group_values(df, 'Language', langs))    
                                 
-    rep = {'neg': pd.Series([results[i][0]/sum(results[i]) for i in langs]),
-        'neg_abs': pd.Series([results[i][0] for i in langs]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in langs]),
-        'pos_abs': pd.Series([results[i][1] for i in langs]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in langs]),
-        'nul_abs': pd.Series([results[i][2] for i in langs]),
-        'N': pd.Series([sum(results[i]) for i in langs]),
-        'type': pd.Series(langs)}
+    rep = outcome_report(results, langs)
     
     df, idx, fig, ax = config_report(rep, len(rep['type']), 6, 8, 111)
     
@@ -242,21 +305,15 @@ def main_per_language_chart(reports, df, wilcoxon = True):
     save_report(reports, 'main_per_language.pdf') 
     test.join(df).to_csv(reports+'/language_test_report.csv', index=False)
     
+@cached_chart('main_per_severity.pdf', 'severity_test_report.csv')
 def main_per_severity(reports, df, wilcoxon = True):
     
     y_axis = data.add_others_group(df, enum.severity, 'Severity', 'UNKNOWN')
     
-    results = {s:data.filter_results_per_field(df, s, 'Severity') for s in y_axis}        
-    test = pd.concat([tests.hypothesis_test(df[df['Severity'] == i]['diff'], i) for i in y_axis], ignore_index=True)
+    results = data.aggregate_outcomes(df, 'Severity', y_axis)
+    test = tests.hypothesis_tests(data.group_values(df, 'Severity', y_axis))
         
-    rep = {'neg': pd.Series([results[i][0]/sum(results[i]) for i in y_axis]),
-        'neg_abs': pd.Series([results[i][0] for i in y_axis]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in y_axis]),
-        'pos_abs': pd.Series([results[i][1] for i in y_axis]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in y_axis]),
-        'nul_abs': pd.Series([results[i][2] for i in y_axis]),
-        'N': pd.Series([sum(results[i]) for i in y_axis]),
-        'type': pd.Series(['Unknown', 'Low', 'Medium', 'High'])}
+    rep = outcome_report(results, ['Unknown', 'Low', 'Medium', 'High'])
 
     df, idx, fig, ax = config_report(rep, len(rep['type']), 6, 6, 111)
     
@@ -276,51 +333,83 @@ def main_per_severity(reports, df, wilcoxon = True):
     save_report(reports, 'main_per_severity.pdf')
     test.join(df).to_csv(reports+'/severity_test_report.csv', index=False)
     
-def main_guideline_swarm_plot(reports, df):
-    
-    swarm_data = {'m': [], 'guideline': [], 'impact': []}
+def beeswarm_offsets(x, bin_width, spacing, width=SWARM_WIDTH):
+    """Offsets across the category axis of points in a binned beeswarm.
+
+    Points are binned along the value axis and stacked alternately on both
+    sides of the category center, closer together in crowded bins so that
+    they stay within the band.
+    """
+    if len(x) == 0:
+        return np.zeros(0)
+    bins = np.floor((x - x.min()) / bin_width).astype(int)
+    order = np.lexsort((x, bins))
+    sorted_bins = bins[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_bins)) + 1]
+    counts = np.diff(np.r_[starts, len(x)])
+    rank = np.arange(len(x)) - np.repeat(starts, counts)
+    step = np.minimum(spacing, width / np.repeat(counts, counts))
+    offsets = np.empty(len(x))
+    offsets[order] = (rank + 1) // 2 * np.where(rank % 2, -1, 1) * step
+    return offsets
+
+def binned_swarm_plot(ax, swarm_data, categories, palette, size=SWARM_POINT_SIZE):
+    """Draw a swarm plot of horizontal categories with points placed by binning.
+
+    Placement is vectorized on the scaled value axis and the points are
+    rasterized, so render time and file size do not grow with the points.
+    """
+    swarm_data = swarm_data[swarm_data['m'].notnull()]
+    position = ax.xaxis.get_transform().transform(swarm_data['m'].to_numpy(dtype=float))
+    ax.set_ylim(len(categories) - 0.5, -0.5)
+    box = ax.get_window_extent()
+    span = max(position.max() - position.min(), 1e-9) * 1.1 if len(position) else 1
+    # marker diameter in scaled value units and in category units
+    bin_width = size * ax.figure.dpi / 72 / box.width * span
+    spacing = size * ax.figure.dpi / 72 / box.height * len(categories)
+    y = swarm_data['guideline'].map({c: i for i, c in enumerate(categories)}).to_numpy(dtype=float)
+    for i in range(len(categories)):
+        selected = y == i
+        y[selected] += beeswarm_offsets(position[selected], bin_width, spacing)
+    handles = []
+    for impact, color in sorted(palette.items()):
+        selected = (swarm_data['impact'] == impact).to_numpy()
+        handles.append(ax.scatter(swarm_data['m'].to_numpy()[selected], y[selected], s=size ** 2,
+                                  color=color, alpha=0.7, lw=0.5, edgecolor='k',
+                                  rasterized=True, label=impact))
+    return handles
+
+@cached_chart('main_guideline_plot.pdf', 'guideline_test_report.csv')
+def main_guideline_swarm_plot(reports, df, binned=False):
     
-    x_axis_values = dict(enum.guidelines, **{'diff': '$M (v)$'})
+    x_axis_values = {k: format_label(v) for k, v in dict(enum.guidelines, **{'diff': '$M (v)$'}).items()}
         
-    test = pd.concat([tests.hypothesis_test(df[i+'-diff'], i) 
+    test = tests.hypothesis_tests([(df[i+'-diff'], i) 
                             if i != 'diff' 
-                            else tests.hypothesis_test(df['diff'], 'diff')
-                            for i in x_axis_values],
-                            ignore_index=True)
-    
-    results = {i:data.filter_results_per_guideline(df, i) 
-                for i in x_axis_values}    
-    
-    keys = results.keys()
-    rep = pd.DataFrame({'neg': pd.Series([results[i][0]/sum(results[i]) for i in keys]),
-        'neg_abs': pd.Series([results[i][0] for i in keys]),
-        'pos': pd.Series([results[i][1]/sum(results[i]) for i in keys]),
-        'pos_abs': pd.Series([results[i][1] for i in keys]),
-        'nul': pd.Series([results[i][2]/sum(results[i]) for i in keys]),
-        'nul_abs': pd.Series([results[i][2] for i in keys]),
-        'N': pd.Series([sum(results[i]) for i in keys]),
-        'type': pd.Series([x_axis_values[i] for i in keys])})
-    
-    for v in x_axis_values.keys():
-        f = v+'-diff' if 'diff' not in v else v
-        for i in df[f]:
-            swarm_data['m'].append(i)
-            swarm_data['guideline'].append(x_axis_values[v])
-            if i > 0:
-                swarm_data['impact'].append('Positive')
-            elif i < 0:
-                swarm_data['impact'].append('Negative')
-            else:
-                swarm_data['impact'].append('None')
+                            else (df['diff'], 'diff')
+                            for i in x_axis_values])
+    
+    keys = list(x_axis_values)
+    results = data.aggregate_columns(df, [i+'-diff' if 'diff' not in i else i for i in keys])
+    rep = pd.DataFrame(outcome_report(results, [x_axis_values[i] for i in keys]))
+    
+    swarm_data = pd.DataFrame({
+        'm': np.concatenate([df[v+'-diff' if 'diff' not in v else v].to_numpy(dtype=float)
+                             for v in keys]),
+        'guideline': np.repeat([x_axis_values[v] for v in keys], len(df))})
+    swarm_data['impact'] = np.select([swarm_data['m'] > 0, swarm_data['m'] < 0],
+                                     ['Positive', 'Negative'], 'None')
                 
     palette ={"Positive":"green","None":"orange","Negative":"red"}
-    swarm_data = pd.DataFrame(swarm_data)
     
     f, ax = plt.subplots(figsize=(9, 18))
     ax.set_xscale("symlog")
 
-    sns.swarmplot(x="m", y="guideline", hue='impact', data=swarm_data, alpha=0.7, ax=ax, size=4.3, palette=palette, lw=2, edgecolor='k')
-    swarm_cols = ax.collections
+    if binned:
+        swarm_cols = binned_swarm_plot(ax, swarm_data, [x_axis_values[v] for v in keys], palette)
+    else:
+        sns.swarmplot(x="m", y="guideline", hue='impact', data=swarm_data, alpha=0.7, ax=ax, size=4.3, palette=palette, lw=2, edgecolor='k')
+        swarm_cols = ax.collections
     
     sns.boxplot(x="m", y="guideline", data=swarm_data,
                      showcaps=True,boxprops=dict(facecolor='None', zorder=10),
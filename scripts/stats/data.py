@@ -1,26 +1,67 @@
+import os
 
-def filter_results_per_field(df, t, field):
-    return [df[(df['diff'] < 0) & (df[field] == t)].shape[0],
-                df[(df['diff'] > 0) & (df[field] == t)].shape[0],
-                df[(df['diff'] == 0) & (df[field] == t)].shape[0]]
+import pandas as pd
 
-def filter_results(df):
-    return {'neg':df[df['diff'] < 0].shape[0],
-                'pos':df[df['diff'] > 0].shape[0],
-                'nul':df[df['diff'] == 0].shape[0]}
+COLUMNAR_READERS = {'.parquet': pd.read_parquet, '.feather': pd.read_feather}
 
-def filter_results_per_guideline(df, g):
-    f = g+'-diff' if 'diff' not in g else g
-    return [df[df[f] < 0].shape[0],
-                df[df[f] > 0].shape[0],
-                df[df[f] == 0].shape[0]]
+def write_results(df, path, columnar=None):
+    """Write results to csv and, optionally, to a parquet/feather file next to it."""
+    df.to_csv(path, index=False)
+    if columnar == 'parquet':
+        df.to_parquet(os.path.splitext(path)[0] + '.parquet', index=False)
+    elif columnar == 'feather':
+        df.reset_index(drop=True).to_feather(os.path.splitext(path)[0] + '.feather')
+
+def read_results(path, columns=None):
+    """Read results, using an up-to-date parquet/feather copy of a csv if available."""
+    base, extension = os.path.splitext(path)
+    if extension in COLUMNAR_READERS:
+        return COLUMNAR_READERS[extension](path, columns=columns)
+    for columnar, reader in COLUMNAR_READERS.items():
+        if os.path.exists(base + columnar) \
+                and os.path.getmtime(base + columnar) >= os.path.getmtime(path):
+            return reader(base + columnar, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+OUTCOME_COLUMNS = ['neg_abs', 'pos_abs', 'nul_abs', 'N', 'mean', 'med']
+
+def _outcomes(values, groups):
+    """Aggregate the outcomes of values by group in one groupby pass."""
+    frame = pd.DataFrame({'group': groups, 'value': values,
+                          'neg': values < 0, 'pos': values > 0, 'nul': values == 0})
+    return frame.groupby('group', sort=False).agg(
+        neg_abs=('neg', 'sum'), pos_abs=('pos', 'sum'), nul_abs=('nul', 'sum'),
+        mean=('value', 'mean'), med=('value', 'median'))
+
+def aggregate_outcomes(df, key, groups=None, value='diff'):
+    """Negative/positive/null counts, N, mean and median of a value per group of a key.
+
+    Groups are in order of first appearance unless given. Rows with a missing
+    value are not counted.
+    """
+    agg = _outcomes(df[value], df[key])
+    if groups is not None:
+        agg = agg.reindex(groups)
+        agg[['neg_abs', 'pos_abs', 'nul_abs']] = agg[['neg_abs', 'pos_abs', 'nul_abs']].fillna(0)
+    agg['N'] = agg['neg_abs'] + agg['pos_abs'] + agg['nul_abs']
+    agg[['neg_abs', 'pos_abs', 'nul_abs', 'N']] = agg[['neg_abs', 'pos_abs', 'nul_abs', 'N']].astype(int)
+    return agg[OUTCOME_COLUMNS]
+
+def aggregate_columns(df, columns):
+    """Same aggregation as aggregate_outcomes, with one group per column."""
+    stacked = df[columns].melt(var_name='group', value_name='value')
+    return aggregate_outcomes(stacked, 'group', columns, value='value')
+
+def group_sizes(df, key):
+    """Number of rows per value of a key, in order of first appearance."""
+    return df.groupby(key, sort=False).size()
+
+def group_values(df, key, groups, value='diff'):
+    """(values, group) pairs of the given groups of a key, split in one pass."""
+    split = dict(list(df.groupby(key, sort=False)[value]))
+    return [(split.get(g, df[value].iloc[:0]), g) for g in groups]
 
 def add_others_group(df, group, key, label):
-    for i, r in df.iterrows():
-        if r[key] not in group:
-            df.at[i, key] = label
+    df[key] = df[key].where(df[key].isin(group), label)
     return [label] + group
-    
-
-    
-    
\ No newline at end of file
@@ -1,3 +1,5 @@
+import os
+
 # data.py 
 
 guidelines = {'Write Short Units of Code':'\\textbf{Write Short}\n\\textbf{Units of Code}\nUnit Size',
@@ -21,11 +23,18 @@ languages = {'Java': ['java', 'scala', 'js'],
 
 severity = ['LOW', 'MEDIUM', 'HIGH']
 
+# file type (extension, or name of files without one) -> language
+file_types = {}
+for language, types in languages.items():
+    for file_type in types:
+        file_types.setdefault(file_type, language)
+
+def get_file_type(path):
+    """Extension of a file, or its name when it has none (e.g., Gemfile, VERSION)."""
+    return os.path.basename(path).split('.')[-1]
+
 def get_language(key):
-    for k, v in languages.items():
-        if key in languages[k]:
-            return k
-    return None
+    return file_types.get(key)
 
 def read_cwe_composites(file):
     composites = {}
@@ -43,4 +52,57 @@ def check_if_belongs_to_cwe(composites, key):
     for i in composites:
         if key in composites[i]:
             return i
-    return None
\ No newline at end of file
+    return None
+
+
+class CWEIndex:
+    """Reverse map and transitive closure of CWE composites."""
+
+    def __init__(self, composites):
+        self.composites = composites
+        # same precedence as check_if_belongs_to_cwe: composites map to
+        # themselves, members to the first composite listing them
+        self.parent = {}
+        parents = {}
+        for composite, members in composites.items():
+            for member in members:
+                self.parent.setdefault(member, composite)
+                parents.setdefault(member, set()).add(composite)
+        for composite in composites:
+            self.parent[composite] = composite
+        self.ancestors = {}
+        for cwe in parents:
+            self.ancestors[cwe] = self._closure(cwe, parents)
+
+    @staticmethod
+    def _closure(cwe, parents):
+        ancestors, stack = set(), [cwe]
+        while stack:
+            for parent in parents.get(stack.pop(), ()):
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    stack.append(parent)
+        return frozenset(ancestors)
+
+    def get(self, cwe):
+        """Composite of a CWE or None, like check_if_belongs_to_cwe."""
+        return self.parent.get(cwe)
+
+    def belongs_to(self, cwe, ancestor):
+        """Check if a CWE is an ancestor or a (nested) member of it."""
+        return cwe == ancestor or ancestor in self.ancestors.get(cwe, ())
+
+    def relabel(self, cwes):
+        """Map a series of CWEs to their composites, keeping CWEs without one."""
+        composites = cwes.map(self.parent)
+        return composites.where(composites.notnull(), cwes)
+
+
+_CWE_INDEXES = {}
+
+def get_cwe_index(file):
+    """Return the CWE index of a composites file, built once per file version."""
+    key = (os.path.abspath(file), os.path.getmtime(file))
+    if key not in _CWE_INDEXES:
+        _CWE_INDEXES[key] = CWEIndex(read_cwe_composites(file))
+    return _CWE_INDEXES[key]
@@ -1,6 +1,18 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 from scipy.stats import wilcoxon
 
+from . import data
+
+RESAMPLES = 0 # bootstrap resamples and permutations per group, 0 to disable
+CONFIDENCE = 0.95
+SEED = 20210607
+WORKERS = None # one per CPU
+BLOCK_SIZE = 1 << 22 # values drawn per vectorized block
+
 def hypothesis_test(diff, i):
     test, pvalue = wilcoxon(x=diff, zero_method="pratt")
     return pd.DataFrame({'guideline':[i], 'test': [test], 
@@ -8,11 +20,63 @@ def hypothesis_test(diff, i):
                         'pvalue': [pvalue], 
                         'mean':[pd.DataFrame({'diff': diff})['diff'].mean()]})
 
+def hypothesis_tests(groups, resamples=None, workers=None):
+    """Wilcoxon test of each (diff, name) group with bootstrap CIs and permutation p-values.
+
+    Groups are resampled in a process pool, each one with its own seed, so
+    results do not depend on the number of workers.
+    """
+    groups = list(groups)
+    test = pd.concat([hypothesis_test(diff, i) for diff, i in groups], ignore_index=True)
+    resamples = RESAMPLES if resamples is None else resamples
+    if not resamples:
+        return test
+    seeds = np.random.SeedSequence(SEED).spawn(len(groups))
+    values = [pd.Series(diff).dropna().to_numpy(dtype=float) for diff, _ in groups]
+    workers = workers or WORKERS or os.cpu_count()
+    if workers > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups))) as executor:
+            results = list(executor.map(resampling_test, values, [resamples] * len(groups), seeds))
+    else:
+        results = [resampling_test(v, resamples, seed) for v, seed in zip(values, seeds)]
+    return test.join(pd.DataFrame(results, index=test.index))
+
+def resampling_test(values, resamples, seed):
+    """Bootstrap CIs of the mean and median and sign-flip permutation p-value of the mean."""
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    if n == 0:
+        return {'mean_ci_low': np.nan, 'mean_ci_high': np.nan, 'med_ci_low': np.nan,
+                'med_ci_high': np.nan, 'perm_pvalue': np.nan}
+    block = max(1, BLOCK_SIZE // n)
+    means, medians = np.empty(resamples), np.empty(resamples)
+    extreme = 0
+    observed = abs(values.mean())
+    for start in range(0, resamples, block):
+        size = min(block, resamples - start)
+        sample = values[rng.integers(0, n, size=(size, n))]
+        means[start:start + size] = sample.mean(axis=1)
+        medians[start:start + size] = np.median(sample, axis=1)
+        # under the null hypothesis the sign of each difference is exchangeable
+        signs = rng.integers(0, 2, size=(size, n), dtype=np.int8) * 2 - 1
+        permuted = np.abs((signs * values).mean(axis=1))
+        extreme += int((permuted >= observed - 1e-12 * max(observed, 1)).sum())
+    tail = (1 - CONFIDENCE) / 2 * 100
+    return {
+        'mean_ci_low': np.percentile(means, tail),
+        'mean_ci_high': np.percentile(means, 100 - tail),
+        'med_ci_low': np.percentile(medians, tail),
+        'med_ci_high': np.percentile(medians, 100 - tail),
+        'perm_pvalue': (extreme + 1) / (resamples + 1),
+    }
+
 def filter_small_sample_groups(df, key):
-    return [i for i in df[key].unique() if len(df[df[key] == i]) > 19]
+    sizes = data.group_sizes(df, key)
+    return [i for i in sizes.index if sizes[i] > 19]
 
 def filter_small_cwe_groups(df):
-    return [i for i in df['CWE'].unique() if str(i) != 'nan' and (len(df[df['CWE'] == i]) > 19) and 'CWE' in i]
+    sizes = data.group_sizes(df, 'CWE')
+    return [i for i in sizes.index if str(i) != 'nan' and sizes[i] > 19 and 'CWE' in i]
 
 def filter_cwe_groups(df):
     return [i for i in df['CWE'].unique() if str(i) != 'nan' and 'CWE' in i]
@@ -0,0 +1,54 @@
+"""Tests of the segment storage of caches."""
+
+from maintainability.cache import Cache, SegmentStore, get_segment_store
+
+
+def _keys(path):
+    return sorted(SegmentStore(path).keys())
+
+
+def test_partial_index_line_keeps_later_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentStore, 'SEGMENT_MAX_BYTES', 200)
+    path = str(tmp_path / 'cache.seg')
+    store = SegmentStore(path)
+    store.put('a', {'value': 0})
+    # interrupted run: the last index line is partially written
+    with open(store._index_path(), 'a') as index_file:
+        index_file.write('["b", 1, 4')
+    store = SegmentStore(path)
+    for n in range(20):
+        store.put(f'k{n}', {'value': n})
+    assert len(store) == 21
+    assert _keys(path) == sorted(['a'] + [f'k{n}' for n in range(20)])
+    assert SegmentStore(path).get('k3') == {'value': 3}
+
+
+def test_corrupted_index_is_rebuilt_from_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentStore, 'SEGMENT_MAX_BYTES', 200)
+    path = str(tmp_path / 'cache.seg')
+    store = SegmentStore(path)
+    for n in range(20):
+        store.put(f'k{n}', {'value': n})
+    store.put('k1', {'value': 'new'})
+    store.delete('k2')
+    with open(store._index_path()) as index_file:
+        lines = index_file.readlines()
+    lines[3] = lines[3][:5]  # a partial line followed by more lines
+    with open(store._index_path(), 'w') as index_file:
+        index_file.writelines(lines)
+    store = SegmentStore(path)
+    assert sorted(store.keys()) == sorted(f'k{n}' for n in range(20) if n != 2)
+    assert store.get('k1') == {'value': 'new'}
+    assert _keys(path) == sorted(store.keys())
+
+
+def test_caches_of_a_path_share_their_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(SegmentStore, 'COMPACTION_MIN_BYTES', 0)
+    path = str(tmp_path / 'cache.seg')
+    first, second = Cache(path), Cache(path)
+    first.set_value('a', 1)
+    assert second.get_value('a') == 1
+    for n in range(5):
+        second.set_value('a', n)  # overwrites compact the store
+    assert first.get_value('a') == 4
+    assert get_segment_store(path) is first._segments()
@@ -0,0 +1,28 @@
+"""Tests of the per-repository commit index."""
+
+import subprocess
+
+from maintainability.commit_index import CommitIndex
+
+
+def _commit(path, message):
+    subprocess.run(['git', '-C', path, '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                    'commit', '--quiet', '--allow-empty', '-m', message], check=True)
+    return subprocess.run(['git', '-C', path, 'rev-parse', 'HEAD'], check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def test_update_after_partial_line(tmp_path):
+    path = str(tmp_path)
+    subprocess.run(['git', 'init', '--quiet', path], check=True)
+    first = _commit(path, 'first')
+    index = CommitIndex(path)
+    # interrupted update: the last line is partially written
+    with open(index.path, 'a') as index_file:
+        index_file.write('{"sha": "')
+    second = _commit(path, 'second')
+    index = CommitIndex(path)
+    assert index.shas() == [first, second]
+    reloaded = CommitIndex(path)
+    assert reloaded.shas() == [first, second]
+    assert reloaded._tips == index._tips
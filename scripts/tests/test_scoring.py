@@ -0,0 +1,32 @@
+"""Tests of the vectorized maintainability scores against the scalar functions."""
+
+import statistics
+
+import numpy as np
+
+from maintainability import better_code_hub as bch
+from maintainability.fake_services import generate_report
+
+
+def test_scores_are_identical_to_scalar_functions():
+    rng = np.random.default_rng(0)
+    reports = [generate_report(rng, '{:040x}'.format(n)) for n in range(5000)]
+    guidelines, scores, overall = bch.compute_maintainability_scores(reports)
+    for index, report in enumerate(reports):
+        assert overall[index] == bch.compute_maintainability_score(report)
+        per_guideline = bch.compute_maintainability_score_per_guideline(report)
+        for guideline, score in per_guideline.items():
+            assert scores[index, guidelines.index(guideline)] == score
+
+
+def test_masked_mean_is_rounded_like_statistics_mean():
+    rng = np.random.default_rng(1)
+    values = rng.standard_normal((20000, 7)) * 10.0 ** rng.integers(-8, 8, (20000, 7))
+    mask = rng.random(values.shape) < 0.8
+    mask[:, 0] = True
+    means = bch._masked_mean(values, mask)
+    for row, row_mask, row_mean in zip(values, mask, means):
+        assert row_mean == statistics.mean(row[row_mask])
+    cancelling = np.array([[1e16, 1.0, -1e16], [0.1, 0.2, 0.3]])
+    assert list(bch._masked_mean(cancelling, np.ones(cancelling.shape, dtype=bool))) == \
+        [statistics.mean([1e16, 1.0, -1e16]), statistics.mean([0.1, 0.2, 0.3])]
@@ -0,0 +1,109 @@
+"""Tests of the local analysis of unit guidelines."""
+
+import textwrap
+
+from maintainability.unit_metrics import Unit, get_units
+
+
+def _units(path, source):
+    return {unit.name: unit for unit in get_units(path, textwrap.dedent(source))}
+
+
+def test_python_docstrings_are_not_code():
+    units = _units('module.py', '''
+        def area(width, height):
+            """Return the area.
+
+            Width and height are in meters.
+            """
+            return width * height
+
+        class Shape:
+            """A shape."""
+
+            def scale(self, factor):
+                """Scale the shape."""
+                if factor < 0:
+                    raise ValueError(factor)
+                self.factor = factor
+        ''')
+    assert units['area'] == Unit('area', 2, 1, 2)
+    assert units['scale'] == Unit('scale', 4, 2, 1)
+
+
+def test_python_nested_functions_are_separate_units():
+    units = _units('module.py', '''
+        def outer(items):
+            def inner(item):
+                return item and item.valid
+            return [item for item in items if inner(item)]
+        ''')
+    assert units['outer'] == Unit('outer', 2, 3, 1)
+    assert units['inner'] == Unit('inner', 2, 2, 1)
+
+
+def test_java_anonymous_class_methods_are_separate_units():
+    units = get_units('Worker.java', textwrap.dedent('''
+        class Worker {
+            public void run(int retries) throws IOException {
+                Runnable task = new Runnable() {
+                    public void run() {
+                        if (ready) {
+                            work();
+                        }
+                    }
+                };
+                for (int i = 0; i < retries; i++) {
+                    task.run();
+                }
+            }
+        }
+        '''))
+    assert units == [Unit('run', 7, 2, 1), Unit('run', 5, 2, 0)]
+
+
+def test_go_functions_with_several_results():
+    units = _units('name.go', '''
+        func (r *Repo) Name(a int, b string) (int, error) {
+            if a > 0 && b != "" {
+                return a, nil
+            }
+            return 0, errors.New("no name")
+        }
+
+        func main() {
+            handler := func(w int) {
+                fmt.Println(w)
+            }
+            handler(1)
+        }
+        ''')
+    assert sorted(units) == ['Name', 'main']
+    assert units['Name'] == Unit('Name', 6, 3, 2)
+    assert units['main'] == Unit('main', 6, 1, 0)
+
+
+def test_c_comments_and_strings_are_ignored():
+    units = _units('main.c', '''
+        /* if (a) { b(); } */
+        static int parse(const char *text, size_t size)
+        {
+            // while (1) { }
+            puts("if (x) {");
+            return size > 0 ? 1 : 0;
+        }
+        ''')
+    assert units == {'parse': Unit('parse', 5, 2, 2)}
+
+
+def test_javascript_object_methods():
+    units = _units('app.js', '''
+        const api = {
+            fetch(url, options) {
+                return request(url, options).then(function (response) {
+                    return response.ok || retry(url);
+                });
+            },
+        };
+        ''')
+    assert units == {'fetch': Unit('fetch', 5, 2, 2)}